@@ -2,27 +2,77 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import datetime as dt
+import importlib.util
+import os
+from functools import partial
 import plotly.express as px
 import plotly.graph_objects as go
 
 # Importation fonctions utils
-from utils import load_and_prepare_data, apply_filters, calculate_rfm, calculate_cohort_retention, calculate_clv_formula, run_scenario_simulation
+from utils import calculate_clv_formula, run_scenario_simulation, simulate_scenario_grid, segment_monetary_summary, segment_stats, sales_trend, GLOBAL_SCENARIO, COHORT_FREQS
+
+from backends import open_backend, ENGINE_ENV, DEFAULT_ENGINE
+from clv import calculate_probabilistic_clv
+from parallel import calculate_rfm_parallel, safe_start_method
+from sketches import DEFAULT_RELATIVE_ACCURACY, calculate_rfm_sketch
+from timeline import snapshot_dates, segment_migrations, transition_matrix, MIGRATION_STATES
+from memo import ComputationGraph
+from profiling import PROFILER
+from plotting import (DEFAULT_POINT_BUDGET, HEATMAP_TEXT_BUDGET, SCATTER_MODES, payload_caption, resolve_scatter_mode,
+                      stratified_sample, binned_scatter, segment_legend_labels)
+from exports import EXPORT_FORMATS, EXPORT_FORMAT_LABELS, ZIP_MIME, spool_export, spool_zip, export_parts, export_by_priority
 
 # --- CONFIGURATION PAGE ---
 st.set_page_config(page_title="Marketing Decision Tool", layout="wide", page_icon="🎯")
+# Instrumentation des étapes (panneau Performance) : numérote le rerun, sans coût si désactivée
+perf_run = PROFILER.begin_run()
 
 # --- CHARGEMENT DONNÉES ---
-@st.cache_data
-def get_data():
-    return load_and_prepare_data('app/data/processed.csv')
+DATA_PATH = 'app/data/processed.csv'
+RFM_MODES = {'exact': 'Exact', 'parallel': 'Exact multi-processus', 'sketch': 'Approché (sketchs de quantiles)'}
+# Moteur de requête : 'pandas' (tout en mémoire), 'arrow' ou 'duckdb' (requêtes sur un jeu Parquet, hors mémoire)
+ENGINE = os.environ.get(ENGINE_ENV, DEFAULT_ENGINE)
+
+@st.cache_resource
+def get_backend():
+    # Chargé une seule fois et partagé : en pandas, transactions + cube facture (les filtres n'y relisent pas les lignes)
+    return open_backend(ENGINE, DATA_PATH)
+
+@st.cache_resource
+def get_graph():
+    # Cache des étapes (filtres, RFM, cohortes...) partagé entre reruns, indexé par les paramètres amont
+    return ComputationGraph()
+
+# --- FIGURES & EXPORTS À LA DEMANDE ---
+def segment_treemap(df_rfm):
+    rfm_counts = df_rfm['Segment_RFM'].value_counts().reset_index()
+    rfm_counts.columns = ['Segment', 'Count']
+    # Segment_RFM est catégoriel : on retire les segments absents du périmètre
+    rfm_counts = rfm_counts[rfm_counts['Count'] > 0]
+    return px.treemap(rfm_counts, path=['Segment'], values='Count', 
+                      title="Poids des Segments (Volume)", color='Count', color_continuous_scale='RdBu')
+
+def transactions_export(graph, backend, filters, fmt, part_rows):
+    # Seul l'export détaillé a besoin des lignes de facture : filtrées (mémoïsées) puis écrites au clic
+    df_lines = graph.stage('filter_lines', backend.apply_filters, filters).value.drop(columns=['InvoiceCode'])
+    if part_rows and len(df_lines) > part_rows:
+        return spool_zip(partial(export_parts, df_lines, stem='transactions_filtered', fmt=fmt, part_rows=part_rows))
+    return spool_export(df_lines, fmt)
+
+def treemap_png(df_rfm):
+    return segment_treemap(df_rfm).to_image(format="png")
+
+def configure_profiler():
+    PROFILER.configure(st.session_state['perf_enabled'], st.session_state.get('perf_memory', True))
 
 try:
-    df_raw = get_data()
+    backend = get_backend()
+    data_meta = backend.metadata()
 except Exception as e:
     st.error("Impossible de charger les données. Vérifiez l'emplacement de 'data/data_clean.csv'.")
     st.stop()
 
-if df_raw.empty:
+if not data_meta['rows']:
     st.error("Le fichier de données est vide ou invalide.")
     st.stop()
 
@@ -31,7 +81,7 @@ with st.sidebar:
     st.header("⚙️ Paramètres & Filtres")
     
     # 1. Période
-    min_d, max_d = df_raw['TransactionDate'].min(), df_raw['TransactionDate'].max()
+    min_d, max_d = data_meta['min_date'], data_meta['max_date']
     date_range = st.date_input("Période d'analyse", value=(min_d, max_d), min_value=min_d, max_value=max_d)
     start_date, end_date = date_range if len(date_range) == 2 else (min_d, max_d)
     
@@ -39,7 +89,7 @@ with st.sidebar:
     time_unit = st.selectbox("Unité de temps (Tendances)", ["Mois", "Trimestre"])
     
     # 3. Pays
-    countries = ['Global'] + sorted(df_raw['Country'].unique().tolist())
+    countries = ['Global'] + data_meta['countries']
     country = st.selectbox("Pays", countries)
     
     # 4. Mode Retours
@@ -49,8 +99,30 @@ with st.sidebar:
     # 5. Seuil Commande
     min_order = st.slider("Seuil minimum commande (£)", 0, 500, 0, step=10)
 
+    # Calcul RFM : moteur de requête (exact), agrégation client multi-processus sur le cube (même résultat)
+    # ou quintiles lus dans des histogrammes / sketchs (sans tri des clients)
+    rfm_mode = st.selectbox("Calcul RFM", list(RFM_MODES), format_func=RFM_MODES.get,
+                            help="Multi-processus : agrégation client répartie sur les CPU, utile au-delà du million de clients. "
+                                 "Approché : scores R et F exacts ; seuils Monetary à la précision choisie, "
+                                 "environ 1 % des M_Score décalés d'un cran à 1 %.")
+    # Toujours affiché (grisé hors mode approché) pour garder la valeur d'un changement de mode à l'autre
+    sketch_accuracy = st.select_slider("Précision des seuils Monetary (mode approché)", [0.001, 0.005, 0.01, 0.02, 0.05],
+                                       value=DEFAULT_RELATIVE_ACCURACY, format_func=lambda a: f"{a:.1%}",
+                                       disabled=rfm_mode != 'sketch')
+    
+    # 6. Hypothèses CLV (partagées par la Vue d'ensemble, la Segmentation et les Exports)
+    with st.expander("🔮 Hypothèses CLV (Formule fermée)", expanded=True):
+        h_margin = st.slider("Marge (%)", 0.05, 0.80, 0.30, 0.05)
+        h_retention = st.slider("Taux Rétention (r)", 0.1, 0.95, 0.60, 0.05)
+        h_discount = st.slider("Taux Actualisation (d)", 0.01, 0.30, 0.10, 0.01)
+
 # --- APPLICATION FILTRES & SÉCURITÉS (A) ---
-df_filtered = apply_filters(df_raw, start_date, end_date, country, returns_mode, min_order)
+graph = get_graph()
+filters = (start_date, end_date, country, returns_mode, min_order)
+
+# df_filtered est au grain facture (cube) : mêmes colonnes et mêmes totaux que les lignes filtrées
+filtered_node = graph.stage('filter', backend.invoice_cube, filters)
+df_filtered = filtered_node.value
 analysis_date = pd.to_datetime(end_date) + dt.timedelta(days=1)
 
 if df_filtered.empty:
@@ -58,15 +130,20 @@ if df_filtered.empty:
     st.stop()
 
 # Calculs RFM
-df_rfm = calculate_rfm(df_filtered, analysis_date)
+if rfm_mode == 'parallel':
+    # Streamlit exécute le script dans un thread : pas de fork ; petits cubes traités sans processus
+    rfm_node = graph.stage('rfm_parallel', calculate_rfm_parallel, filtered_node, analysis_date,
+                           mp_context=safe_start_method())
+elif rfm_mode == 'sketch':
+    rfm_node = graph.stage('rfm_sketch', calculate_rfm_sketch, filtered_node, analysis_date, sketch_accuracy)
+else:
+    rfm_node = graph.stage('rfm', backend.calculate_rfm, filters, analysis_date)
+df_rfm = rfm_node.value
 
 if df_rfm.empty:
     st.warning("⚠️ Aucune donnée client valide après filtrage (ex: Clients avec TotalSales <= 0 exclus).")
     st.stop()
 
-# Calculs Cohortes
-retention_matrix, arpu_matrix, cohort_sizes = calculate_cohort_retention(df_filtered)
-
 # --- BANDEAU FILTRES ACTIFS ---
 active_filters_text = f"**Filtres actifs :** 🗓️ {start_date} à {end_date} | 🌍 {country} | 🔄 {returns_mode} | 🛒 Min £{min_order}"
 if returns_mode == "Exclure":
@@ -74,249 +151,415 @@ if returns_mode == "Exclure":
 st.info(active_filters_text)
 
 # --- NAVIGATION ---
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
+# Onglets paresseux : seul l'onglet ouvert (tab.open) est calculé à chaque rerun
+# Les widgets d'un onglet fermé ne sont pas rendus, et Streamlit efface leur état en fin de rerun :
+# réassigner leur clé à chaque rerun la conserve (réglages retrouvés au retour sur l'onglet).
+# Les valeurs initiales passent par st.session_state, et non par `value=`, qui ferait doublon avec elle.
+TAB_WIDGET_DEFAULTS = {
+    'point_budget': DEFAULT_POINT_BUDGET,
+    'sim_m': 0.3, 'sim_r': 0.6, 'sim_d': 0.1, 'sim_disc_pct': 0.0,
+    'export_proba_clv': False, 'clv_horizon': 12, 'clv_draws': 0, 'export_part_rows': 0,
+}
+TAB_WIDGET_KEYS = [
+    'cohort_freq', 'target_cohort',
+    'scatter_mode', 'point_budget',
+    'migration_freq', 'migration_period', 'migration_values',
+    'sim_m', 'sim_r', 'sim_d', 'sim_disc_mode', 'sim_target_seg', 'sim_disc_pct', 'heat_target',
+    'export_proba_clv', 'clv_horizon', 'clv_draws', 'export_fmt', 'export_split', 'export_part_rows',
+]
+for widget_key in TAB_WIDGET_KEYS:
+    if widget_key in st.session_state:
+        st.session_state[widget_key] = st.session_state[widget_key]
+    elif widget_key in TAB_WIDGET_DEFAULTS:
+        st.session_state[widget_key] = TAB_WIDGET_DEFAULTS[widget_key]
+
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "📈 Vue d'ensemble", 
     "📅 Cohortes & Rétention", 
     "👥 Segmentation RFM", 
+    "🔀 Migrations de segments",
     "🧪 Simulateur",
     "⬇️ Exports"
-])
+], key='onglet', on_change='rerun')
 
 # ================= TAB 1 : VUE D'ENSEMBLE =================
 with tab1:
-    st.markdown("### KPIs Clés")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    nb_clients = df_rfm['CustomerID'].nunique()
-    ca_total = df_rfm['Monetary'].sum()
-    nb_invoices = df_filtered['InvoiceNo'].nunique()
-    panier_moyen = ca_total / nb_invoices if nb_invoices > 0 else 0
-    clv_empirique = df_rfm['Monetary'].mean()
+    if tab1.open:
+        with PROFILER.span("Onglet Vue d'ensemble", rows_in=len(df_filtered)):
+            st.markdown("### KPIs Clés")
+    
+            col1, col2, col3, col4 = st.columns(4)
+    
+            nb_clients = df_rfm['CustomerID'].nunique()
+            ca_total = df_rfm['Monetary'].sum()
+            nb_invoices = df_filtered['InvoiceNo'].nunique()
+            panier_moyen = ca_total / nb_invoices if nb_invoices > 0 else 0
+            clv_empirique = df_rfm['Monetary'].mean()
+    
+            col1.metric("Clients Actifs", f"{nb_clients:,}", help="Nombre de clients uniques ayant acheté sur la période.")
+            col2.metric("Chiffre d'Affaires", f"£ {ca_total:,.0f}", help="Somme des ventes filtrées (£).")
+            col3.metric("Panier Moyen", f"£ {panier_moyen:.2f}", help="CA Total / Nombre de Factures.")
+            col4.metric("CLV Moyenne (Empirique)", f"£ {clv_empirique:.2f}", help="CA Total / Nombre de Clients Uniques.")
+
+            st.markdown("---")
     
-    col1.metric("Clients Actifs", f"{nb_clients:,}", help="Nombre de clients uniques ayant acheté sur la période.")
-    col2.metric("Chiffre d'Affaires", f"£ {ca_total:,.0f}", help="Somme des ventes filtrées (£).")
-    col3.metric("Panier Moyen", f"£ {panier_moyen:.2f}", help="CA Total / Nombre de Factures.")
-    col4.metric("CLV Moyenne (Empirique)", f"£ {clv_empirique:.2f}", help="CA Total / Nombre de Clients Uniques.")
+            # Hypothèses saisies dans la barre latérale
+            # (D) calculate_clv_formula gère désormais proprement les scalaires
+            clv_formula = calculate_clv_formula(clv_empirique, h_retention, h_discount, h_margin)
+            st.metric("CLV Projetée (Formule)", f"£ {clv_formula:.2f}",
+                      help=f"Marge {h_margin:.0%}, Rétention r = {h_retention:.2f}, Actualisation d = {h_discount:.2f}")
 
-    st.markdown("---")
+            st.markdown(f"### 📉 Évolution du CA ({time_unit})")
+            freq = 'Q' if time_unit == "Trimestre" else 'M'
     
-    with st.expander("🔮 Hypothèses CLV (Formule fermée)", expanded=True):
-        hc1, hc2, hc3, hc4 = st.columns(4)
-        h_margin = hc1.slider("Marge (%)", 0.05, 0.80, 0.30, 0.05)
-        h_retention = hc2.slider("Taux Rétention (r)", 0.1, 0.95, 0.60, 0.05)
-        h_discount = hc3.slider("Taux Actualisation (d)", 0.01, 0.30, 0.10, 0.01)
-        
-        # (D) calculate_clv_formula gère désormais proprement les scalaires
-        clv_formula = calculate_clv_formula(clv_empirique, h_retention, h_discount, h_margin)
-        hc4.metric("CLV Projetée (Formule)", f"£ {clv_formula:.2f}")
-
-    st.markdown(f"### 📉 Évolution du CA ({time_unit})")
-    freq = 'Q' if time_unit == "Trimestre" else 'M'
-    
-    # Check si df_trend a des données
-    if not df_filtered.empty:
-        df_trend = df_filtered.set_index('TransactionDate').resample(freq)['TotalSales'].sum().reset_index()
-        trend_counts = df_filtered.set_index('TransactionDate').resample(freq)['InvoiceNo'].nunique().reset_index()
-        df_trend['InvoiceCount'] = trend_counts['InvoiceNo'].values
+            # Check si df_trend a des données
+            if not df_filtered.empty:
+                df_trend = graph.stage('trend', sales_trend, filtered_node, freq).value
         
-        fig_trend = px.line(df_trend, x='TransactionDate', y='TotalSales', markers=True, 
-                            hover_data=['InvoiceCount'], title=f"CA par {time_unit}")
-        st.plotly_chart(fig_trend, use_container_width=True)
-    else:
-        st.info("Pas de données pour le graphique de tendance.")
+                fig_trend = px.line(df_trend, x='TransactionDate', y='TotalSales', markers=True, 
+                                    hover_data=['InvoiceCount'], title=f"CA par {time_unit}")
+                st.plotly_chart(fig_trend, use_container_width=True)
+                st.caption(payload_caption(fig_trend, len(df_trend)))
+            else:
+                st.info("Pas de données pour le graphique de tendance.")
 
 # ================= TAB 2 : COHORTES =================
 with tab2:
-    st.markdown("### Analyse de la Dynamique de Cohorte")
-    
-    # (B) Robustesse : Si matrices vides, on affiche un message
-    if retention_matrix.empty or arpu_matrix.empty:
-        st.info("⚠️ Pas assez de données pour calculer les cohortes sur ce périmètre (peut-être une période trop courte ou filtre trop restrictif).")
-    else:
-        cohort_list = ["Toutes"] + retention_matrix.index.tolist()
-        target_cohort = st.selectbox("Cohorte à analyser", cohort_list)
+    if tab2.open:
+        with PROFILER.span("Onglet Cohortes", rows_in=len(df_filtered)):
+            st.markdown("### Analyse de la Dynamique de Cohorte")
+    
+            # Granularité des cohortes (Mois / Semaine / Trimestre)
+            cohort_freq = st.selectbox("Granularité des cohortes", list(COHORT_FREQS), format_func=COHORT_FREQS.get,
+                                       key='cohort_freq')
+            age_label = f"{COHORT_FREQS[cohort_freq]} (Index)"
+    
+            # Calculs Cohortes
+            retention_matrix, arpu_matrix, cohort_sizes = graph.stage('cohorts', backend.calculate_cohort_retention, filters, cohort_freq).value
+    
+            # (B) Robustesse : Si matrices vides, on affiche un message
+            if retention_matrix.empty or arpu_matrix.empty:
+                st.info("⚠️ Pas assez de données pour calculer les cohortes sur ce périmètre (peut-être une période trop courte ou filtre trop restrictif).")
+            else:
+                cohort_list = ["Toutes"] + retention_matrix.index.tolist()
+                target_cohort = st.selectbox("Cohorte à analyser", cohort_list, key='target_cohort')
         
-        if target_cohort == "Toutes":
-            st.subheader("Heatmap de Rétention (%)")
-            fig_hm = px.imshow(retention_matrix, text_auto=".1f", aspect="auto", color_continuous_scale="Blues",
-                               labels=dict(x="Mois (Index)", y="Cohorte", color="Rétention %"))
-            fig_hm.update_xaxes(side="top")
-            st.plotly_chart(fig_hm, use_container_width=True)
+                if target_cohort == "Toutes":
+                    st.subheader("Heatmap de Rétention (%)")
+                    # Valeurs écrites dans les cases seulement sous le budget (ex. cohortes hebdomadaires : > 10 000 cases)
+                    show_values = retention_matrix.size <= HEATMAP_TEXT_BUDGET
+                    fig_hm = px.imshow(retention_matrix, text_auto=".1f" if show_values else False, aspect="auto",
+                                       color_continuous_scale="Blues",
+                                       labels=dict(x=age_label, y="Cohorte", color="Rétention %"))
+                    fig_hm.update_xaxes(side="top")
+                    st.plotly_chart(fig_hm, use_container_width=True)
+                    st.caption(payload_caption(fig_hm, retention_matrix.size))
             
-            st.subheader("Courbes de Valeur (CA Moyen Cumulé par Client)")
-            # (C) Robustesse : melt sur données existantes
-            arpu_long = arpu_matrix.reset_index().melt(id_vars='CohortMonth', var_name='Index', value_name='ARPU')
-            fig_arpu = px.line(arpu_long, x='Index', y='ARPU', color='CohortMonth', 
-                               title="CA Moyen par Client par âge de cohorte")
-            st.plotly_chart(fig_arpu, use_container_width=True)
+                    st.subheader("Courbes de Valeur (CA Moyen Cumulé par Client)")
+                    # (C) Robustesse : melt sur données existantes
+                    cohort_col = arpu_matrix.index.name
+                    arpu_long = arpu_matrix.reset_index().melt(id_vars=cohort_col, var_name='Index', value_name='ARPU')
+                    fig_arpu = px.line(arpu_long, x='Index', y='ARPU', color=cohort_col, 
+                                       title="CA Moyen par Client par âge de cohorte")
+                    st.plotly_chart(fig_arpu, use_container_width=True)
+                    st.caption(payload_caption(fig_arpu, len(arpu_long)))
             
-            st.markdown("**Tailles initiales des cohortes (n)**")
-            st.dataframe(cohort_sizes.to_frame().T)
+                    st.markdown("**Tailles initiales des cohortes (n)**")
+                    st.dataframe(cohort_sizes.to_frame().T)
             
-        else:
-            st.subheader(f"Focus : Cohorte {target_cohort}")
-            # Sécurité si la cohorte n'existe pas dans l'index (rare mais possible)
-            if target_cohort in cohort_sizes.index:
-                n_init = cohort_sizes.loc[target_cohort]
-                st.metric("Taille Initiale (M+0)", f"{n_init} clients")
+                else:
+                    st.subheader(f"Focus : Cohorte {target_cohort}")
+                    # Sécurité si la cohorte n'existe pas dans l'index (rare mais possible)
+                    if target_cohort in cohort_sizes.index:
+                        n_init = cohort_sizes.loc[target_cohort]
+                        st.metric("Taille Initiale (M+0)", f"{n_init:.0f} clients")
                 
-                col_f1, col_f2 = st.columns(2)
+                        col_f1, col_f2 = st.columns(2)
                 
-                ret_data = retention_matrix.loc[target_cohort]
-                fig_ret = px.line(x=ret_data.index, y=ret_data.values, markers=True, 
-                                  labels={'x':'Mois (Index)', 'y':'Rétention %'}, title="Courbe de Rétention")
-                col_f1.plotly_chart(fig_ret, use_container_width=True)
+                        ret_data = retention_matrix.loc[target_cohort]
+                        fig_ret = px.line(x=ret_data.index, y=ret_data.values, markers=True, 
+                                          labels={'x':age_label, 'y':'Rétention %'}, title="Courbe de Rétention")
+                        col_f1.plotly_chart(fig_ret, use_container_width=True)
                 
-                rev_data = arpu_matrix.loc[target_cohort]
-                fig_rev = px.bar(x=rev_data.index, y=rev_data.values, 
-                                 labels={'x':'Mois (Index)', 'y':'CA Moyen (£)'}, title="CA Moyen par Client (ARPU)")
-                col_f2.plotly_chart(fig_rev, use_container_width=True)
+                        rev_data = arpu_matrix.loc[target_cohort]
+                        fig_rev = px.bar(x=rev_data.index, y=rev_data.values, 
+                                         labels={'x':age_label, 'y':'CA Moyen (£)'}, title="CA Moyen par Client (ARPU)")
+                        col_f2.plotly_chart(fig_rev, use_container_width=True)
 
 # ================= TAB 3 : RFM =================
 with tab3:
-    st.subheader("Segmentation & Priorisation CRM")
-    
-    # (E) Robustesse Table RFM
-    # On construit le dictionnaire d'aggrégation dynamiquement pour éviter les KeyError
-    agg_dict = {
-        'CustomerID': 'count',
-        'Monetary': ['sum', 'mean'],
-        'Recency': 'mean'
-    }
-    # On ajoute Priorité_CRM seulement si elle existe
-    if 'Priorité_CRM' in df_rfm.columns:
-        agg_dict['Priorité_CRM'] = 'first'
-    
-    rfm_stats = df_rfm.groupby('Segment_RFM').agg(agg_dict).round(1)
-    
-    # Aplatir les colonnes MultiIndex proprement
-    # Les colonnes seront [CustomerID, Monetary_sum, Monetary_mean, Recency, Priorité_CRM] dans l'ordre
-    rfm_stats.columns = ['_'.join(col).strip() if col[1] else col[0] for col in rfm_stats.columns.values]
-    
-    # Renommage explicite pour affichage
-    rename_map = {
-        'CustomerID_count': 'Nb Clients',
-        'Monetary_sum': 'CA Total',
-        'Monetary_mean': 'CA Moyen',
-        'Recency_mean': 'Récence Moy',
-        'Priorité_CRM_first': 'Priorité'
-    }
-    # Nettoyage si Priorité n'existe pas
-    if 'Priorité_CRM' not in df_rfm.columns:
-        rename_map.pop('Priorité_CRM_first', None)
-        
-    rfm_stats = rfm_stats.rename(columns=rename_map)
-    
-    # Calcul CLV Formule par segment (Series)
-    rfm_stats['CLV Estimée (Formule)'] = calculate_clv_formula(rfm_stats['CA Moyen'], h_retention, h_discount, h_margin)
-    
-    # Tri sécurisé
-    sort_col = 'Priorité' if 'Priorité' in rfm_stats.columns else 'CA Total'
-    st.dataframe(rfm_stats.sort_values(sort_col), use_container_width=True)
-    
-    # Visualisations
-    col_v1, col_v2 = st.columns(2)
-    
-    rfm_counts = df_rfm['Segment_RFM'].value_counts().reset_index()
-    rfm_counts.columns = ['Segment', 'Count']
-    # Variable fig_tree stockée pour l'export plus tard
-    fig_tree = px.treemap(rfm_counts, path=['Segment'], values='Count', 
-                          title="Poids des Segments (Volume)", color='Count', color_continuous_scale='RdBu')
-    col_v1.plotly_chart(fig_tree, use_container_width=True)
-    
-    fig_scatter = px.scatter(df_rfm, x='Recency', y='Frequency', color='Segment_RFM', 
-                             size='Monetary', size_max=40, opacity=0.6,
-                             hover_data=['CustomerID', 'Monetary'],
-                             title="Carte Récence vs Fréquence")
-    col_v2.plotly_chart(fig_scatter, use_container_width=True)
-
-# ================= TAB 4 : SIMULATEUR =================
+    if tab3.open:
+        with PROFILER.span("Onglet Segmentation RFM", rows_in=len(df_filtered)):
+            st.subheader("Segmentation & Priorisation CRM")
+    
+            # (E) Robustesse Table RFM (synthèse mémoïsée, copiée avant d'y ajouter la CLV)
+            rfm_stats = graph.stage('segment_stats', segment_stats, rfm_node).value.copy()
+    
+            # Calcul CLV Formule par segment (Series)
+            rfm_stats['CLV Estimée (Formule)'] = calculate_clv_formula(rfm_stats['CA Moyen'], h_retention, h_discount, h_margin)
+    
+            # Tri sécurisé
+            sort_col = 'Priorité' if 'Priorité' in rfm_stats.columns else 'CA Total'
+            st.dataframe(rfm_stats.sort_values(sort_col), use_container_width=True)
+    
+            # Visualisations
+            col_v1, col_v2 = st.columns(2)
+    
+            fig_tree = segment_treemap(df_rfm)
+            col_v1.plotly_chart(fig_tree, use_container_width=True)
+            col_v1.caption(payload_caption(fig_tree))
+    
+            # Carte Récence vs Fréquence sous budget de points : échantillon stratifié par segment ou histogramme 2D
+            sc1, sc2 = col_v2.columns(2)
+            scatter_mode = sc1.selectbox("Rendu du nuage", list(SCATTER_MODES), format_func=SCATTER_MODES.get,
+                                         key='scatter_mode')
+            point_budget = sc2.select_slider("Budget de points", [5_000, 10_000, 20_000, 50_000, 100_000],
+                                             key='point_budget')
+            mode_used = resolve_scatter_mode(len(df_rfm), point_budget, scatter_mode)
+            if mode_used == 'bins':
+                df_bins = graph.stage('scatter_bins', binned_scatter, rfm_node, 'Recency', 'Frequency', 'Segment_RFM', 'Monetary').value
+                fig_scatter = px.scatter(df_bins, x='Recency', y='Frequency', color='Segment_RFM',
+                                         size='Clients', size_max=40, opacity=0.6,
+                                         hover_data={'Clients': ':,', 'Monetary_Total': ':,.0f', 'Monetary_Moyen': ':,.2f'},
+                                         title="Carte Récence vs Fréquence (histogramme 2D)")
+                n_points = len(df_bins)
+            else:
+                df_points = df_rfm if mode_used == 'points' else \
+                    graph.stage('scatter_sample', stratified_sample, rfm_node, 'Segment_RFM', point_budget).value
+                fig_scatter = px.scatter(df_points, x='Recency', y='Frequency', color='Segment_RFM', 
+                                         size='Monetary', size_max=40, opacity=0.6,
+                                         hover_data=['CustomerID', 'Monetary'],
+                                         title="Carte Récence vs Fréquence")
+                n_points = len(df_points)
+            # Légende : effectifs et CA exacts sur tous les clients, quel que soit le rendu
+            legend_labels = segment_legend_labels(df_rfm, 'Segment_RFM', 'Monetary')
+            fig_scatter.for_each_trace(lambda trace: trace.update(name=legend_labels.get(trace.name, trace.name)))
+            col_v2.plotly_chart(fig_scatter, use_container_width=True)
+            col_v2.caption(f"{payload_caption(fig_scatter, n_points)} · {SCATTER_MODES[mode_used]} ({len(df_rfm):,} clients)")
+
+# ================= TAB 4 : MIGRATIONS DE SEGMENTS =================
 with tab4:
-    st.subheader("Simulateur de Scénarios Marketing")
-    
-    col_s1, col_s2 = st.columns(2)
-    with col_s1:
-        st.markdown("**Paramètres Structurels**")
-        sim_margin = st.slider("Marge Brute (%) ", 0.05, 0.8, 0.3, 0.01, key='sim_m')
-        sim_retention = st.slider("Taux Rétention (r)", 0.1, 0.95, 0.6, 0.01, key='sim_r')
-        sim_discount = st.number_input("Taux Actualisation (d)", 0.01, 0.5, 0.1, key='sim_d')
+    if tab4.open:
+        with PROFILER.span("Onglet Migrations", rows_in=len(df_filtered)):
+            st.subheader("Migrations entre segments RFM")
+            st.caption("RFM recalculé à chaque instantané (début de période) sur l'historique depuis le début du filtre ; "
+                       "le dernier instantané est la date d'analyse de l'onglet Segmentation.")
+
+            migration_freq = st.selectbox("Fréquence des instantanés", list(COHORT_FREQS), format_func=COHORT_FREQS.get,
+                                          key='migration_freq')
+            dates = tuple(snapshot_dates(start_date, end_date, migration_freq))
+            segment_counts, transitions = graph.stage('migrations', segment_migrations, filtered_node, dates).value
+
+            if len(dates) < 2:
+                st.info("⚠️ Période trop courte : au moins deux instantanés sont nécessaires pour observer des migrations.")
+            else:
+                # Évolution des effectifs par segment
+                counts_long = segment_counts.loc[:, segment_counts.sum() > 0].reset_index().melt(
+                    id_vars='Snapshot', var_name='Segment', value_name='Clients')
+                fig_counts = px.area(counts_long, x='Snapshot', y='Clients', color='Segment',
+                                     title="Clients par segment à chaque instantané")
+                st.plotly_chart(fig_counts, use_container_width=True)
+                st.caption(payload_caption(fig_counts, len(counts_long)))
+
+                # Matrice de transition : une période (instantanés consécutifs) ou cumul sur toute la plage
+                periods = {f"{pd.Timestamp(begin):%Y-%m-%d} → {pd.Timestamp(end):%Y-%m-%d}": [end]
+                           for begin, end in zip(dates[:-1], dates[1:])}
+                periods = dict(reversed(periods.items()))  # période la plus récente en premier
+                periods["Toutes les périodes (cumul)"] = None
+                mc1, mc2 = st.columns([3, 1])
+                period = mc1.selectbox("Période de transition", list(periods), key='migration_period')
+                as_share = mc2.radio("Valeurs", ["% de la ligne", "Clients"], key='migration_values') == "% de la ligne"
+                selection = periods[period]
+                flows = transition_matrix(transitions, selection)
+                matrix = transition_matrix(transitions, selection, normalize=True) if as_share else flows
+                # États jamais observés sur la sélection retirés des deux axes
+                observed = [state for state in MIGRATION_STATES if flows.loc[state].sum() + flows[state].sum() > 0]
+                matrix = matrix.loc[observed, observed]
+                fig_mig = px.imshow(matrix, text_auto=".1f" if as_share else ",.0f", aspect="auto",
+                                    color_continuous_scale="Blues",
+                                    labels=dict(x="Segment d'arrivée", y="Segment de départ",
+                                                color="% de la ligne" if as_share else "Clients"))
+                fig_mig.update_xaxes(side="top")
+                st.plotly_chart(fig_mig, use_container_width=True)
+                st.caption(f"{payload_caption(fig_mig, matrix.size)} · « Hors base » : pas encore client "
+                           "ou CA cumulé ≤ 0 à l'instantané")
+
+# ================= TAB 5 : SIMULATEUR =================
+with tab5:
+    if tab5.open:
+        with PROFILER.span("Onglet Simulateur", rows_in=len(df_filtered)):
+            st.subheader("Simulateur de Scénarios Marketing")
+    
+            col_s1, col_s2 = st.columns(2)
+            with col_s1:
+                st.markdown("**Paramètres Structurels**")
+                sim_margin = st.slider("Marge Brute (%) ", 0.05, 0.8, step=0.01, key='sim_m')
+                sim_retention = st.slider("Taux Rétention (r)", 0.1, 0.95, step=0.01, key='sim_r')
+                sim_discount = st.number_input("Taux Actualisation (d)", 0.01, 0.5, key='sim_d')
         
-    with col_s2:
-        st.markdown("**Levier Commercial (Remise)**")
-        disc_mode = st.selectbox("Mode de remise", ["Globale (tous les clients)", "Par segment RFM (simple)"])
+            with col_s2:
+                st.markdown("**Levier Commercial (Remise)**")
+                disc_mode = st.selectbox("Mode de remise", ["Globale (tous les clients)", "Par segment RFM (simple)"],
+                                         key='sim_disc_mode')
         
-        target_seg = None
-        if disc_mode == "Par segment RFM (simple)":
-            target_seg = st.selectbox("Segment Cible", df_rfm['Segment_RFM'].unique())
+                target_seg = None
+                if disc_mode == "Par segment RFM (simple)":
+                    target_seg = st.selectbox("Segment Cible", df_rfm['Segment_RFM'].unique().tolist(), key='sim_target_seg')
             
-        sim_disc_pct = st.slider("Pourcentage de Remise (%)", 0.0, 0.5, 0.0, 0.01)
-
-    # Exécution Simulation
-    clv_sim, ca_sim = run_scenario_simulation(df_filtered, df_rfm, sim_retention, sim_discount, sim_margin, disc_mode, sim_disc_pct, target_seg)
-    
-    # Baseline
-    clv_base = calculate_clv_formula(df_rfm['Monetary'].mean(), sim_retention, sim_discount, sim_margin)
-    ca_base = df_rfm['Monetary'].sum()
-    
-    st.markdown("---")
-    res_c1, res_c2 = st.columns(2)
-    
-    fig_clv = go.Figure(data=[
-        go.Bar(name='Baseline', x=['CLV'], y=[clv_base], marker_color='lightgrey'),
-        go.Bar(name='Scénario', x=['CLV'], y=[clv_sim], marker_color='blue')
-    ])
-    fig_clv.update_layout(title="Impact CLV Moyenne (£)", barmode='group')
-    res_c1.plotly_chart(fig_clv, use_container_width=True)
-    res_c1.metric("Delta CLV", f"£ {clv_sim - clv_base:.2f}")
-
-    fig_ca = go.Figure(data=[
-        go.Bar(name='Baseline', x=['CA Total'], y=[ca_base], marker_color='lightgrey'),
-        go.Bar(name='Scénario', x=['CA Total'], y=[ca_sim], marker_color='green')
-    ])
-    fig_ca.update_layout(title="Impact CA Total (£)", barmode='group')
-    res_c2.plotly_chart(fig_ca, use_container_width=True)
-    res_c2.metric("Delta CA", f"£ {ca_sim - ca_base:,.0f}")
-    
-    st.markdown("#### Analyse de Sensibilité : CLV en fonction de la Rétention (r)")
-    r_values = np.linspace(0.3, 0.9, 20)
-    avg_monetary_for_curve = (ca_sim / len(df_rfm)) if len(df_rfm) > 0 else 0
-    sens_y = [calculate_clv_formula(avg_monetary_for_curve, r, sim_discount, sim_margin) for r in r_values]
-    
-    fig_sens = px.line(x=r_values, y=sens_y, labels={'x':'Taux Rétention (r)', 'y':'CLV (£)'}, markers=True)
-    fig_sens.add_vline(x=sim_retention, line_dash="dash", line_color="red", annotation_text="r choisi")
-    st.plotly_chart(fig_sens, use_container_width=True)
-
-# ================= TAB 5 : EXPORTS =================
-with tab5:
-    st.subheader("Exporter les Données et Plans d'Action")
-    
-    col_ex1, col_ex2 = st.columns(2)
-    
-    # Export RFM
-    df_export_rfm = df_rfm.copy()
-    # (D) calculate_clv_formula gère Series proprement
-    df_export_rfm['CLV_Formule'] = calculate_clv_formula(df_export_rfm['Monetary'], h_retention, h_discount, h_margin)
-    
-    csv_rfm = df_export_rfm.to_csv(index=False).encode('utf-8')
-    col_ex1.download_button("📥 Télécharger Liste Activable (RFM + CLV)", csv_rfm, 'plan_action_rfm.csv', 'text/csv')
-    
-    # Export Raw
-    csv_trans = df_filtered.to_csv(index=False).encode('utf-8')
-    col_ex2.download_button("📥 Télécharger Transactions Filtrées", csv_trans, 'transactions_filtered.csv', 'text/csv')
-    
-    st.markdown("---")
-    st.markdown("**Export des Graphiques**")
-    st.info("💡 Utilisez l'icône appareil photo sur les graphiques pour un PNG rapide.")
-    
-    # (F) Bouton Spécifique Treemap (Sécurisé)
-    # On vérifie si fig_tree est défini dans le scope local (il l'est si Tab 3 a été exécuté par le script)
-    # Streamlit exécute le script de haut en bas, donc fig_tree existe.
-    if 'fig_tree' in locals():
-        try:
-            # Fallback en cas d'absence de librairie graphique serveur (kaleido)
-            img_bytes = fig_tree.to_image(format="png")
-            st.download_button("📷 Télécharger Image Segments (Treemap)", img_bytes, "segments_treemap.png", "image/png")
-        except Exception as e:
-            # On n'affiche pas l'erreur complète à l'utilisateur, juste une info
-            st.caption("Le téléchargement direct bouton n'est pas disponible (librairie manquante). Utilisez l'icône caméra du graphique.")
\ No newline at end of file
+                sim_disc_pct = st.slider("Pourcentage de Remise (%)", 0.0, 0.5, step=0.01, key='sim_disc_pct')
+
+            # Exécution Simulation
+            clv_sim, ca_sim = run_scenario_simulation(df_filtered, df_rfm, sim_retention, sim_discount, sim_margin, disc_mode, sim_disc_pct, target_seg)
+    
+            # Baseline
+            clv_base = calculate_clv_formula(df_rfm['Monetary'].mean(), sim_retention, sim_discount, sim_margin)
+            ca_base = df_rfm['Monetary'].sum()
+    
+            st.markdown("---")
+            res_c1, res_c2 = st.columns(2)
+    
+            fig_clv = go.Figure(data=[
+                go.Bar(name='Baseline', x=['CLV'], y=[clv_base], marker_color='lightgrey'),
+                go.Bar(name='Scénario', x=['CLV'], y=[clv_sim], marker_color='blue')
+            ])
+            fig_clv.update_layout(title="Impact CLV Moyenne (£)", barmode='group')
+            res_c1.plotly_chart(fig_clv, use_container_width=True)
+            res_c1.metric("Delta CLV", f"£ {clv_sim - clv_base:.2f}")
+
+            fig_ca = go.Figure(data=[
+                go.Bar(name='Baseline', x=['CA Total'], y=[ca_base], marker_color='lightgrey'),
+                go.Bar(name='Scénario', x=['CA Total'], y=[ca_sim], marker_color='green')
+            ])
+            fig_ca.update_layout(title="Impact CA Total (£)", barmode='group')
+            res_c2.plotly_chart(fig_ca, use_container_width=True)
+            res_c2.metric("Delta CA", f"£ {ca_sim - ca_base:,.0f}")
+    
+            st.markdown("#### Analyse de Sensibilité : CLV en fonction de la Rétention (r)")
+            r_values = np.linspace(0.3, 0.9, 20)
+            # Une seule évaluation vectorisée pour toute la courbe (scénario courant)
+            sim_target = GLOBAL_SCENARIO if disc_mode == GLOBAL_SCENARIO else target_seg
+            seg_summary = graph.stage('segment_summary', segment_monetary_summary, rfm_node).value
+            sens_clv, _, _ = simulate_scenario_grid(df_rfm, r_values, sim_discount, sim_margin, sim_disc_pct,
+                                                    targets=[sim_target], summary=seg_summary)
+            sens_y = sens_clv[:, 0]
+    
+            fig_sens = px.line(x=r_values, y=sens_y, labels={'x':'Taux Rétention (r)', 'y':'CLV (£)'}, markers=True)
+            fig_sens.add_vline(x=sim_retention, line_dash="dash", line_color="red", annotation_text="r choisi")
+            st.plotly_chart(fig_sens, use_container_width=True)
+    
+            st.markdown("#### Carte de Sensibilité : Rétention (r) × Remise (%) par cible")
+            # Grille complète r × remise évaluée pour toutes les cibles en une diffusion NumPy
+            grid_r = np.round(np.linspace(0.3, 0.95, 66), 2)
+            grid_disc = np.round(np.linspace(0.0, 0.5, 51), 2)
+            mesh_r, mesh_disc = np.meshgrid(grid_r, grid_disc, indexing='ij')
+            grid_clv, grid_ca, grid_targets = simulate_scenario_grid(df_rfm, mesh_r, sim_discount, sim_margin, mesh_disc,
+                                                                     summary=seg_summary)
+            heat_target = st.selectbox("Cible de la remise", grid_targets, key='heat_target')
+            k = grid_targets.index(heat_target)
+            fig_grid = px.imshow(grid_clv[:, :, k], x=grid_disc, y=grid_r, aspect="auto", origin="lower",
+                                 color_continuous_scale="Viridis",
+                                 labels=dict(x="Remise (%)", y="Taux Rétention (r)", color="CLV (£)"))
+            fig_grid.update_traces(customdata=grid_ca[:, :, k],
+                                   hovertemplate="r=%{y}<br>Remise=%{x}<br>CLV=£%{z:.2f}<br>CA=£%{customdata:,.0f}<extra></extra>")
+            st.plotly_chart(fig_grid, use_container_width=True)
+            st.caption(f"{grid_clv.size:,} scénarios évalués ({len(grid_r)} × {len(grid_disc)} × {len(grid_targets)} cibles).")
+
+# ================= TAB 6 : EXPORTS =================
+with tab6:
+    if tab6.open:
+        with PROFILER.span("Onglet Exports", rows_in=len(df_filtered)):
+            st.subheader("Exporter les Données et Plans d'Action")
+    
+            col_ex1, col_ex2 = st.columns(2)
+    
+            # Export RFM
+            df_export_rfm = df_rfm.copy()
+            # (D) calculate_clv_formula gère Series proprement
+            df_export_rfm['CLV_Formule'] = calculate_clv_formula(df_export_rfm['Monetary'], h_retention, h_discount, h_margin)
+    
+            # CLV probabiliste par client (BG/NBD + Gamma-Gamma), optionnelle car plus coûteuse
+            with st.expander("🎲 CLV probabiliste (BG/NBD + Gamma-Gamma)"):
+                add_proba_clv = st.checkbox("Ajouter la CLV probabiliste à la liste activable", key='export_proba_clv')
+                pc1, pc2 = st.columns(2)
+                clv_horizon = pc1.slider("Horizon (mois)", 3, 36, step=3, key='clv_horizon')
+                clv_draws = pc2.select_slider("Tirages Monte Carlo (intervalle 90 %)", [0, 100, 200, 500], key='clv_draws')
+                if add_proba_clv:
+                    # Taux d'actualisation (d) annuel ramené au mois
+                    monthly_d = (1 + h_discount) ** (1 / 12) - 1
+                    df_proba, clv_params = graph.stage('clv_proba', calculate_probabilistic_clv, filtered_node, analysis_date,
+                                                       clv_horizon, h_margin, monthly_d, n_draws=clv_draws).value
+                    if df_proba is None:
+                        st.info(f"CLV probabiliste : modèle non estimable ({clv_params['non_estimable']}). "
+                                "Élargissez la période ou les pays ; l'export ne contient que la CLV formule.")
+                    else:
+                        df_export_rfm = df_export_rfm.merge(df_proba, on='CustomerID', how='left')
+                        st.caption("Paramètres ajustés : " + ", ".join(
+                            f"{k}={v:.3g}" for model in clv_params.values() for k, v in model.items()))
+    
+            # Format et découpage : écriture par tranches dans un fichier temporaire
+            fc1, fc2, fc3 = st.columns(3)
+            export_fmt = fc1.selectbox("Format d'export", list(EXPORT_FORMATS), format_func=EXPORT_FORMAT_LABELS.get,
+                                       key='export_fmt')
+            split_priority = fc2.checkbox("Liste activable : un fichier par priorité CRM (zip)", key='export_split')
+            part_rows = fc3.number_input("Transactions : lignes max par fichier (0 = fichier unique)", 0, 50_000_000,
+                                         step=500_000, key='export_part_rows')
+            ext, mime = EXPORT_FORMATS[export_fmt]
+    
+            # Les fichiers sont écrits au clic (callable), pas à chaque rerun ; on_click='ignore' évite un rerun
+            if split_priority:
+                file_rfm = partial(spool_zip, partial(export_by_priority, df_export_rfm, fmt=export_fmt))
+                col_ex1.download_button("📥 Télécharger Liste Activable (RFM + CLV)", file_rfm, 'plan_action_rfm.zip', ZIP_MIME,
+                                        on_click='ignore')
+            else:
+                file_rfm = partial(spool_export, df_export_rfm, export_fmt)
+                col_ex1.download_button("📥 Télécharger Liste Activable (RFM + CLV)", file_rfm, f'plan_action_rfm{ext}', mime,
+                                        on_click='ignore')
+    
+            # Export Raw (archive zip de plusieurs parties si le découpage s'applique)
+            file_trans = partial(transactions_export, graph, backend, filters, export_fmt, part_rows)
+            # Nombre de lignes connu sans relire les transactions : LineCount du cube facture
+            n_lines = int(df_filtered['LineCount'].sum())
+            trans_name, trans_mime = (('transactions_filtered.zip', ZIP_MIME) if part_rows and n_lines > part_rows
+                                      else (f'transactions_filtered{ext}', mime))
+            col_ex2.download_button("📥 Télécharger Transactions Filtrées", file_trans, trans_name, trans_mime,
+                                    on_click='ignore')
+    
+            st.markdown("---")
+            st.markdown("**Export des Graphiques**")
+            st.info("💡 Utilisez l'icône appareil photo sur les graphiques pour un PNG rapide.")
+    
+            # (F) Bouton Spécifique Treemap (Sécurisé)
+            # Le rendu PNG (kaleido) n'a lieu qu'au clic ; fallback si la librairie graphique serveur est absente
+            if importlib.util.find_spec('kaleido') is not None:
+                st.download_button("📷 Télécharger Image Segments (Treemap)", partial(treemap_png, df_rfm),
+                                   "segments_treemap.png", "image/png", on_click='ignore')
+            else:
+                # On n'affiche pas l'erreur complète à l'utilisateur, juste une info
+                st.caption("Le téléchargement direct bouton n'est pas disponible (librairie manquante). Utilisez l'icône caméra du graphique.")
+
+# --- DEBUG : CACHE DES ÉTAPES ---
+with st.sidebar.expander("🛠️ Debug : cache des calculs"):
+    cache_stats = graph.stats()
+    total_hits, total_misses = cache_stats['hits'].sum(), cache_stats['misses'].sum()
+    st.caption(f"Moteur {backend.name} | {len(graph)} entrées, {graph.nbytes / 1024 ** 2:.1f} Mo / {graph.max_bytes / 1024 ** 2:.0f} Mo "
+               f"| Succès {total_hits} · Échecs {total_misses}")
+    st.dataframe(cache_stats, use_container_width=True)
+    if st.button("Vider le cache des calculs"):
+        graph.clear()
+
+# --- PERFORMANCE : MESURES PAR ÉTAPE ---
+with st.sidebar.expander("⏱️ Performance des étapes"):
+    # Réglage appliqué par callback, avant le rerun : les étapes de ce rerun sont déjà instrumentées
+    st.toggle("Activer l'instrumentation", value=PROFILER.enabled, key='perf_enabled', on_change=configure_profiler)
+    st.checkbox("Mesurer la mémoire (tracemalloc, plus lent)", value=True, key='perf_memory',
+                on_change=configure_profiler, disabled=not PROFILER.enabled)
+    if PROFILER.enabled:
+        st.caption(f"Rerun n°{perf_run} : {PROFILER.run_elapsed():.2f} s jusqu'à ce panneau")
+        st.dataframe(PROFILER.last_run(), use_container_width=True, hide_index=True)
+    if PROFILER.records:
+        st.markdown("**Percentiles glissants (derniers appels par étape)**")
+        st.dataframe(PROFILER.summary(), use_container_width=True)
+        st.download_button("📥 Exporter les mesures (JSON lines)", PROFILER.to_jsonl, 'perf_etapes.jsonl',
+                           'application/x-ndjson', on_click='ignore')
+        if st.button("Effacer les mesures"):
+            PROFILER.clear()
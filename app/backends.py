@@ -0,0 +1,449 @@
+import json
+import os
+import shutil
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import acero
+
+from utils import (load_and_prepare_data, read_transactions_csv, prepare_transactions, apply_filters, build_invoice_cube, filter_invoice_cube,
+                   calculate_rfm, score_rfm, calculate_cohort_retention, cohort_matrices, RFM_COLUMNS, CUBE_KEYS,
+                   CATEGORICAL_COLUMNS, CACHE_DIRNAME)
+
+# --- MOTEURS DE REQUÊTE : PANDAS EN MÉMOIRE, ARROW / DUCKDB SUR PARQUET ---
+# Le moteur de l'application se choisit par la variable d'environnement RFM_ENGINE
+ENGINES = ('pandas', 'arrow', 'duckdb')
+ENGINE_ENV = 'RFM_ENGINE'
+DEFAULT_ENGINE = 'pandas'
+
+# Jeu Parquet des transactions préparées : à incrémenter si son format change
+DATASET_VERSION = 2
+DATASET_SUFFIX = '.dataset'
+DATASET_META = '_meta.json'  # préfixe '_' : ignoré par la découverte des fichiers Parquet
+DATASET_CHUNK_ROWS = 1_000_000
+# Groupes de lignes courts : leurs statistiques min / max de date permettent d'écarter une période sans la lire
+DATASET_ROW_GROUP_ROWS = 128 * 1024
+PARTITION_COLUMN = 'Country'
+
+def _dataset_meta(directory):
+    try:
+        with open(os.path.join(directory, DATASET_META), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_transactions_dataset(csv_path, directory, chunksize=DATASET_CHUNK_ROWS):
+    """
+    Convertit le CSV en jeu Parquet de transactions préparées (prepare_transactions), par morceaux :
+    la mémoire reste bornée par `chunksize` quelle que soit la taille du fichier.
+
+    Partitionné par pays (Country=.../) et trié par date dans chaque fichier : un filtre pays ne lit qu'un
+    répertoire, un filtre de période écarte les groupes de lignes hors bornes. RowId (n° de ligne du CSV,
+    index du DataFrame pandas) restitue l'ordre et l'index d'origine.
+    """
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    columns, countries, rows = None, set(), 0
+    min_date = max_date = None
+    for i, chunk in enumerate(read_transactions_csv(csv_path, chunksize=chunksize)):
+        chunk = prepare_transactions(chunk)
+        columns = columns or chunk.columns.tolist()
+        chunk = chunk.drop(columns='InvoiceCode').sort_values('TransactionDate', kind='stable')
+        chunk.insert(0, 'RowId', chunk.index.to_numpy(dtype='int64'))
+        for col in CATEGORICAL_COLUMNS:
+            # Texte brut dans le Parquet : dictionnaires propres à chaque morceau sinon
+            chunk[col] = chunk[col].astype(object)
+        if chunk.empty:
+            continue
+        countries.update(chunk[PARTITION_COLUMN].unique().tolist())
+        rows += len(chunk)
+        lo, hi = chunk['TransactionDate'].iloc[0], chunk['TransactionDate'].iloc[-1]
+        min_date = lo if min_date is None else min(min_date, lo)
+        max_date = hi if max_date is None else max(max_date, hi)
+        ds.write_dataset(pa.Table.from_pandas(chunk, preserve_index=False), tmp_dir, format='parquet',
+                         partitioning=[PARTITION_COLUMN], partitioning_flavor='hive',
+                         basename_template=f'part-{i:05d}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore',
+                         max_rows_per_group=DATASET_ROW_GROUP_ROWS, min_rows_per_group=0)
+
+    stat = os.stat(csv_path)
+    meta = {
+        'version': DATASET_VERSION,
+        'source': os.path.abspath(csv_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'columns': columns,
+        'countries': sorted(countries),
+        'rows': rows,
+        'min_date': None if min_date is None else min_date.isoformat(),
+        'max_date': None if max_date is None else max_date.isoformat(),
+    }
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(os.path.join(tmp_dir, DATASET_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return directory
+
+def ensure_transactions_dataset(csv_path, cache_dir=None, chunksize=DATASET_CHUNK_ROWS):
+    """Jeu Parquet à jour pour ce CSV (dans le dossier de cache), reconstruit si le fichier source a changé."""
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(csv_path)), CACHE_DIRNAME)
+    directory = os.path.join(cache_dir, os.path.basename(csv_path) + DATASET_SUFFIX)
+    meta = _dataset_meta(directory)
+    stat = os.stat(csv_path)
+    if (meta is None or meta.get('version') != DATASET_VERSION or meta.get('size') != stat.st_size
+            or meta.get('mtime_ns') != stat.st_mtime_ns):
+        os.makedirs(cache_dir, exist_ok=True)
+        write_transactions_dataset(csv_path, directory, chunksize)
+    return directory
+
+class QueryBackend(ABC):
+    """
+    Interface commune des moteurs de requête du pipeline.
+
+    `filters` = (start_date, end_date, country_filter, returns_mode, min_order_val), avec les règles de
+    utils.apply_filters. Chaque méthode retourne les mêmes tables que le chemin pandas :
+      - apply_filters(filters)                      -> lignes filtrées (apply_filters)
+      - invoice_cube(filters)                       -> cube facture filtré (filter_invoice_cube)
+      - calculate_rfm(filters, analysis_date)       -> table RFM scorée (calculate_rfm)
+      - calculate_cohort_retention(filters, freq)   -> (rétention, ARPU, tailles) (calculate_cohort_retention)
+    `metadata()` donne les bornes de dates et les pays, sans lire les transactions.
+    L'application passe par ces méthodes pour le filtrage, la RFM et les cohortes : avec un moteur
+    Parquet, ces étapes s'exécutent dans le moteur.
+    """
+    name = None
+
+    @abstractmethod
+    def metadata(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_filters(self, filters):
+        raise NotImplementedError
+
+    @abstractmethod
+    def invoice_cube(self, filters):
+        raise NotImplementedError
+
+    @abstractmethod
+    def calculate_rfm(self, filters, analysis_date):
+        raise NotImplementedError
+
+    @abstractmethod
+    def calculate_cohort_retention(self, filters, freq='M'):
+        raise NotImplementedError
+
+class PandasBackend(QueryBackend):
+    """Chemin de référence : toutes les transactions en mémoire (DataFrame + cube facture)."""
+    name = 'pandas'
+
+    def __init__(self, df, cube=None):
+        self.df = df
+        self.cube = build_invoice_cube(df) if cube is None else cube
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        return cls(load_and_prepare_data(csv_path))
+
+    def metadata(self):
+        if self.df.empty:
+            return {'rows': 0, 'countries': [], 'min_date': None, 'max_date': None}
+        return {'rows': len(self.df), 'countries': sorted(self.df['Country'].unique().tolist()),
+                'min_date': self.df['TransactionDate'].min(), 'max_date': self.df['TransactionDate'].max()}
+
+    def apply_filters(self, filters):
+        return apply_filters(self.df, *filters)
+
+    def invoice_cube(self, filters):
+        return filter_invoice_cube(self.cube, *filters)
+
+    # RFM et cohortes sur le cube facture : mêmes résultats que sur les lignes, sans les relire
+    def calculate_rfm(self, filters, analysis_date):
+        return calculate_rfm(self.invoice_cube(filters), analysis_date)
+
+    def calculate_cohort_retention(self, filters, freq='M'):
+        return calculate_cohort_retention(self.invoice_cube(filters), freq)
+
+class ParquetBackend(QueryBackend):
+    """
+    Moteur hors mémoire sur le jeu Parquet (write_transactions_dataset) : filtres, agrégats par facture,
+    par client et par (client, période) exécutés par le moteur ; seuls les résultats agrégés (ou les
+    lignes demandées par apply_filters) arrivent en pandas.
+
+    Les sous-classes fournissent les requêtes élémentaires (_invoice_totals, _invoice_lines, _lines,
+    _cube_aggregates, _customer_aggregates, _period_aggregates). Les sommes du moteur peuvent différer
+    de pandas au dernier chiffre : les factures proches du seuil de commande sont re-sommées comme en
+    pandas (ordre des lignes, groupby) pour conserver exactement les mêmes décisions.
+    Écarts assumés avec le chemin pandas : InvoiceCode est renuméroté dans chaque résultat, l'index du
+    cube est remis à zéro et les catégories des colonnes texte (hors pays) sont celles présentes dans le résultat.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = _dataset_meta(directory)
+        if self.meta is None:
+            raise FileNotFoundError(f"Jeu Parquet introuvable ou incomplet : {directory}")
+
+    def metadata(self):
+        return {'rows': self.meta['rows'], 'countries': self.meta['countries'],
+                'min_date': pd.Timestamp(self.meta['min_date']) if self.meta['min_date'] else None,
+                'max_date': pd.Timestamp(self.meta['max_date']) if self.meta['max_date'] else None}
+
+    def _valid_invoices(self, filters):
+        """Factures dont le total (lignes filtrées par date / pays / retours) atteint le seuil de commande."""
+        min_order_val = filters[4]
+        totals = self._invoice_totals(filters)
+        near = np.isclose(totals['TotalSales'].to_numpy(dtype='float64'), min_order_val, rtol=1e-9, atol=1e-9)
+        if near.any():
+            exact = self._exact_totals(filters, totals.loc[near, 'InvoiceNo'])
+            totals.loc[near, 'TotalSales'] = totals.loc[near, 'InvoiceNo'].map(exact).to_numpy()
+        return totals.loc[totals['TotalSales'] >= min_order_val, 'InvoiceNo'].tolist()
+
+    def _exact_totals(self, filters, invoices):
+        # Même calcul que pandas : somme groupby des lignes dans l'ordre du CSV
+        lines = self._invoice_lines(filters, list(invoices)).sort_values('RowId', kind='stable')
+        return lines.groupby('InvoiceNo', sort=False)['TotalSales'].sum()
+
+    def _threshold(self, filters):
+        return self._valid_invoices(filters) if filters[4] > 0 else None
+
+    def apply_filters(self, filters):
+        df = self._lines(filters, self._threshold(filters))
+        df = df.sort_values('RowId', kind='stable').set_index('RowId')
+        df.index.name = None
+        if filters[3] == 'Neutraliser':
+            df.loc[df['is_return'], 'TotalSales'] = 0
+        df['Country'] = pd.Categorical(df['Country'], categories=self.meta['countries'])
+        for col in CATEGORICAL_COLUMNS:
+            if col != 'Country' and col in df.columns:
+                df[col] = df[col].astype('category')
+        df['InvoiceCode'] = df['InvoiceNo'].cat.codes.astype('int32')
+        return df[self.meta['columns']]
+
+    def invoice_cube(self, filters):
+        cube = self._cube_aggregates(filters)
+        if cube.empty:
+            return pd.DataFrame(columns=CUBE_KEYS + ['TotalSales', 'LineCount'])
+        # Ordre du cube pandas : date, puis ordre d'apparition des factures dans le CSV
+        cube = cube.sort_values(['TransactionDate', 'FirstRow'], kind='stable').reset_index(drop=True)
+        cube['InvoiceCode'] = cube['FirstRow'].rank(method='dense').astype('int32') - 1
+        min_order_val = filters[4]
+        if min_order_val > 0:
+            near = np.isclose(cube['TotalSales'].to_numpy(dtype='float64'), min_order_val, rtol=1e-9, atol=1e-9)
+            if near.any():
+                exact = self._exact_totals(filters, cube.loc[near, 'InvoiceNo'])
+                cube.loc[near, 'TotalSales'] = cube.loc[near, 'InvoiceNo'].map(exact).to_numpy()
+            cube = cube[cube['TotalSales'] >= min_order_val].reset_index(drop=True)
+        cube['CustomerID'] = cube['CustomerID'].astype('int32')
+        cube['InvoiceNo'] = cube['InvoiceNo'].astype('category')
+        cube['Country'] = pd.Categorical(cube['Country'], categories=self.meta['countries'])
+        cube['LineCount'] = cube['LineCount'].astype('int32')
+        return cube[CUBE_KEYS + ['TotalSales', 'LineCount']]
+
+    def calculate_rfm(self, filters, analysis_date):
+        agg = self._customer_aggregates(filters, self._threshold(filters))
+        if agg.empty:
+            return pd.DataFrame(columns=RFM_COLUMNS)
+        # Même table que utils.aggregate_rfm, triée par client pour un départage reproductible des ex-aequo
+        rfm_df = agg.sort_values('CustomerID').reset_index(drop=True)
+        rfm_df['CustomerID'] = rfm_df['CustomerID'].astype('int32')
+        rfm_df['Frequency'] = rfm_df['Frequency'].astype('int64')
+        rfm_df.insert(1, 'Recency', (pd.Timestamp(analysis_date) - rfm_df.pop('LastPurchase')).dt.days)
+        return score_rfm(rfm_df[['CustomerID', 'Recency', 'Frequency', 'Monetary']])
+
+    def calculate_cohort_retention(self, filters, freq='M'):
+        activity = self._period_aggregates(filters, self._threshold(filters), freq)
+        if activity.empty:
+            return pd.DataFrame(), pd.DataFrame(), pd.Series(dtype="float")
+        activity = activity.sort_values(['CustomerID', 'Period']).reset_index(drop=True)
+        return cohort_matrices(activity[['CustomerID', 'Period', 'TotalSales']], freq)
+
+# Colonnes lues par les agrégations Arrow (filtres + projections) : les autres ne sont jamais décodées
+FILTER_COLUMNS = ['TransactionDate', PARTITION_COLUMN, 'is_return', 'InvoiceNo']
+PROJECTED_COLUMNS = ['RowId', 'CustomerID', 'TotalSales']
+
+def _timestamp(value):
+    return pa.scalar(pd.Timestamp(value).as_unit('ns'), type=pa.timestamp('ns'))
+
+class ArrowBackend(ParquetBackend):
+    """
+    Requêtes Arrow (pyarrow.dataset + Acero) : le filtre date / pays est poussé au scan (partitions et
+    statistiques des groupes de lignes), les agrégations par clé s'exécutent en flux par lots.
+    """
+    name = 'arrow'
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.dataset = ds.dataset(directory, format='parquet',
+                                  partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]),
+                                                               flavor='hive'))
+
+    def _expression(self, filters, valid_invoices=None, invoices=None):
+        start_date, end_date, country_filter, returns_mode, _ = filters
+        date = ds.field('TransactionDate')
+        expr = (date >= _timestamp(start_date)) & (date <= _timestamp(end_date))
+        if country_filter != 'Global':
+            expr = expr & (ds.field(PARTITION_COLUMN) == country_filter)
+        if returns_mode == 'Exclure':
+            expr = expr & ~ds.field('is_return')
+        for subset in (valid_invoices, invoices):
+            if subset is not None:
+                expr = expr & pc.is_in(ds.field('InvoiceNo'), value_set=pa.array(subset, pa.string()))
+        return expr
+
+    @staticmethod
+    def _sales(filters):
+        if filters[3] == 'Neutraliser':
+            return pc.if_else(ds.field('is_return'), pa.scalar(0.0), ds.field('TotalSales'))
+        return ds.field('TotalSales')
+
+    def _aggregate(self, expr, projection, aggregates, keys):
+        """Scan (filtre poussé au Parquet) -> filtre -> projection -> agrégation par clés, exécutés en flux."""
+        # Seules les colonnes du filtre et de la projection sont lues
+        columns = FILTER_COLUMNS + [c for c in PROJECTED_COLUMNS if c not in FILTER_COLUMNS]
+        plan = acero.Declaration.from_sequence([
+            acero.Declaration('scan', acero.ScanNodeOptions(self.dataset, filter=expr, columns=columns)),
+            acero.Declaration('filter', acero.FilterNodeOptions(expr)),
+            acero.Declaration('project', acero.ProjectNodeOptions(list(projection.values()), list(projection))),
+            acero.Declaration('aggregate', acero.AggregateNodeOptions(aggregates, keys=keys)),
+        ])
+        return plan.to_table().to_pandas()
+
+    def _invoice_totals(self, filters):
+        return self._aggregate(self._expression(filters),
+                               {'InvoiceNo': ds.field('InvoiceNo'), 'Sales': self._sales(filters)},
+                               [('Sales', 'hash_sum', None, 'TotalSales')], ['InvoiceNo'])
+
+    def _invoice_lines(self, filters, invoices):
+        table = self.dataset.to_table(columns={'RowId': ds.field('RowId'), 'InvoiceNo': ds.field('InvoiceNo'),
+                                               'TotalSales': self._sales(filters)},
+                                      filter=self._expression(filters, invoices=invoices))
+        return table.to_pandas()
+
+    def _lines(self, filters, valid_invoices):
+        return self.dataset.to_table(filter=self._expression(filters, valid_invoices)).to_pandas()
+
+    def _cube_aggregates(self, filters):
+        keys = [k for k in CUBE_KEYS if k != 'InvoiceCode']
+        projection = {k: ds.field(k) for k in keys}
+        projection.update(Sales=self._sales(filters), RowId=ds.field('RowId'))
+        return self._aggregate(self._expression(filters), projection,
+                               [('Sales', 'hash_sum', None, 'TotalSales'),
+                                ('Sales', 'hash_count', pc.CountOptions(mode='all'), 'LineCount'),
+                                ('RowId', 'hash_min', None, 'FirstRow')], keys)
+
+    def _customer_aggregates(self, filters, valid_invoices):
+        projection = {'CustomerID': ds.field('CustomerID'), 'TransactionDate': ds.field('TransactionDate'),
+                      'InvoiceNo': ds.field('InvoiceNo'), 'Sales': self._sales(filters)}
+        return self._aggregate(self._expression(filters, valid_invoices), projection,
+                               [('TransactionDate', 'hash_max', None, 'LastPurchase'),
+                                ('InvoiceNo', 'hash_count_distinct', None, 'Frequency'),
+                                ('Sales', 'hash_sum', None, 'Monetary')], ['CustomerID'])
+
+    def _period_aggregates(self, filters, valid_invoices, freq):
+        date = ds.field('TransactionDate')
+        if freq == 'W':
+            # Mêmes numéros que utils.period_codes : jours depuis 1970 décalés au lundi
+            # (division entière Arrow tronquée = division euclidienne pour les dates postérieures à 1970)
+            days = date.cast(pa.date32()).cast(pa.int32()).cast(pa.int64())
+            period = pc.divide(pc.add(days, 3), 7)
+        else:
+            period = pc.add(pc.multiply(pc.subtract(pc.year(date), 1970), 12), pc.subtract(pc.month(date), 1))
+            if freq == 'Q':
+                period = pc.divide(period, 3)
+        projection = {'CustomerID': ds.field('CustomerID'), 'Period': period, 'Sales': self._sales(filters)}
+        return self._aggregate(self._expression(filters, valid_invoices), projection,
+                               [('Sales', 'hash_sum', None, 'TotalSales')], ['CustomerID', 'Period'])
+
+class DuckDBBackend(ParquetBackend):
+    """
+    Requêtes SQL DuckDB sur le même jeu Parquet (dépendance optionnelle : pip install duckdb).
+    Filtres date / pays poussés au lecteur Parquet (partitions hive, statistiques des groupes de lignes).
+    """
+    name = 'duckdb'
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("Le moteur 'duckdb' nécessite le paquet duckdb (pip install duckdb).") from e
+        self.connection = duckdb.connect()
+        pattern = os.path.join(directory, '**', '*.parquet').replace("'", "''")
+        self.source = f"read_parquet('{pattern}', hive_partitioning = true)"
+
+    def _query(self, sql, params, invoices=None):
+        # Un curseur par requête : la connexion DuckDB n'est pas partagée entre threads
+        cursor = self.connection.cursor()
+        try:
+            if invoices is not None:
+                cursor.register('invoice_subset', pa.table({'InvoiceNo': pa.array(invoices, pa.string())}))
+            return cursor.execute(sql, params).df()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _where(filters, invoices=None):
+        start_date, end_date, country_filter, returns_mode, _ = filters
+        clauses = ['TransactionDate >= ?', 'TransactionDate <= ?']
+        params = [pd.Timestamp(start_date).to_pydatetime(), pd.Timestamp(end_date).to_pydatetime()]
+        if country_filter != 'Global':
+            clauses.append(f'{PARTITION_COLUMN} = ?')
+            params.append(country_filter)
+        if returns_mode == 'Exclure':
+            clauses.append('NOT is_return')
+        if invoices is not None:
+            clauses.append('InvoiceNo IN (SELECT InvoiceNo FROM invoice_subset)')
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def _sales(filters):
+        return 'CASE WHEN is_return THEN 0.0 ELSE TotalSales END' if filters[3] == 'Neutraliser' else 'TotalSales'
+
+    def _select(self, filters, select, group_by=None, invoices=None):
+        where, params = self._where(filters, invoices)
+        sql = f"SELECT {select} FROM {self.source} WHERE {where}"
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        return self._query(sql, params, invoices)
+
+    def _invoice_totals(self, filters):
+        return self._select(filters, f"InvoiceNo, sum({self._sales(filters)}) AS TotalSales", 'InvoiceNo')
+
+    def _invoice_lines(self, filters, invoices):
+        return self._select(filters, f"RowId, InvoiceNo, {self._sales(filters)} AS TotalSales", invoices=invoices)
+
+    def _lines(self, filters, valid_invoices):
+        return self._select(filters, '*', invoices=valid_invoices)
+
+    def _cube_aggregates(self, filters):
+        keys = ', '.join(k for k in CUBE_KEYS if k != 'InvoiceCode')
+        return self._select(filters, f"{keys}, sum({self._sales(filters)}) AS TotalSales, "
+                                     f"count(*) AS LineCount, min(RowId) AS FirstRow", keys)
+
+    def _customer_aggregates(self, filters, valid_invoices):
+        return self._select(filters, f"CustomerID, max(TransactionDate) AS LastPurchase, "
+                                     f"count(DISTINCT InvoiceNo) AS Frequency, "
+                                     f"sum({self._sales(filters)}) AS Monetary", 'CustomerID', valid_invoices)
+
+    def _period_aggregates(self, filters, valid_invoices, freq):
+        if freq == 'W':
+            period = "(date_diff('day', DATE '1970-01-01', CAST(TransactionDate AS DATE)) + 3) // 7"
+        else:
+            period = "(year(TransactionDate) - 1970) * 12 + month(TransactionDate) - 1"
+            if freq == 'Q':
+                period = f"({period}) // 3"
+        return self._select(filters, f"CustomerID, {period} AS Period, sum({self._sales(filters)}) AS TotalSales",
+                            'CustomerID, Period', valid_invoices)
+
+def open_backend(engine, csv_path, cache_dir=None):
+    """Moteur `engine` ('pandas', 'arrow' ou 'duckdb') sur le CSV ; le jeu Parquet est construit si besoin."""
+    if engine not in ENGINES:
+        raise ValueError(f"Moteur inconnu : {engine} (attendu : {', '.join(ENGINES)})")
+    if engine == 'pandas':
+        return PandasBackend.from_csv(csv_path)
+    directory = ensure_transactions_dataset(csv_path, cache_dir)
+    return ArrowBackend(directory) if engine == 'arrow' else DuckDBBackend(directory)
@@ -0,0 +1,336 @@
+"""
+Scoring RFM / cohortes / CLV hors Streamlit, pour des jobs planifiés (ex. nuit).
+
+Chaque configuration (pays × mode retours × fenêtre) est calculée dans un worker à partir
+des données chargées une seule fois. Les résultats sont écrits en Parquet partitionné :
+
+    <out>/rfm/country=France/returns_mode=Exclure/window=2010-01-01_2010-12-31/part-0.parquet
+    <out>/cohorts/...   (rétention & ARPU au format long)
+    <out>/_configs/<id>.json   (marqueur de configuration terminée, avec durées par étape)
+    <out>/manifest.json
+
+Un job interrompu reprend là où il s'est arrêté : les configurations déjà marquées comme
+terminées (mêmes paramètres, même fichier source) ne sont pas recalculées.
+
+Usage (depuis la racine du projet) :
+    python app/batch.py --data app/data/processed.csv --out runs/rfm \\
+        --countries Global France Germany --returns-modes Exclure Inclure \\
+        --windows 2010-01-01:2010-12-31 2011-01-01:2011-12-09 --workers 4
+    python app/batch.py ... --at 02:30        # boucle : un run par nuit dans <out>/<date>/
+    python app/batch.py ... --rfm-mode parallel --rfm-workers 8   # grosses configurations, une à la fois
+"""
+import argparse
+import datetime as dt
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from utils import (load_and_prepare_data, build_invoice_cube, filter_invoice_cube, calculate_rfm,
+                   calculate_cohort_retention, calculate_clv_formula)
+from parallel import calculate_rfm_parallel
+from sketches import DEFAULT_RELATIVE_ACCURACY, calculate_rfm_sketch
+
+# --- SCORING PAR LOTS (CLI) ---
+MANIFEST_VERSION = 1
+# Calcul RFM : 'exact' (calculate_rfm), 'parallel' (agrégation client répartie sur des processus, même résultat),
+# 'sketch' (quintiles lus dans des histogrammes / sketchs sans tri des clients : R et F exacts, M approché)
+RFM_MODES = ['exact', 'parallel', 'sketch']
+
+# Données partagées par les configurations d'un même processus (héritées par fork)
+_CUBE = None
+
+def _set_cube(cube):
+    global _CUBE
+    _CUBE = cube
+
+def _init_worker(cube, data_path):
+    # Avec fork, le cube est déjà hérité du parent ; sinon chaque worker le reconstruit une fois (cache Parquet)
+    if _CUBE is None:
+        _set_cube(cube if cube is not None else build_invoice_cube(load_and_prepare_data(data_path)))
+
+def parse_window(text):
+    """'2010-01-01:2010-12-31' -> (Timestamp, Timestamp)."""
+    start, end = text.split(':')
+    return pd.Timestamp(start), pd.Timestamp(end)
+
+def data_signature(data_path):
+    """Identité du fichier source (taille + date de modification) pour la reprise."""
+    stat = os.stat(data_path)
+    return {'path': os.path.abspath(data_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def config_id(config):
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def partition_path(config):
+    """Chemin de partition Hive (country=.../returns_mode=.../window=...)."""
+    window = f"{config['start']}_{config['end']}"
+    country = str(config['country']).replace('/', '-')
+    return os.path.join(f"country={country}", f"returns_mode={config['returns_mode']}", f"window={window}")
+
+def resolve_countries(requested, available):
+    """
+    Pays des configurations : 'ALL' (où qu'il figure) devient chaque pays des données, 'Global' est gardé tel quel.
+    Un pays absent des données lève ValueError plutôt que de produire des partitions vides.
+    """
+    countries = []
+    for name in requested:
+        for country in (available if name == 'ALL' else [name]):
+            if country not in countries:
+                countries.append(country)
+    unknown = [country for country in countries if country != 'Global' and country not in available]
+    if unknown:
+        raise ValueError(f"Pays absents des données : {', '.join(unknown)} (disponibles : {', '.join(available)})")
+    return countries
+
+def build_configs(countries, returns_modes, windows, min_order):
+    return [{'country': country, 'returns_mode': mode, 'start': str(start.date()), 'end': str(end.date()),
+             'min_order': min_order}
+            for country in countries for mode in returns_modes for start, end in windows]
+
+def _write_parquet(df, path):
+    # Écriture atomique : un fichier partiel n'est jamais visible sous son nom final
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def cohorts_long(retention_matrix, arpu_matrix, cohort_sizes):
+    """Matrices cohorte × âge -> table longue (Cohort, Index, Retention, ARPU, CohortSize)."""
+    if retention_matrix.empty:
+        return pd.DataFrame(columns=['Cohort', 'Index', 'Retention', 'ARPU', 'CohortSize'])
+    retention = retention_matrix.rename_axis(index='Cohort', columns='Index').stack().rename('Retention')
+    arpu = arpu_matrix.rename_axis(index='Cohort', columns='Index').stack().rename('ARPU')
+    long = pd.concat([retention, arpu], axis=1).reset_index()
+    long['CohortSize'] = long['Cohort'].map(cohort_sizes).astype('int64')
+    return long
+
+def compute_rfm(df_filtered, analysis_date, rfm_mode='exact', rfm_workers=None,
+                sketch_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    RFM d'une configuration selon `rfm_mode` (RFM_MODES) ; `rfm_workers` : processus du mode 'parallel',
+    `sketch_accuracy` : précision relative du sketch Monetary du mode 'sketch'.
+    """
+    if rfm_mode == 'parallel':
+        return calculate_rfm_parallel(df_filtered, analysis_date, n_workers=rfm_workers)
+    if rfm_mode == 'sketch':
+        return calculate_rfm_sketch(df_filtered, analysis_date, sketch_accuracy)
+    return calculate_rfm(df_filtered, analysis_date)
+
+def run_config(config, out_dir, clv_params, proba_clv=False, rfm_mode='exact', rfm_workers=None,
+               sketch_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Calcule une configuration (worker) et écrit ses partitions. Retourne les durées par étape."""
+    from clv import calculate_probabilistic_clv
+
+    timings = {}
+    t0 = time.perf_counter()
+    df_filtered = filter_invoice_cube(_CUBE, config['start'], config['end'], config['country'],
+                                      config['returns_mode'], config['min_order'])
+    timings['filter'] = time.perf_counter() - t0
+    analysis_date = pd.Timestamp(config['end']) + dt.timedelta(days=1)
+
+    t0 = time.perf_counter()
+    df_rfm = compute_rfm(df_filtered, analysis_date, rfm_mode, rfm_workers, sketch_accuracy)
+    timings['rfm'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    cohorts = cohorts_long(*calculate_cohort_retention(df_filtered))
+    timings['cohorts'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    df_rfm = df_rfm.copy()
+    df_rfm['CLV_Formule'] = calculate_clv_formula(df_rfm['Monetary'].astype('float64'), clv_params['retention'],
+                                                  clv_params['discount'], clv_params['margin'])
+    proba_status = None
+    if proba_clv and len(df_rfm) > 1:
+        monthly_d = (1 + clv_params['discount']) ** (1 / 12) - 1
+        df_proba, fitted = calculate_probabilistic_clv(df_filtered, analysis_date, clv_params['horizon_months'],
+                                                       clv_params['margin'], monthly_d)
+        # Modèle non estimable : pas de colonnes probabilistes (plutôt que des NaN), raison dans le manifeste
+        if df_proba is None:
+            proba_status = fitted['non_estimable']
+        else:
+            df_rfm = df_rfm.merge(df_proba, on='CustomerID', how='left')
+    timings['clv'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    partition = partition_path(config)
+    # Résultat vide : aucun fichier (ses colonnes sans type rendraient tout le jeu partitionné illisible),
+    # la configuration est marquée 'empty' dans le manifeste
+    if not df_rfm.empty:
+        _write_parquet(df_rfm, os.path.join(out_dir, 'rfm', partition, 'part-0.parquet'))
+    if not cohorts.empty:
+        _write_parquet(cohorts, os.path.join(out_dir, 'cohorts', partition, 'part-0.parquet'))
+    timings['write'] = time.perf_counter() - t0
+    return {'timings': timings, 'empty': df_rfm.empty, 'proba_clv_non_estimable': proba_status, 'rows': {'transactions': int(df_filtered['LineCount'].sum()) if len(df_filtered) else 0,
+                                         'invoices': len(df_filtered), 'customers': len(df_rfm),
+                                         'cohort_cells': len(cohorts)}}
+
+def _marker_path(out_dir, cid):
+    return os.path.join(out_dir, '_configs', f"{cid}.json")
+
+def _read_marker(out_dir, cid):
+    try:
+        with open(_marker_path(out_dir, cid), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(payload, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def run_batch(data_path, out_dir, configs, clv_params, proba_clv=False, n_workers=1, resume=True, cube=None,
+              load_seconds=0.0, rfm_mode='exact', rfm_workers=None, sketch_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    Exécute toutes les configurations (reprise possible) et écrit le manifeste. Retourne le manifeste.
+
+    Une configuration est terminée quand son marqueur `_configs/<id>.json` existe : il est écrit
+    après ses partitions Parquet et porte les paramètres, la signature du fichier source et les durées.
+    `cube` : cube facture déjà construit (sinon chargé depuis `data_path` s'il reste des configurations),
+    `load_seconds` : durée de son chargement, reportée dans le manifeste.
+    `rfm_mode` / `rfm_workers` / `sketch_accuracy` : calcul RFM de chaque configuration (voir compute_rfm).
+    """
+    signature = data_signature(data_path)
+    run_params = {'clv': clv_params, 'proba_clv': proba_clv, 'rfm_mode': rfm_mode, 'data': signature}
+    if rfm_mode == 'sketch':
+        # Seul le mode sketch dépend de la précision : les identifiants des autres modes restent inchangés
+        run_params['sketch_accuracy'] = sketch_accuracy
+    manifest = {'version': MANIFEST_VERSION, 'started_at': dt.datetime.now().isoformat(timespec='seconds'),
+                'data': signature, 'clv': clv_params, 'proba_clv': proba_clv, 'rfm_mode': rfm_mode,
+                'sketch_accuracy': run_params.get('sketch_accuracy'), 'configs': []}
+
+    pending, done = [], []
+    for config in configs:
+        cid = config_id({'config': config, **run_params})
+        marker = _read_marker(out_dir, cid) if resume else None
+        if marker is not None:
+            done.append(dict(marker, status='skipped'))
+        else:
+            pending.append((cid, config))
+
+    stage_timings = {'load': load_seconds}
+    if pending:
+        t0 = time.perf_counter()
+        _set_cube(cube if cube is not None else build_invoice_cube(load_and_prepare_data(data_path)))
+        stage_timings['load'] += time.perf_counter() - t0
+
+    def record(cid, config, result):
+        entry = {'id': cid, 'config': config, 'partition': partition_path(config), 'status': 'done',
+                 'finished_at': dt.datetime.now().isoformat(timespec='seconds'), **result}
+        _write_json(entry, _marker_path(out_dir, cid))
+        done.append(entry)
+        manifest['configs'] = done
+        _write_json(manifest, os.path.join(out_dir, 'manifest.json'))
+
+    if n_workers <= 1 or len(pending) <= 1:
+        for cid, config in pending:
+            record(cid, config, run_config(config, out_dir, clv_params, proba_clv, rfm_mode, rfm_workers,
+                                           sketch_accuracy))
+    else:
+        # fork : les workers héritent du cube sans copie ni rechargement
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        shared_cube = None if ctx.get_start_method() == 'fork' else _CUBE
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(shared_cube, data_path)) as pool:
+            futures = {pool.submit(run_config, config, out_dir, clv_params, proba_clv, rfm_mode, rfm_workers,
+                                   sketch_accuracy): (cid, config)
+                       for cid, config in pending}
+            for future in as_completed(futures):
+                cid, config = futures[future]
+                record(cid, config, future.result())
+
+    # Durées cumulées des configurations calculées dans ce run (les reprises gardent leurs durées d'origine)
+    for entry in done:
+        if entry['status'] != 'done':
+            continue
+        for stage, seconds in entry.get('timings', {}).items():
+            stage_timings[stage] = stage_timings.get(stage, 0.0) + seconds
+    manifest.update(configs=done, stage_timings=stage_timings,
+                    finished_at=dt.datetime.now().isoformat(timespec='seconds'))
+    _write_json(manifest, os.path.join(out_dir, 'manifest.json'))
+    return manifest
+
+def _next_run(at, now=None):
+    now = now or dt.datetime.now()
+    hour, minute = (int(part) for part in at.split(':'))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return target if target > now else target + dt.timedelta(days=1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='app/data/processed.csv')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--countries', nargs='+', default=['Global'],
+                        help="Pays, 'Global' ou 'ALL' (chaque pays présent dans les données) ; un pays inconnu est refusé.")
+    parser.add_argument('--returns-modes', nargs='+', default=['Exclure'], choices=['Inclure', 'Exclure', 'Neutraliser'])
+    parser.add_argument('--windows', nargs='+', default=None, help="Fenêtres DEBUT:FIN (défaut : toute la période).")
+    parser.add_argument('--min-order', type=float, default=0)
+    parser.add_argument('--margin', type=float, default=0.30)
+    parser.add_argument('--retention', type=float, default=0.60)
+    parser.add_argument('--discount', type=float, default=0.10)
+    parser.add_argument('--proba-clv', action='store_true', help="Ajoute la CLV probabiliste (BG/NBD + Gamma-Gamma).")
+    parser.add_argument('--horizon-months', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rfm-mode', choices=RFM_MODES, default='exact',
+                        help="Calcul RFM : exact, parallel (multi-processus, même résultat) ou sketch "
+                             "(sans tri : R et F exacts, seuils Monetary approchés).")
+    parser.add_argument('--rfm-workers', type=int, default=None,
+                        help="Processus du mode parallel (défaut : nombre de CPU, 8 au plus ; réduit à 1 processus par "
+                             "250 000 lignes, à réduire si --workers > 1).")
+    parser.add_argument('--sketch-accuracy', type=float, default=DEFAULT_RELATIVE_ACCURACY,
+                        help="Précision relative des seuils Monetary du mode sketch (défaut : 0.01).")
+    parser.add_argument('--no-resume', action='store_true', help="Recalcule toutes les configurations.")
+    parser.add_argument('--at', default=None, help="HH:MM : exécution quotidienne à heure fixe (boucle).")
+    args = parser.parse_args(argv)
+
+    clv_params = {'margin': args.margin, 'retention': args.retention, 'discount': args.discount,
+                  'horizon_months': args.horizon_months}
+
+    def run_once(out_dir):
+        # Chargement unique : sert à énumérer pays / fenêtres puis à construire le cube partagé
+        t0 = time.perf_counter()
+        df = load_and_prepare_data(args.data)
+        if df.empty:
+            raise SystemExit(f"Données introuvables ou vides : {args.data}")
+        try:
+            countries = resolve_countries(args.countries, sorted(df['Country'].unique().tolist()))
+        except ValueError as e:
+            raise SystemExit(str(e))
+        windows = ([parse_window(w) for w in args.windows] if args.windows
+                   else [(df['TransactionDate'].min().normalize(), df['TransactionDate'].max().normalize())])
+        configs = build_configs(countries, args.returns_modes, windows, args.min_order)
+        cube = build_invoice_cube(df)
+        del df
+        manifest = run_batch(args.data, out_dir, configs, clv_params, args.proba_clv, args.workers,
+                             resume=not args.no_resume, cube=cube, load_seconds=time.perf_counter() - t0,
+                             rfm_mode=args.rfm_mode, rfm_workers=args.rfm_workers,
+                             sketch_accuracy=args.sketch_accuracy)
+        n_skipped = sum(entry['status'] == 'skipped' for entry in manifest['configs'])
+        n_empty = sum(bool(entry.get('empty')) for entry in manifest['configs'])
+        n_no_proba = sum(bool(entry.get('proba_clv_non_estimable')) for entry in manifest['configs'])
+        print(f"{len(manifest['configs'])} configurations ({n_skipped} reprises, {n_empty} vides, "
+              f"{n_no_proba} sans CLV probabiliste) -> {out_dir}")
+        for stage, seconds in manifest['stage_timings'].items():
+            print(f"  {stage:>8} : {seconds:7.2f} s")
+
+    if args.at is None:
+        run_once(args.out)
+        return
+
+    while True:
+        target = _next_run(args.at)
+        time.sleep(max(0.0, (target - dt.datetime.now()).total_seconds()))
+        run_once(os.path.join(args.out, target.strftime('%Y-%m-%d')))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+# --- CLV PROBABILISTE : BG/NBD + GAMMA-GAMMA (NUMPY PUR) ---
+# Unité de temps des modèles : la semaine (durées en jours / 7)
+DAYS_PER_PERIOD = 7.0
+WEEKS_PER_MONTH = 52.0 / 12
+# Pénalité ridge sur les log-paramètres des ajustements (stabilise les petits échantillons)
+PENALIZER = 1e-4
+# Achats attendus : a = 1 est une singularité apparente de c / (a - 1) ; en deçà de cet écart,
+# on prend la limite (moyenne des valeurs en 1 - pas et 1 + pas)
+A_SINGULAR_TOL = 1e-6
+A_LIMIT_STEP = 1e-4
+
+# Coefficients de Lanczos (g = 7, n = 9) pour log Gamma vectorisé
+_LANCZOS_G = 7
+_LANCZOS_COEFS = np.array([
+    0.99999999999980993, 676.5203681218851, -1259.1392167224028, 771.32342877765313,
+    -176.61502916214059, 12.507343278686905, -0.13857109526572012,
+    9.9843695780195716e-6, 1.5056327351493116e-7,
+])
+
+def gammaln(x):
+    """log Gamma(x) vectorisé pour x > 0 (approximation de Lanczos, précision ~1e-13)."""
+    x = np.asarray(x, dtype='float64')
+    # Réflexion pour x < 0.5 : Gamma(x) Gamma(1-x) = pi / sin(pi x)
+    small = x < 0.5
+    z = np.where(small, 1.0 - x, x) - 1.0
+    series = np.full_like(z, _LANCZOS_COEFS[0])
+    for i in range(1, len(_LANCZOS_COEFS)):
+        series = series + _LANCZOS_COEFS[i] / (z + i)
+    t = z + _LANCZOS_G + 0.5
+    result = 0.5 * np.log(2 * np.pi) + (z + 0.5) * np.log(t) - t + np.log(series)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reflected = np.log(np.pi / np.abs(np.sin(np.pi * x))) - result
+    return np.where(small, reflected, result)
+
+def hyp2f1(a, b, c, z, max_terms=500, tol=1e-12):
+    """Fonction hypergéométrique 2F1(a, b; c; z) pour |z| < 1, série sommée en vectoriel."""
+    a, b, c, z = np.broadcast_arrays(*(np.asarray(v, dtype='float64') for v in (a, b, c, z)))
+    term = np.ones_like(z)
+    total = np.ones_like(z)
+    for k in range(max_terms):
+        term = term * (a + k) * (b + k) / ((c + k) * (k + 1)) * z
+        total = total + term
+        if np.all(np.abs(term) <= tol * np.abs(total)):
+            break
+    return total
+
+def digamma(x):
+    """Fonction digamma vectorisée pour x > 0 (récurrence puis développement asymptotique)."""
+    x = np.array(x, dtype='float64')
+    result = np.zeros_like(x)
+    # Récurrence psi(x) = psi(x + 1) - 1/x jusqu'à x >= 6
+    for _ in range(6):
+        small = x < 6
+        if not small.any():
+            break
+        result[small] -= 1.0 / x[small]
+        x[small] += 1.0
+    inv2 = 1.0 / (x * x)
+    result += (np.log(x) - 0.5 / x
+               - inv2 * (1 / 12 - inv2 * (1 / 120 - inv2 * (1 / 252 - inv2 * (1 / 240 - inv2 / 132)))))
+    return result
+
+def _penalized(fun_grad, penalizer):
+    """
+    Ajoute une pénalité ridge sur les log-paramètres : négligeable si les données identifient le modèle,
+    elle évite les dérives vers l'infini (ex. p -> 0, q, v -> inf) sur les petits périmètres.
+    """
+    def wrapped(log_params):
+        f, g = fun_grad(log_params)
+        return f + penalizer * (log_params @ log_params), g + 2 * penalizer * log_params
+    return wrapped
+
+def _minimize_bfgs(fun_grad, x0, max_iter=200, gtol=1e-7, ftol=1e-12):
+    """
+    Quasi-Newton BFGS avec recherche linéaire d'Armijo (quelques dizaines d'évaluations).
+    Arrêt aussi sur progrès relatif < `ftol` (vraisemblance plate, ex. modèle dégénéré).
+    """
+    with np.errstate(all='ignore'):
+        # Les pas d'essai peuvent sortir du domaine (log(0), débordement) : rejetés car f non fini
+        return _bfgs_loop(fun_grad, np.asarray(x0, dtype='float64'), max_iter, gtol, ftol)
+
+def _bfgs_loop(fun_grad, x, max_iter, gtol, ftol):
+    f, g = fun_grad(x)
+    H = np.eye(len(x))
+    for _ in range(max_iter):
+        if np.max(np.abs(g)) < gtol:
+            break
+        direction = -H @ g
+        if g @ direction >= 0:
+            # Direction non descendante : on repart de la plus forte pente
+            H = np.eye(len(x))
+            direction = -g
+        step = 1.0
+        while True:
+            x_new = x + step * direction
+            f_new, g_new = fun_grad(x_new)
+            if np.isfinite(f_new) and f_new <= f + 1e-4 * step * (g @ direction):
+                break
+            step *= 0.5
+            if step < 1e-10:
+                return x
+        s_k, y_k = x_new - x, g_new - g
+        sy = s_k @ y_k
+        if sy > 1e-12:
+            rho = 1.0 / sy
+            I = np.eye(len(x))
+            H = (I - rho * np.outer(s_k, y_k)) @ H @ (I - rho * np.outer(y_k, s_k)) + rho * np.outer(s_k, s_k)
+        converged = f - f_new <= ftol * (1 + abs(f))
+        x, f, g = x_new, f_new, g_new
+        if converged:
+            break
+    return x
+
+def clv_summary(df_transactions, analysis_date):
+    """
+    Statistiques par client pour les modèles (unité : semaine) :
+    frequency = achats répétés (Frequency - 1), recency = durée premier -> dernier achat,
+    T = ancienneté à la date d'analyse, monetary_value = panier moyen (Monetary / Frequency).
+    Fonctionne sur les lignes filtrées comme sur le cube facture.
+    """
+    summary = df_transactions.groupby('CustomerID').agg(
+        first=('TransactionDate', 'min'),
+        last=('TransactionDate', 'max'),
+        Frequency=('InvoiceNo', 'nunique'),
+        Monetary=('TotalSales', 'sum')
+    )
+    analysis_date = pd.Timestamp(analysis_date)
+    return pd.DataFrame({
+        'frequency': (summary['Frequency'] - 1).astype('float64'),
+        'recency': (summary['last'] - summary['first']).dt.days / DAYS_PER_PERIOD,
+        'T': (analysis_date - summary['first']).dt.days / DAYS_PER_PERIOD,
+        'monetary_value': summary['Monetary'] / summary['Frequency'],
+    }, index=summary.index)
+
+def _compress(*columns):
+    """Regroupe les clients identiques (mêmes statistiques) : la vraisemblance est pondérée."""
+    stacked = np.column_stack(columns)
+    unique, counts = np.unique(stacked, axis=0, return_counts=True)
+    return [unique[:, i] for i in range(unique.shape[1])], counts.astype('float64')
+
+def bgnbd_log_likelihood(params, x, t_x, T):
+    """Log-vraisemblance BG/NBD par client (Fader, Hardie & Lee 2005)."""
+    r, alpha, a, b = params
+    a1 = gammaln(r + x) - gammaln(r) + r * np.log(alpha)
+    a2 = gammaln(a + b) + gammaln(b + x) - gammaln(b) - gammaln(a + b + x)
+    a3 = -(r + x) * np.log(alpha + T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a4 = np.where(x > 0, np.log(a) - np.log(b + x - 1) - (r + x) * np.log(alpha + t_x), -np.inf)
+    return a1 + a2 + np.logaddexp(a3, a4)
+
+def fit_bgnbd(x, t_x, T, penalizer=PENALIZER):
+    """
+    Ajuste (r, alpha, a, b) par maximum de vraisemblance : gradient analytique, BFGS sur les
+    log-paramètres. Les termes Gamma ne dépendent que de x (entier) : calculés sur ses valeurs uniques.
+    """
+    (x, t_x, T), weights = _compress(x, t_x, T)
+    total = weights.sum()
+    x_unique, x_inv = np.unique(x, return_inverse=True)
+    has_repeat = x > 0
+    b_x1 = np.where(has_repeat, x - 1, 0.0)
+
+    def fun_grad(log_params):
+        r, alpha, a, b = np.exp(log_params)
+        lg = lambda v: gammaln(v)[x_inv]   # noqa: E731
+        dg = lambda v: digamma(v)[x_inv]   # noqa: E731
+        log_alpha_T, log_alpha_tx = np.log(alpha + T), np.log(alpha + t_x)
+
+        a1 = lg(r + x_unique) - gammaln(r) + r * np.log(alpha)
+        a2 = gammaln(a + b) + lg(b + x_unique) - gammaln(b) - lg(a + b + x_unique)
+        a3 = -(r + x) * log_alpha_T
+        a4 = np.where(has_repeat, np.log(a) - np.log(b + b_x1) - (r + x) * log_alpha_tx, -np.inf)
+        mix = np.logaddexp(a3, a4)
+        w3, w4 = np.exp(a3 - mix), np.exp(a4 - mix)
+        ll = a1 + a2 + mix
+
+        psi_ab_x = dg(a + b + x_unique)
+        d_r = dg(r + x_unique) - digamma(r) + np.log(alpha) - w3 * log_alpha_T - w4 * log_alpha_tx
+        d_alpha = r / alpha - w3 * (r + x) / (alpha + T) - w4 * (r + x) / (alpha + t_x)
+        d_a = digamma(a + b) - psi_ab_x + w4 / a
+        d_b = digamma(a + b) + dg(b + x_unique) - digamma(b) - psi_ab_x - w4 / (b + b_x1)
+
+        grad = np.array([weights @ d for d in (d_r, d_alpha, d_a, d_b)]) * np.array([r, alpha, a, b])
+        return -(weights @ ll) / total, -grad / total
+
+    r, alpha, a, b = np.exp(_minimize_bfgs(_penalized(fun_grad, penalizer), np.zeros(4)))
+    return {'r': r, 'alpha': alpha, 'a': a, 'b': b}
+
+def gamma_gamma_log_likelihood(params, x, m_x):
+    """Log-vraisemblance Gamma-Gamma par client (panier moyen m_x sur x transactions)."""
+    p, q, v = params
+    return (gammaln(p * x + q) - gammaln(p * x) - gammaln(q) + q * np.log(v)
+            + (p * x - 1) * np.log(m_x) + p * x * np.log(x) - (p * x + q) * np.log(x * m_x + v))
+
+def fit_gamma_gamma(x, m_x, penalizer=PENALIZER):
+    """Ajuste (p, q, v) sur les clients ayant au moins un achat répété et un panier positif."""
+    (x, m_x), weights = _compress(x, m_x)
+    total = weights.sum()
+    x_unique, x_inv = np.unique(x, return_inverse=True)
+    log_m, log_x = np.log(m_x), np.log(x)
+
+    def fun_grad(log_params):
+        p, q, v = np.exp(log_params)
+        log_xm_v = np.log(x * m_x + v)
+        ll = (gammaln(p * x_unique + q)[x_inv] - gammaln(p * x_unique)[x_inv] - gammaln(q) + q * np.log(v)
+              + (p * x - 1) * log_m + p * x * log_x - (p * x + q) * log_xm_v)
+        psi_pxq = digamma(p * x_unique + q)[x_inv]
+        d_p = x * (psi_pxq - digamma(p * x_unique)[x_inv] + log_m + log_x - log_xm_v)
+        d_q = psi_pxq - digamma(q) + np.log(v) - log_xm_v
+        d_v = q / v - (p * x + q) / (x * m_x + v)
+        grad = np.array([weights @ d for d in (d_p, d_q, d_v)]) * np.array([p, q, v])
+        return -(weights @ ll) / total, -grad / total
+
+    p, q, v = np.exp(_minimize_bfgs(_penalized(fun_grad, penalizer), np.zeros(3)))
+    return {'p': p, 'q': q, 'v': v}
+
+def probability_alive(params, x, t_x, T):
+    """Probabilité que le client soit encore actif à la date d'analyse."""
+    r, alpha, a, b = params['r'], params['alpha'], params['a'], params['b']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(x > 0, a / (b + x - 1) * ((alpha + T) / (alpha + t_x)) ** (r + x), 0.0)
+    return 1.0 / (1.0 + ratio)
+
+def expected_purchases(params, t, x, t_x, T):
+    """Nombre d'achats attendus sur les `t` prochaines périodes, conditionnellement à l'historique."""
+    r, alpha, a, b = params['r'], params['alpha'], params['a'], params['b']
+    if abs(a - 1) < A_SINGULAR_TOL:
+        return 0.5 * (expected_purchases(dict(params, a=1 - A_LIMIT_STEP), t, x, t_x, T)
+                      + expected_purchases(dict(params, a=1 + A_LIMIT_STEP), t, x, t_x, T))
+    z, x = np.broadcast_arrays(np.asarray(t / (alpha + T + t), dtype='float64'), np.asarray(x, dtype='float64'))
+    c = a + b + x - 1
+    # Transformation d'Euler : ((1-z)^(r+x)) 2F1(r+x, b+x; c; z) = (1-z)^(a-1) 2F1(a+b-1-r, a-1; c; z).
+    # La forme transformée converge bien plus vite pour les gros acheteurs, mais diverge numériquement
+    # si a et b sont très grands (ajustement dégénéré) : on retient par client la série au plus petit
+    # premier rapport de termes.
+    euler = np.abs((a + b - 1 - r) * (a - 1)) <= np.abs((r + x) * (b + x))
+    scaled_hyp = np.empty_like(z)
+    scaled_hyp[euler] = (1 - z[euler]) ** (a - 1) * hyp2f1(a + b - 1 - r, a - 1, c[euler], z[euler])
+    direct = ~euler
+    scaled_hyp[direct] = (1 - z[direct]) ** (r + x[direct]) * hyp2f1(r + x[direct], b + x[direct], c[direct], z[direct])
+    numerator = c / (a - 1) * (1 - scaled_hyp)
+    return numerator * probability_alive(params, x, t_x, T)
+
+def expected_average_value(params, x, m_x):
+    """Panier moyen attendu (Gamma-Gamma) ; retombe sur la moyenne de population si x = 0."""
+    p, q, v = params['p'], params['q'], params['v']
+    repeat = (x > 0) & (m_x > 0)
+    # q <= 1 : moyenne de population infinie, on prend le panier moyen observé des clients répétés
+    population_mean = p * v / (q - 1) if q > 1 else (m_x[repeat].mean() if repeat.any() else np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conditional = (v + x * m_x) * p / (p * x + q - 1)
+    return np.where(x > 0, conditional, population_mean)
+
+def _simulate_purchases(params, x, t_x, T, horizon, n_draws, rng):
+    """
+    Tirages Monte Carlo des achats futurs (clients × tirages) sur `horizon` périodes :
+    actif ~ Bernoulli(P(actif)), lambda ~ Gamma(r+x, alpha+T), p ~ Beta(a, b+x).
+    Chaque achat entraîne l'abandon avec probabilité p : le nombre d'achats est le minimum
+    d'un Poisson(lambda × horizon) et d'une géométrique(p), sans boucle sur les achats.
+    """
+    r, alpha, a, b = params['r'], params['alpha'], params['a'], params['b']
+    shape = (len(x), n_draws)
+    alive = rng.random(shape) < probability_alive(params, x, t_x, T)[:, None]
+    lam = rng.gamma((r + x)[:, None], 1.0 / (alpha + T)[:, None], size=shape)
+    # Bornage : un tirage Beta peut valoir exactement 0 par sous-dépassement
+    p_drop = np.clip(rng.beta(a, (b + x)[:, None], size=shape), 1e-12, 1.0)
+    purchases = np.minimum(rng.poisson(lam * horizon), rng.geometric(p_drop))
+    return np.where(alive, purchases, 0)
+
+@profiled
+def calculate_probabilistic_clv(df_transactions, analysis_date, horizon_months=12, margin=0.3,
+                                monthly_discount=0.01, n_draws=0, interval=0.9, seed=0,
+                                draw_batch=50_000):
+    """
+    CLV par client (BG/NBD pour le nombre d'achats, Gamma-Gamma pour le panier) sur `horizon_months`.
+
+    CLV = somme mensuelle actualisée de (achats attendus du mois × panier attendu × marge).
+    Si `n_draws` > 0, des tirages Monte Carlo (par lots de `draw_batch` clients) donnent
+    l'intervalle de confiance `interval` de la CLV de chaque client.
+    Retourne (DataFrame par client, paramètres ajustés), ou (None, {'non_estimable': raison}) si la
+    période ne permet pas d'ajuster les modèles (aucun achat répété) : jamais de CLV NaN.
+    """
+    summary = clv_summary(df_transactions, analysis_date)
+    x = summary['frequency'].to_numpy()
+    t_x = summary['recency'].to_numpy()
+    T = summary['T'].to_numpy()
+    m_x = summary['monetary_value'].to_numpy()
+
+    repeat = (x > 0) & (m_x > 0)
+    # Sans client répété, ni le taux d'achat ni le panier ne sont identifiables : les ajustements
+    # restent au point de départ (a = b = 1, p = q = v = 1) et donnent des CLV NaN
+    if not repeat.any():
+        return None, {'non_estimable': "aucun client n'a acheté plus d'une fois sur la période"}
+
+    bgnbd = fit_bgnbd(x, t_x, T)
+    gamma_gamma = fit_gamma_gamma(x[repeat], m_x[repeat])
+
+    value = expected_average_value(gamma_gamma, x, np.where(m_x > 0, m_x, 0.0))
+
+    # Achats attendus cumulés en fin de chaque mois, puis différences mensuelles actualisées
+    months = np.arange(1, horizon_months + 1)
+    cumulative = np.column_stack([expected_purchases(bgnbd, m * WEEKS_PER_MONTH, x, t_x, T) for m in months])
+    monthly = np.diff(np.column_stack([np.zeros(len(x)), cumulative]), axis=1)
+    discount = 1.0 / (1 + monthly_discount) ** months
+    clv = (monthly * discount).sum(axis=1) * value * margin
+    if not (np.isfinite(clv).all() and np.isfinite(cumulative[:, -1]).all()):
+        return None, {'non_estimable': "ajustement numériquement instable (CLV non finie)"}
+
+    result = pd.DataFrame({
+        'CustomerID': summary.index,
+        'P_Actif': probability_alive(bgnbd, x, t_x, T),
+        'Achats_Attendus': cumulative[:, -1],
+        'Panier_Attendu': value,
+        'CLV_Probabiliste': clv,
+    })
+
+    if n_draws > 0:
+        rng = np.random.default_rng(seed)
+        horizon = horizon_months * WEEKS_PER_MONTH
+        # Actualisation moyenne sur l'horizon (les tirages ne datent pas chaque achat)
+        avg_discount = discount.mean()
+        low, high = np.empty(len(x)), np.empty(len(x))
+        for start in range(0, len(x), draw_batch):
+            sl = slice(start, start + draw_batch)
+            counts = _simulate_purchases(bgnbd, x[sl], t_x[sl], T[sl], horizon, n_draws, rng)
+            draws = counts * (value[sl] * margin * avg_discount)[:, None]
+            low[sl], high[sl] = np.quantile(draws, [(1 - interval) / 2, (1 + interval) / 2], axis=1)
+        result['CLV_Borne_Basse'] = low
+        result['CLV_Borne_Haute'] = high
+
+    return result, {'bgnbd': bgnbd, 'gamma_gamma': gamma_gamma}
@@ -0,0 +1,113 @@
+import gzip
+import os
+import tempfile
+import zipfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from profiling import profiled
+
+# --- EXPORTS PAR MORCEAUX (CSV, CSV GZIP, PARQUET) ---
+# Format -> (extension, type MIME)
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+EXPORT_FORMAT_LABELS = {'csv': 'CSV', 'csv.gz': 'CSV compressé (gzip)', 'parquet': 'Parquet'}
+EXPORT_CHUNK_ROWS = 100_000
+ZIP_MIME = 'application/zip'
+
+def _chunks(df, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield start, df.iloc[start:start + chunk_rows]
+
+@profiled
+def write_export(df, file_obj, fmt='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Écrit `df` dans un fichier binaire ouvert, par tranches de `chunk_rows` lignes.
+
+    Seule une tranche est encodée à la fois (texte CSV ou table Arrow) : le surcoût mémoire
+    reste borné quelle que soit la taille de la table, au lieu de la chaîne CSV complète
+    plus sa copie en octets.
+    """
+    if fmt == 'parquet':
+        writer = None
+        try:
+            for _, chunk in _chunks(df, chunk_rows):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(file_obj, table.schema, compression='zstd')
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt}")
+    stream = gzip.GzipFile(fileobj=file_obj, mode='wb', compresslevel=6, mtime=0) if fmt == 'csv.gz' else file_obj
+    try:
+        for start, chunk in _chunks(df, chunk_rows):
+            stream.write(chunk.to_csv(index=False, header=(start == 0)).encode('utf-8'))
+    finally:
+        if stream is not file_obj:
+            stream.close()
+
+def export_to_file(df, path, fmt='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """Écrit `df` sur disque (écriture par tranches). Retourne le chemin."""
+    with open(path, 'wb') as f:
+        write_export(df, f, fmt, chunk_rows)
+    return path
+
+def export_parts(df, directory, stem, fmt='csv', part_rows=1_000_000, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Découpe un export volumineux en fichiers de `part_rows` lignes au plus (stem_part001.csv...)."""
+    ext = EXPORT_FORMATS[fmt][0]
+    n_parts = max(1, -(-len(df) // part_rows))
+    return [export_to_file(df.iloc[i * part_rows:(i + 1) * part_rows],
+                           os.path.join(directory, f"{stem}_part{i + 1:03d}{ext}"), fmt, chunk_rows)
+            for i in range(n_parts)]
+
+def export_by_priority(df_rfm, directory, stem='plan_action', fmt='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """Liste activable segmentée : un fichier par Priorité CRM (stem_priorite_1.csv...)."""
+    ext = EXPORT_FORMATS[fmt][0]
+    return [export_to_file(group, os.path.join(directory, f"{stem}_priorite_{int(priority)}{ext}"), fmt, chunk_rows)
+            for priority, group in df_rfm.groupby('Priorité_CRM', sort=True)]
+
+def _spool(write):
+    """
+    Contenu (bytes) d'un fichier temporaire écrit par `write(f)`. L'encodage se fait par tranches sur
+    disque ; seul le résultat final est relu en mémoire (st.download_button le conserve de toute façon),
+    puis le fichier est fermé et supprimé.
+    """
+    fd, path = tempfile.mkstemp(prefix='export_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def spool_export(df, fmt='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """Export encodé via un fichier temporaire ; les octets sont à passer tels quels à st.download_button."""
+    return _spool(lambda f: write_export(df, f, fmt, chunk_rows))
+
+def spool_zip(write_files):
+    """
+    Archive zip temporaire d'un jeu de fichiers. `write_files(directory)` écrit les fichiers
+    dans un dossier temporaire et retourne leurs chemins (ex. export_parts, export_by_priority).
+    """
+    def write(f):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_files(directory)
+            with zipfile.ZipFile(f, 'w') as archive:
+                for path in paths:
+                    # Fichiers déjà compressés (gzip, parquet) : stockés tels quels
+                    compress = zipfile.ZIP_DEFLATED if path.endswith('.csv') else zipfile.ZIP_STORED
+                    archive.write(path, os.path.basename(path), compress_type=compress)
+    return _spool(write)
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from utils import (RFM_COLUMNS, read_transactions_csv, prepare_transactions, apply_filters, score_rfm,
+                   cohort_matrices, customer_period_activity)
+
+# --- AGRÉGATS INCRÉMENTAUX RFM & COHORTES ---
+class IncrementalRFMStore:
+    """
+    Agrégat client alimenté par lots de transactions successifs (ex. factures du jour).
+
+    Chaque lot doit déjà être filtré (sortie de `apply_filters`) avec la même configuration
+    que les lots précédents. L'état conservé est compact :
+      - `customers` : une ligne par client (dernier / premier achat, nb factures, CA cumulé) ;
+      - `activity` : une ligne par (client, période active) avec le CA de la période, d'où sont
+        dérivées les matrices cohorte × âge (effectifs et CA), y compris pour des lots non chronologiques ;
+      - les couples (client, facture) déjà vus, rangés par jour de facture, pour une Frequency exacte
+        même si une facture est répartie sur plusieurs lots.
+    Le scoring par quintiles n'est recalculé que sur la table client, jamais sur les transactions.
+
+    Coût d'un lot : O(lignes du lot + clients + couples (client, période) + factures déjà vues aux jours
+    du lot). Toutes les lignes d'une facture portant la même date, un lot n'est comparé qu'aux factures
+    de ses propres jours, et non à tout l'historique. Avec `invoice_window_days`, les jours antérieurs de plus de N jours au
+    dernier jour reçu sont oubliés : mémoire bornée, la Frequency restant exacte tant que les lignes
+    d'une facture arrivent dans cette fenêtre (None : tout est conservé).
+    """
+
+    def __init__(self, cohort_freq='M', invoice_window_days=None):
+        self.cohort_freq = cohort_freq
+        self.invoice_window_days = invoice_window_days
+        self.customers = pd.DataFrame(
+            {
+                'LastPurchase': pd.Series(dtype='datetime64[ns]'),
+                'FirstPurchase': pd.Series(dtype='datetime64[ns]'),
+                'Frequency': pd.Series(dtype='int64'),
+                'Monetary': pd.Series(dtype='float64'),
+            },
+            index=pd.Index([], dtype='int64', name='CustomerID'),
+        )
+        self.activity = pd.DataFrame({
+            'CustomerID': pd.Series(dtype='int64'),
+            'Period': pd.Series(dtype='int64'),
+            'TotalSales': pd.Series(dtype='float64'),
+        })
+        self._invoices = {}  # jour (datetime64[D]) -> MultiIndex (CustomerID, InvoiceNo) des factures vues
+        self._cohorts = None
+        self.n_transactions = 0
+
+    def update(self, df_batch):
+        """Intègre un lot de transactions filtrées. Retourne le store pour chaînage."""
+        if df_batch.empty:
+            return self
+
+        # 1. Factures nouvelles par client (Frequency exacte), comparées aux seuls jours du lot
+        pairs = df_batch[['CustomerID', 'InvoiceNo', 'TransactionDate']].drop_duplicates(['CustomerID', 'InvoiceNo'])
+        pairs = pairs.assign(InvoiceNo=pairs['InvoiceNo'].astype(str),
+                             Day=pairs['TransactionDate'].to_numpy().astype('datetime64[D]'))
+        new_customers = []
+        for day, day_pairs in pairs.groupby('Day', sort=False):
+            day_pairs = pd.MultiIndex.from_frame(day_pairs[['CustomerID', 'InvoiceNo']])
+            seen = self._invoices.get(day)
+            if seen is not None:
+                day_pairs = day_pairs.difference(seen)
+                self._invoices[day] = seen.append(day_pairs)
+            else:
+                self._invoices[day] = day_pairs
+            new_customers.append(day_pairs.get_level_values('CustomerID'))
+        new_invoices = pd.Series(np.concatenate(new_customers)).value_counts()
+        self._forget_old_invoices()
+
+        # 2. Agrégats client du lot, fusionnés avec l'état existant
+        batch_customers = df_batch.groupby('CustomerID').agg(
+            LastPurchase=('TransactionDate', 'max'),
+            FirstPurchase=('TransactionDate', 'min'),
+            Monetary=('TotalSales', 'sum')
+        )
+        batch_customers['Frequency'] = new_invoices.reindex(batch_customers.index, fill_value=0)
+
+        merged = pd.concat([self.customers, batch_customers])
+        self.customers = merged.groupby(level=0).agg(
+            LastPurchase=('LastPurchase', 'max'),
+            FirstPurchase=('FirstPurchase', 'min'),
+            Frequency=('Frequency', 'sum'),
+            Monetary=('Monetary', 'sum')
+        )
+        self.customers.index.name = 'CustomerID'
+
+        # 3. Activité (client, période) pour les cohortes
+        batch_activity = customer_period_activity(df_batch, self.cohort_freq)
+        activity = pd.concat([self.activity, batch_activity], ignore_index=True)
+        self.activity = (activity.groupby(['CustomerID', 'Period'])['TotalSales']
+                         .sum().reset_index())
+
+        self._cohorts = None
+        self.n_transactions += len(df_batch)
+        return self
+
+    def _forget_old_invoices(self):
+        if self.invoice_window_days is None or not self._invoices:
+            return
+        cutoff = max(self._invoices) - np.timedelta64(self.invoice_window_days, 'D')
+        for day in [day for day in self._invoices if day < cutoff]:
+            del self._invoices[day]
+
+    @property
+    def first_purchase_month(self):
+        """Mois de première commande par client (mois de cohorte)."""
+        return self.customers['FirstPurchase'].dt.to_period('M')
+
+    def rfm(self, analysis_date):
+        """Équivalent de `calculate_rfm` sur l'ensemble des lots ingérés."""
+        if self.customers.empty:
+            return pd.DataFrame(columns=RFM_COLUMNS)
+
+        rfm_df = pd.DataFrame({
+            'CustomerID': self.customers.index,
+            'Recency': (pd.Timestamp(analysis_date) - self.customers['LastPurchase']).dt.days.to_numpy(),
+            'Frequency': self.customers['Frequency'].to_numpy(),
+            'Monetary': self.customers['Monetary'].to_numpy(),
+        })
+        return score_rfm(rfm_df)
+
+    def cohorts(self):
+        """Équivalent de `calculate_cohort_retention` : (rétention %, ARPU, tailles de cohortes)."""
+        if self._cohorts is None:
+            self._cohorts = cohort_matrices(self.activity, self.cohort_freq)
+        return self._cohorts
+
+# --- INGESTION EN FLUX (CSV PAR MORCEAUX) ---
+STREAM_COLUMNS = {'Customer ID', 'CustomerID', 'Invoice', 'InvoiceNo', 'InvoiceDate',
+                  'TotalAmount', 'TotalSales', 'Country'}
+
+def _iter_filtered_chunks(file_path, start_date, end_date, country_filter, returns_mode, chunksize):
+    """Lit le CSV par morceaux et applique nettoyage + filtres date/pays/retours à chacun."""
+    reader = read_transactions_csv(file_path, columns=STREAM_COLUMNS, chunksize=chunksize)
+    for chunk in reader:
+        chunk = prepare_transactions(chunk)
+        chunk = apply_filters(chunk, start_date, end_date, country_filter, returns_mode, 0)
+        if not chunk.empty:
+            yield chunk
+
+def stream_csv_to_store(file_path, start_date, end_date, country_filter='Global', returns_mode='Inclure',
+                        min_order_val=0, chunksize=1_000_000, store=None):
+    """
+    Construit un IncrementalRFMStore depuis un CSV sans jamais le charger en entier.
+    Mémoire crête ~ un morceau + les agrégats (clients, factures), quel que soit le nombre de lignes.
+
+    Le seuil de commande porte sur le total de la facture, qui peut être réparti sur plusieurs
+    morceaux : dans ce cas une première passe calcule les totaux par facture.
+    """
+    store = store if store is not None else IncrementalRFMStore()
+    args = (file_path, start_date, end_date, country_filter, returns_mode, chunksize)
+
+    valid_invoices = None
+    if min_order_val > 0:
+        invoice_totals = pd.Series(dtype='float64')
+        for chunk in _iter_filtered_chunks(*args):
+            chunk_totals = chunk.groupby('InvoiceNo', observed=True)['TotalSales'].sum()
+            invoice_totals = invoice_totals.add(chunk_totals, fill_value=0)
+        valid_invoices = invoice_totals.index[invoice_totals >= min_order_val]
+
+    for chunk in _iter_filtered_chunks(*args):
+        if valid_invoices is not None:
+            chunk = chunk[chunk['InvoiceNo'].isin(valid_invoices)]
+        store.update(chunk)
+
+    return store
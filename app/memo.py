@@ -0,0 +1,127 @@
+import datetime as dt
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# --- MÉMOÏSATION DES ÉTAPES DU PIPELINE (GRAPHE DE CALCUL) ---
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 Mo
+
+class Node:
+    """Résultat d'une étape du graphe : la valeur calculée et la clé qui l'identifie."""
+    __slots__ = ('value', 'key')
+
+    def __init__(self, value, key):
+        self.value = value
+        self.key = key
+
+def _param_key(value):
+    """
+    Clé hachable d'un paramètre d'étape. Un `Node` est représenté par sa clé (et non son contenu) :
+    une étape dépend ainsi exactement des paramètres de ses étapes amont.
+    """
+    if isinstance(value, Node):
+        return ('node', value.key)
+    if value is None or isinstance(value, (str, bool, int, float, np.generic)):
+        return value
+    if isinstance(value, (dt.date, dt.datetime, pd.Timestamp)):
+        return pd.Timestamp(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_param_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _param_key(v)) for k, v in value.items()))
+    if isinstance(value, np.ndarray):
+        return ('array', value.dtype.str, value.shape, value.tobytes())
+    raise TypeError(f"Paramètre non mémoïsable : {type(value).__name__} (passer un Node pour les tables).")
+
+def estimate_nbytes(value):
+    """Taille mémoire approximative d'un résultat (DataFrame, Series, ndarray ou tuple de ceux-ci)."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    return 64
+
+class ComputationGraph:
+    """
+    Cache LRU borné des étapes du pipeline, partagé entre les reruns Streamlit.
+
+    Chaque appel `stage(nom, fonction, *args, **kwargs)` est identifié par le nom de l'étape et
+    ses paramètres exacts ; les entrées issues d'une autre étape sont passées sous forme de `Node`
+    et contribuent par leur clé. Modifier un filtre change la clé de l'étape de filtrage et donc
+    celles de toutes les étapes en aval ; modifier un paramètre du simulateur ne touche aucune clé
+    des étapes amont, qui sont servies depuis le cache.
+
+    Le cache est borné en nombre d'entrées et en mémoire (taille estimée des résultats) ;
+    les entrées les moins récemment utilisées sont évincées en premier. Les résultats servis
+    sont partagés : l'appelant ne doit pas les modifier en place.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clé -> (valeur, taille estimée)
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.counters = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, name, counter):
+        stats = self.counters.setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0})
+        stats[counter] += 1
+
+    def stage(self, name, func, *args, **kwargs):
+        """Exécute `func` (ou sert son résultat depuis le cache) et retourne un `Node`."""
+        key = (name, _param_key(args), _param_key(kwargs))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(name, 'hits')
+                return Node(self._entries[key][0], key)
+            self._count(name, 'misses')
+
+        value = func(*[a.value if isinstance(a, Node) else a for a in args],
+                     **{k: v.value if isinstance(v, Node) else v for k, v in kwargs.items()})
+        size = estimate_nbytes(value)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.nbytes += size
+                self._evict()
+        return Node(value, key)
+
+    def _evict(self):
+        # On conserve toujours au moins l'entrée la plus récente, même si elle dépasse le plafond seule
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            (name, _, _), (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self._count(name, 'evictions')
+
+    def clear(self):
+        """Vide le cache (les compteurs sont conservés)."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Compteurs par étape : succès, échecs, évictions, entrées présentes et mémoire occupée."""
+        with self._lock:
+            rows = {name: dict(counters, entries=0, bytes=0) for name, counters in self.counters.items()}
+            for (name, _, _), (_, size) in self._entries.items():
+                rows[name]['entries'] += 1
+                rows[name]['bytes'] += size
+        stats = pd.DataFrame.from_dict(rows, orient='index',
+                                       columns=['hits', 'misses', 'evictions', 'entries', 'bytes'])
+        stats.index.name = 'Étape'
+        return stats
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from utils import RFM_COLUMNS, aggregate_rfm, score_rfm
+
+# --- RFM PARALLÈLE (SHARDS CLIENTS, MÉMOIRE PARTAGÉE) ---
+# Colonnes transmises aux workers : (nom dans le worker, dtype)
+SHARD_COLUMNS = {
+    'CustomerID': 'int64',
+    'TransactionDate': 'datetime64[ns]',
+    'InvoiceNo': 'int64',     # codes entiers de facture (InvoiceCode)
+    'TotalSales': 'float64',
+}
+# Nombre de workers par défaut plafonné (au-delà, la fusion et la copie en mémoire partagée dominent)
+MAX_WORKERS = 8
+# Lignes minimales par worker : en deçà, démarrage des processus et IPC coûtent plus que l'agrégation
+# (ex. le cube facture d'Online Retail II, ~40 000 lignes, reste sur le calcul exact)
+MIN_ROWS_PER_WORKER = 250_000
+
+def safe_start_method():
+    """
+    Méthode de démarrage sans fork, pour les processus hôtes multi-threads (Streamlit) : forkserver si
+    disponible, sinon spawn. Un fork depuis un processus à plusieurs threads peut hériter de verrous tenus.
+    """
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+@contextmanager
+def _main_module_hidden():
+    """
+    Streamlit installe le script de l'application comme module __main__ : forkserver / spawn le
+    réexécuteraient dans chaque worker. Les workers n'en ont pas besoin (fonction de module) : un
+    __main__ vide est exposé le temps de leur démarrage.
+    """
+    main_module = sys.modules.get('__main__')
+    placeholder = types.ModuleType('__main__')
+    sys.modules['__main__'] = placeholder
+    try:
+        yield
+    finally:
+        if sys.modules.get('__main__') is placeholder:
+            sys.modules['__main__'] = main_module
+
+def _customer_shards(customer_ids, n_shards):
+    """Partition par hachage multiplicatif de CustomerID (évite les shards déséquilibrés)."""
+    hashed = (customer_ids.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    return (hashed % np.uint64(n_shards)).astype(np.int64)
+
+def _aggregate_shard(blocks, n_rows, lo, hi, analysis_date):
+    """Worker : rattache les blocs partagés, agrège les lignes [lo, hi) sans copie des colonnes."""
+    handles, columns = [], {}
+    try:
+        for col, (name, dtype) in blocks.items():
+            shm = shared_memory.SharedMemory(name=name)
+            handles.append(shm)
+            columns[col] = np.ndarray((n_rows,), dtype=dtype, buffer=shm.buf)[lo:hi]
+        shard = aggregate_rfm(pd.DataFrame(columns, copy=False), analysis_date)
+        # Les vues sur la mémoire partagée doivent être libérées avant close()
+        return shard.copy()
+    finally:
+        columns.clear()
+        for shm in handles:
+            shm.close()
+
+def calculate_rfm_parallel(df_transactions, analysis_date, n_workers=None, mp_context=None,
+                           min_rows_per_worker=MIN_ROWS_PER_WORKER):
+    """
+    Calcule R, F, M, scores, segments en répartissant l'agrégation client sur `n_workers` processus.
+
+    Les transactions sont partitionnées par hachage de CustomerID (un client = un shard), les colonnes
+    sont copiées une seule fois en mémoire partagée et chaque worker agrège sa tranche. Les shards
+    agrégés sont fusionnés puis triés avant le scoring : les quintiles restent calculés globalement
+    (exacts) sur la table client, d'où un résultat identique à `calculate_rfm`.
+    `n_workers` : défaut nombre de CPU plafonné à MAX_WORKERS, réduit pour garder `min_rows_per_worker`
+    lignes par worker (0 : pas de réduction) ; un seul worker retombe sur le calcul exact sans processus.
+    `mp_context` : contexte multiprocessing ou nom de méthode (safe_start_method() depuis un processus
+    multi-threads) ; défaut : celui de la plateforme.
+    """
+    if df_transactions.empty:
+        return pd.DataFrame(columns=RFM_COLUMNS)
+
+    n_workers = n_workers or min(os.cpu_count() or 1, MAX_WORKERS)
+    if min_rows_per_worker:
+        n_workers = min(n_workers, len(df_transactions) // min_rows_per_worker)
+    if n_workers <= 1:
+        return score_rfm(aggregate_rfm(df_transactions, analysis_date))
+
+    if 'InvoiceCode' in df_transactions.columns:
+        invoice_codes = df_transactions['InvoiceCode'].to_numpy()
+    else:
+        invoice_codes = pd.factorize(df_transactions['InvoiceNo'])[0]
+    arrays = {
+        'CustomerID': df_transactions['CustomerID'].to_numpy(),
+        'TransactionDate': df_transactions['TransactionDate'].to_numpy(),
+        'InvoiceNo': invoice_codes,
+        'TotalSales': df_transactions['TotalSales'].to_numpy(),
+    }
+
+    # Regroupement des lignes par shard : chaque worker lit une tranche contiguë
+    shards = _customer_shards(arrays['CustomerID'], n_workers)
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(n_workers + 1))
+    n_rows = len(order)
+
+    handles, blocks = [], {}
+    try:
+        for col, dtype in SHARD_COLUMNS.items():
+            values = np.asarray(arrays[col]).astype(dtype, copy=False)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+            handles.append(shm)
+            np.take(values, order, out=np.ndarray((n_rows,), dtype=dtype, buffer=shm.buf))
+            blocks[col] = (shm.name, dtype)
+
+        if isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context) as pool:
+            # Les workers démarrent à la soumission des tâches
+            with _main_module_hidden():
+                futures = [pool.submit(_aggregate_shard, blocks, n_rows, bounds[i], bounds[i + 1], analysis_date)
+                           for i in range(n_workers) if bounds[i + 1] > bounds[i]]
+            parts = [future.result() for future in futures]
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    # Fusion des shards : ordre CustomerID identique au groupby global
+    rfm_df = pd.concat(parts, ignore_index=True).sort_values('CustomerID', ignore_index=True)
+    rfm_df['CustomerID'] = rfm_df['CustomerID'].astype(df_transactions['CustomerID'].dtype)
+    return score_rfm(rfm_df)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from profiling import PROFILER, profiled
+
+# --- PRÉPARATION DES GRAPHIQUES (BUDGET DE POINTS & TAILLE DES PAYLOADS) ---
+DEFAULT_POINT_BUDGET = 20_000
+# Au-delà de SAMPLE_LIMIT x budget, le mode automatique agrège en histogramme 2D plutôt que d'échantillonner
+SAMPLE_LIMIT = 10
+HEATMAP_TEXT_BUDGET = 2_500  # cellules au-delà desquelles les valeurs ne sont plus écrites dans la heatmap
+SCATTER_MODES = {
+    'auto': 'Automatique',
+    'points': 'Tous les points',
+    'sample': 'Échantillon stratifié',
+    'bins': 'Histogramme 2D',
+}
+
+@profiled
+def figure_payload_bytes(fig):
+    """Taille (octets) du JSON Plotly envoyé au navigateur pour cette figure."""
+    return len(fig.to_json(validate=False).encode('utf-8'))
+
+def figure_point_count(fig):
+    """Nombre de points des traces (plus long tableau de données de chaque trace), sans sérialiser la figure."""
+    total = 0
+    for trace in fig.data:
+        sizes = [np.size(trace[attr]) for attr in ('x', 'y', 'z', 'values', 'labels')
+                 if attr in trace and trace[attr] is not None]
+        total += max(sizes, default=0)
+    return total
+
+def payload_caption(fig, n_points=None):
+    """
+    Légende d'un graphique. La taille exacte du JSON (fig.to_json, aussi coûteux que l'envoi) n'est mesurée
+    que si l'instrumentation est active ; sinon seul le nombre de points est affiché.
+    """
+    n_points = figure_point_count(fig) if n_points is None else n_points
+    if not PROFILER.enabled:
+        return f"Graphique : {n_points:,} points"
+    return f"Payload graphique : {figure_payload_bytes(fig) / 1024:,.0f} Ko ({n_points:,} points)"
+
+def stratified_sample(df, by, n, seed=0):
+    """
+    Échantillon de `n` lignes respectant les proportions de chaque strate `by` (répartition par plus forts restes,
+    au moins une ligne par strate non vide quand n le permet). Déterministe pour un `seed` donné.
+    """
+    if len(df) <= n:
+        return df
+    sizes = df.groupby(by, observed=True).size()
+    sizes = sizes[sizes > 0]
+    quotas = sizes * n / sizes.sum()
+    alloc = np.floor(quotas).astype(int)
+    if n >= len(sizes):
+        alloc = alloc.clip(lower=1)
+    remainder = n - alloc.sum()
+    if remainder > 0:
+        extra = (quotas - np.floor(quotas)).sort_values(ascending=False).index[:remainder]
+        alloc[extra] += 1
+    alloc = np.minimum(alloc, sizes)
+
+    rng = np.random.default_rng(seed)
+    strata = df[by].astype('category')  # sans copie si la colonne est déjà catégorielle
+    codes, categories = strata.cat.codes.to_numpy(), strata.cat.categories
+    # Tirage sans remise par strate : clé aléatoire triée, on garde les `alloc` premières lignes de chaque strate
+    keys = rng.random(len(df))
+    order = np.lexsort((keys, codes))
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(categories)))
+    ranks = np.arange(len(df)) - starts[sorted_codes]
+    quota_by_code = np.zeros(len(categories), dtype=np.int64)
+    quota_by_code[categories.get_indexer(alloc.index)] = alloc.to_numpy()
+    keep = np.sort(order[ranks < quota_by_code[sorted_codes]])
+    return df.iloc[keep]
+
+def binned_scatter(df, x, y, color, value, bins=40):
+    """
+    Histogramme 2D par strate : une bulle par (case x, case y, `color`) au centre de la case, avec l'effectif
+    et la somme / moyenne exactes de `value` sur les clients de la case.
+    """
+    grid = {}
+    for axis in (x, y):
+        values = df[axis].to_numpy(dtype='float64')
+        edges = np.linspace(values.min(), values.max(), bins + 1) if len(values) else np.zeros(bins + 1)
+        idx = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bins - 1)
+        grid[axis] = (edges[idx] + edges[idx + 1]) / 2 if edges[-1] > edges[0] else values
+    binned = pd.DataFrame({x: grid[x], y: grid[y], color: df[color].to_numpy(), value: df[value].to_numpy()})
+    agg = binned.groupby([x, y, color], observed=True)[value].agg(['size', 'sum', 'mean']).reset_index()
+    return agg.rename(columns={'size': 'Clients', 'sum': f'{value}_Total', 'mean': f'{value}_Moyen'})
+
+def resolve_scatter_mode(n_rows, budget=DEFAULT_POINT_BUDGET, mode='auto'):
+    """Mode effectif : tous les points sous le budget, sinon échantillon stratifié puis histogramme 2D."""
+    if mode != 'auto':
+        return mode
+    if n_rows <= budget:
+        return 'points'
+    return 'sample' if n_rows <= SAMPLE_LIMIT * budget else 'bins'
+
+def segment_legend_labels(df, color, value):
+    """Libellés de légende avec effectifs et totaux exacts (calculés sur toute la population)."""
+    totals = df.groupby(color, observed=True)[value].agg(['size', 'sum'])
+    return {segment: f"{segment} (n={row['size']:,.0f}, £ {row['sum']:,.0f})" for segment, row in totals.iterrows()}
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+# --- INSTRUMENTATION DES ÉTAPES (TEMPS, LIGNES, MÉMOIRE) ---
+DEFAULT_MAX_RECORDS = 5_000
+DEFAULT_WINDOW = 50  # derniers appels de chaque étape pris en compte dans les percentiles glissants
+SUMMARY_COLUMNS = ['calls', 'last_s', 'p50_s', 'p90_s', 'p99_s', 'rows_in', 'rows_out', 'peak_mb_p90']
+
+def row_count(value):
+    """Nombre de lignes d'une entrée / d'un résultat (DataFrame, Series, ndarray ; 1er élément d'un tuple)."""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    if isinstance(value, tuple) and value:
+        return row_count(value[0])
+    return None
+
+class _NullSpan:
+    """Mesure inactive (instrumentation désactivée) : aucun chronométrage, aucun enregistrement."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    """Mesure d'une étape, à utiliser comme contexte ; `rows_out` peut être renseigné avant la sortie."""
+    __slots__ = ('profiler', 'name', 'rows_in', 'rows_out', 'parent', 'depth', 't0', 'mem_start', 'max_seen')
+
+    def __init__(self, profiler, name, rows_in=None):
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.mem_start = None
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._exit(self, exc_type)
+        return False
+
+class StageProfiler:
+    """
+    Journal des étapes du pipeline : temps mur, lignes en entrée / sortie et pic de mémoire allouée.
+
+    Désactivé par défaut : `span()` retourne alors une mesure vide et les fonctions décorées par
+    `profiled` appellent directement la fonction (un seul test d'attribut). Les étapes imbriquées
+    sont enregistrées avec leur parent ; le temps d'un parent inclut celui de ses enfants.
+
+    La mémoire est mesurée avec tracemalloc (allocations Python et NumPy, hors Arrow) si `track_memory`
+    est actif, ce qui ralentit les allocations. L'état est partagé par tout le processus : avec plusieurs
+    sessions simultanées, les pics mémoire des étapes concurrentes se mélangent.
+    """
+
+    def __init__(self, max_records=DEFAULT_MAX_RECORDS):
+        self.enabled = False
+        self.track_memory = False
+        self.records = deque(maxlen=max_records)
+        self.run_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._owns_tracemalloc = False
+
+    def configure(self, enabled, track_memory=True):
+        """Active / désactive l'instrumentation (et tracemalloc si la mémoire est suivie)."""
+        track_memory = bool(enabled and track_memory)
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        elif not track_memory and self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        self.track_memory = track_memory
+        self.enabled = bool(enabled)
+
+    def begin_run(self):
+        """Début d'un rerun : les mesures suivantes de ce thread portent son numéro."""
+        with self._lock:
+            self.run_id += 1
+            self._local.run = self.run_id
+        self._local.run_t0 = time.perf_counter()
+        return self._local.run
+
+    def run_elapsed(self):
+        """Temps écoulé depuis `begin_run` dans ce thread (s), ou None."""
+        t0 = getattr(self._local, 'run_t0', None)
+        return None if t0 is None else time.perf_counter() - t0
+
+    def span(self, name, rows_in=None):
+        """Contexte mesurant une étape (sans effet si l'instrumentation est désactivée)."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, rows_in)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, span):
+        stack = self._stack()
+        span.parent = stack[-1].name if stack else None
+        span.depth = len(stack)
+        if self.track_memory and tracemalloc.is_tracing():
+            # Un seul compteur de pic dans tracemalloc : on le reporte sur le parent avant de le remettre à zéro
+            current, peak = tracemalloc.get_traced_memory()
+            if stack and stack[-1].mem_start is not None:
+                stack[-1].max_seen = max(stack[-1].max_seen, peak)
+            tracemalloc.reset_peak()
+            span.mem_start = span.max_seen = current
+        stack.append(span)
+        span.t0 = time.perf_counter()
+
+    def _exit(self, span, exc_type):
+        seconds = time.perf_counter() - span.t0
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        peak_bytes = None
+        if span.mem_start is not None and tracemalloc.is_tracing():
+            peak = max(span.max_seen, tracemalloc.get_traced_memory()[1])
+            peak_bytes = max(0, peak - span.mem_start)
+            if stack and stack[-1].mem_start is not None:
+                stack[-1].max_seen = max(stack[-1].max_seen, peak)
+        record = {
+            'run': getattr(self._local, 'run', None),
+            'time': round(time.time(), 3),
+            'stage': span.name,
+            'parent': span.parent,
+            'depth': span.depth,
+            'seconds': round(seconds, 6),
+            'rows_in': span.rows_in,
+            'rows_out': span.rows_out,
+            'peak_bytes': peak_bytes,
+            'error': exc_type.__name__ if exc_type else None,
+        }
+        with self._lock:
+            self.records.append(record)
+
+    def snapshot(self):
+        """Copie des enregistrements (liste de dict), du plus ancien au plus récent."""
+        with self._lock:
+            return list(self.records)
+
+    def last_run(self):
+        """Mesures du rerun courant de ce thread, dans l'ordre de fin des étapes."""
+        run = getattr(self._local, 'run', None)
+        records = [r for r in self.snapshot() if run is not None and r['run'] == run]
+        return pd.DataFrame(records, columns=['stage', 'parent', 'seconds', 'rows_in', 'rows_out', 'peak_bytes'])
+
+    def summary(self, window=DEFAULT_WINDOW):
+        """Percentiles glissants par étape, sur ses `window` derniers appels (temps en s, pic en Mo)."""
+        records = pd.DataFrame(self.snapshot())
+        if records.empty:
+            return pd.DataFrame(columns=SUMMARY_COLUMNS).rename_axis('Étape')
+        recent = records.groupby('stage', sort=False).tail(window)
+        by_stage = recent.groupby('stage', sort=False)
+        seconds = by_stage['seconds']
+        summary = pd.DataFrame({
+            'calls': records.groupby('stage', sort=False).size(),
+            'last_s': seconds.last(),
+            'p50_s': seconds.quantile(0.5),
+            'p90_s': seconds.quantile(0.9),
+            'p99_s': seconds.quantile(0.99),
+            'rows_in': by_stage['rows_in'].last(),
+            'rows_out': by_stage['rows_out'].last(),
+            'peak_mb_p90': by_stage['peak_bytes'].quantile(0.9) / 1024 ** 2,
+        })
+        summary.index.name = 'Étape'
+        return summary.sort_values('p90_s', ascending=False)
+
+    def to_jsonl(self):
+        """Enregistrements au format JSON lines (octets), un objet par étape mesurée."""
+        return ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in self.snapshot()).encode('utf-8')
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+PROFILER = StageProfiler()
+
+def profiled(func):
+    """
+    Instrumente une fonction du pipeline sous son nom : lignes du premier argument en entrée,
+    lignes du résultat en sortie. Appel direct quand l'instrumentation est désactivée.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return func(*args, **kwargs)
+        with Span(PROFILER, name, row_count(args[0]) if args else None) as span:
+            result = func(*args, **kwargs)
+            span.rows_out = row_count(result)
+        return result
+    return wrapper
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+from utils import RFM_COLUMNS, aggregate_rfm, score_rfm
+
+# --- SKETCHS DE QUANTILES FUSIONNABLES (SCORING RFM APPROCHÉ) ---
+RFM_METRICS = ['Recency', 'Frequency', 'Monetary']
+QUINTILE_PERCENTS = np.linspace(0, 1, 6) * 100.0  # mêmes bornes que pd.qcut(x, 5)
+# Métriques entières : histogramme exact (un compteur par valeur), donc scores R et F identiques au calcul exact
+INTEGER_METRICS = ['Recency', 'Frequency']
+# Précision relative par défaut du sketch Monetary (seule métrique approchée)
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+class QuantileSketch:
+    """
+    Sketch de quantiles à précision relative garantie (principe DDSketch), en NumPy pur.
+
+    Les valeurs positives sont rangées dans des seaux logarithmiques de raison gamma = (1+a)/(1-a) :
+    tout quantile renvoyé est à moins de `relative_accuracy` (a) en valeur relative du vrai quantile.
+    Les valeurs <= `min_value` (ex. Recency = 0) vont dans un seau « zéro ».
+    Deux sketchs de même précision fusionnent par simple addition des compteurs.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self._log_gamma = np.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return int(self.counts.sum() + self.zero_count)
+
+    def _keys(self, values):
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _extend(self, key_min, key_max):
+        """Agrandit le tableau de compteurs pour couvrir [key_min, key_max]."""
+        if len(self.counts) == 0:
+            self.offset = key_min
+            self.counts = np.zeros(key_max - key_min + 1, dtype=np.int64)
+            return
+        new_offset = min(self.offset, key_min)
+        new_len = max(self.offset + len(self.counts), key_max + 1) - new_offset
+        if new_offset != self.offset or new_len != len(self.counts):
+            counts = np.zeros(new_len, dtype=np.int64)
+            counts[self.offset - new_offset:self.offset - new_offset + len(self.counts)] = self.counts
+            self.offset, self.counts = new_offset, counts
+
+    def add(self, values):
+        """Ajoute un lot de valeurs (vectorisé). Retourne le sketch pour chaînage."""
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        positive = values > self.min_value
+        self.zero_count += int((~positive).sum())
+        if positive.any():
+            keys = self._keys(values[positive])
+            self._extend(keys.min(), keys.max())
+            self.counts += np.bincount(keys - self.offset, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        """Fusionne un autre sketch (même précision) dans celui-ci."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Impossible de fusionner des sketchs de précisions différentes.")
+        self.zero_count += other.zero_count
+        if len(other.counts):
+            self._extend(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+        return self
+
+    def quantile(self, qs):
+        """Quantiles approchés (q dans [0, 1]), vectorisé."""
+        qs = np.atleast_1d(np.asarray(qs, dtype='float64'))
+        total = self.count
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        ranks = qs * (total - 1)
+        cumulative = self.zero_count + np.cumsum(self.counts)
+        positions = np.searchsorted(cumulative, ranks, side='right')
+        gamma = np.exp(self._log_gamma)
+        # Valeur représentative du seau : milieu (relatif) de ]gamma^(k-1), gamma^k]
+        keys = self.offset + np.minimum(positions, max(len(self.counts) - 1, 0))
+        values = 2 * gamma ** keys / (gamma + 1)
+        return np.where(ranks < self.zero_count, 0.0, values)
+
+class IntegerHistogram:
+    """
+    Histogramme exact de valeurs entières (Recency en jours, Frequency en factures), fusionnable par addition.
+
+    Les entiers étant peu nombreux (quelques centaines de valeurs distinctes), un compteur par valeur
+    suffit : les quantiles et les effectifs sous un seuil sont exacts, sans tri des clients.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    # Même agrandissement du tableau de compteurs que le sketch (clés = valeurs entières)
+    _extend = QuantileSketch._extend
+
+    def add(self, values):
+        """Ajoute un lot de valeurs entières (vectorisé). Retourne l'histogramme pour chaînage."""
+        values = np.asarray(values, dtype=np.int64)
+        if len(values):
+            self._extend(int(values.min()), int(values.max()))
+            self.counts += np.bincount(values - self.offset, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        """Fusionne un autre histogramme dans celui-ci."""
+        if len(other.counts):
+            self._extend(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+        return self
+
+    def sorted_values(self):
+        """Valeurs triées, reconstituées par tri par dénombrement (O(n), sans comparaison)."""
+        return np.repeat(np.arange(self.offset, self.offset + len(self.counts)), self.counts)
+
+    def count_below(self, value):
+        """Nombre de valeurs strictement inférieures à `value`."""
+        return int(self.counts[:max(int(value) - self.offset, 0)].sum())
+
+def build_rfm_sketches(rfm_df, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Histogrammes Recency / Frequency et sketch Monetary d'une table client agrégée."""
+    sketches = {metric: IntegerHistogram().add(rfm_df[metric].to_numpy()) for metric in INTEGER_METRICS}
+    sketches['Monetary'] = QuantileSketch(relative_accuracy).add(rfm_df['Monetary'].to_numpy())
+    return sketches
+
+def build_rfm_sketches_by(rfm_tables, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Précalcule les sketchs pour chaque partition (ex. {pays: table RFM agrégée de ce pays})."""
+    return {key: build_rfm_sketches(table, relative_accuracy) for key, table in rfm_tables.items()}
+
+def merge_rfm_sketches(sketch_sets):
+    """
+    Fusionne des jeux de sketchs (ex. plusieurs pays) en un seul, sans retrier les clients.
+    Valide si les partitions portent sur des clients distincts (un client = un pays). Fonction de
+    bibliothèque : ni l'application ni batch.py ne l'appellent, leurs filtres (période, retours, seuil)
+    changeant la table client à chaque calcul et un client pouvant acheter depuis plusieurs pays.
+    """
+    sketch_sets = list(sketch_sets)
+    merged = {metric: IntegerHistogram() for metric in INTEGER_METRICS}
+    merged['Monetary'] = QuantileSketch(sketch_sets[0]['Monetary'].relative_accuracy)
+    for sketches in sketch_sets:
+        for metric in RFM_METRICS:
+            merged[metric].merge(sketches[metric])
+    return merged
+
+def rfm_cutpoints(sketches):
+    """
+    Seuils des quintiles pour score_rfm(cutpoints=...), ou None si qcut échouerait (bornes confondues),
+    auquel cas score_rfm applique son repli exact.
+
+    Recency : bornes de pd.qcut calculées sur l'histogramme exact. Frequency : rang 'first' reconstitué,
+    le seuil de chaque coupure et le nombre d'ex-aequo à ce seuil restant sous la coupure (départagés
+    par ordre de la table, comme le rang). Monetary : quantiles du sketch (précision relative).
+    """
+    recency, frequency = sketches['Recency'], sketches['Frequency']
+    n = frequency.count
+    recency_bounds = np.percentile(recency.sorted_values(), QUINTILE_PERCENTS) if n else []
+    rank_bounds = np.percentile(np.arange(1, n + 1), QUINTILE_PERCENTS) if n else []
+    if n == 0 or len(np.unique(recency_bounds)) < 6 or len(np.unique(rank_bounds)) < 6:
+        return None
+    # Nombre de rangs (1..n) sous chaque coupure, puis valeur de Frequency au rang de la coupure
+    cuts = np.floor(rank_bounds[1:-1]).astype(np.int64)
+    thresholds = frequency.sorted_values()[cuts - 1]
+    return {
+        'Recency': recency_bounds[1:-1],
+        'Frequency': thresholds.astype('float64'),
+        'Monetary': sketches['Monetary'].quantile(QUINTILE_PERCENTS[1:-1] / 100),
+        'ties': {'Frequency': cuts - np.array([frequency.count_below(t) for t in thresholds])},
+    }
+
+def calculate_rfm_sketch(df_transactions, analysis_date, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    Équivalent de `calculate_rfm` sans tri des clients : les quintiles sont lus dans des histogrammes
+    (R, F : scores exacts) et un sketch (M : seuils à `relative_accuracy` près), construits en une passe
+    sur la table client, puis appliqués par score_rfm(cutpoints=...).
+    """
+    if df_transactions.empty:
+        return pd.DataFrame(columns=RFM_COLUMNS)
+    rfm_df = aggregate_rfm(df_transactions, analysis_date)
+    # Sketchs sur les seuls clients scorés (score_rfm écarte Monetary <= 0)
+    scored = rfm_df[rfm_df['Monetary'].round(2) > 0]
+    return score_rfm(rfm_df, cutpoints=rfm_cutpoints(build_rfm_sketches(scored, relative_accuracy)))
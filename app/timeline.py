@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+from utils import (SEGMENT_LABELS, SEGMENT_CODE_LOOKUP, SEGMENT_PRIORITY_LOOKUP, period_codes,
+                   period_start_dates, rfm_score_labels)
+
+# --- RFM GLISSANT : INSTANTANÉS SUCCESSIFS ET MIGRATIONS DE SEGMENTS ---
+# État des clients non scorés à un instantané : pas encore d'achat, ou Monetary <= 0 (exclus par score_rfm)
+OUT_OF_BASE = 'Hors base'
+MIGRATION_STATES = SEGMENT_LABELS + [OUT_OF_BASE]
+QUINTILE_PERCENTS = np.linspace(0, 1, 6) * 100.0  # mêmes bornes que pd.qcut(x, 5)
+NS_PER_DAY = 86_400 * 10 ** 9
+
+def snapshot_dates(start_date, end_date, freq='M'):
+    """
+    Dates d'instantané : début de chaque période ('M', 'W', 'Q') après `start_date`, puis end_date + 1 jour
+    (date d'analyse de l'onglet RFM). Un instantané à la date d porte sur les transactions antérieures à d.
+    """
+    stop = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+    first, last = period_codes([pd.Timestamp(start_date), stop], freq)
+    starts = period_start_dates(np.arange(first + 1, last + 1), freq)
+    return starts[starts < stop].append(pd.DatetimeIndex([stop]))
+
+def _quintile_codes(values):
+    """Codes 0..4 de pd.qcut(values, 5) (intervalles ]b(i), b(i+1)]) ; None si des bornes sont confondues."""
+    bounds = np.percentile(values, QUINTILE_PERCENTS)
+    if len(np.unique(bounds)) < len(bounds):
+        return None
+    codes = np.zeros(len(values), dtype=np.int8)
+    for bound in bounds[1:-1]:
+        codes += values > bound
+    return codes
+
+def _rank_quintile_codes(values, cuts):
+    """
+    Codes 0..4 de pd.qcut(values.rank(method='first'), 5) sans tri complet. `cuts` : nombre d'éléments
+    sous chaque coupure ; la valeur de ce rang est localisée par np.partition (O(n)), et les ex-aequo
+    à cette valeur sont départagés par position, comme le rang 'first'.
+    """
+    thresholds = np.partition(values, cuts - 1)[cuts - 1]
+    codes = np.zeros(len(values), dtype=np.int8)
+    for cut, threshold in zip(cuts, thresholds):
+        above = values > threshold
+        ties = np.flatnonzero(values == threshold)
+        above[ties[cut - np.count_nonzero(values < threshold):]] = True
+        codes += above
+    return codes
+
+def _customer_events(df_transactions, dates_ns):
+    """
+    Agrégats par (client, instantané d'entrée) : CA, dernier achat et nouvelles factures.
+    Une transaction entre dans les instantanés d'indice >= searchsorted(dates, date, 'right').
+    """
+    customer_ids, customers = np.unique(df_transactions['CustomerID'].to_numpy(), return_inverse=True)
+    times = df_transactions['TransactionDate'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    if 'InvoiceCode' in df_transactions.columns:
+        invoices = df_transactions['InvoiceCode'].to_numpy()
+    else:
+        invoices = pd.factorize(df_transactions['InvoiceNo'])[0]
+    events = pd.DataFrame({
+        'Customer': customers,
+        'Snapshot': np.searchsorted(dates_ns, times, side='right'),
+        'Invoice': invoices,
+        'Time': times,
+        'TotalSales': df_transactions['TotalSales'].to_numpy(dtype='float64'),
+    })
+    events = events[events['Snapshot'] < len(dates_ns)]
+
+    # Sommes par groupe compensées (Kahan) comme le groupby de calculate_rfm, dans l'ordre des lignes ;
+    # les cumuls par instantané peuvent encore différer au dernier chiffre, d'où le scoring au centime
+    by_snapshot = events.groupby(['Snapshot', 'Customer'], sort=True).agg(
+        TotalSales=('TotalSales', 'sum'), LastTime=('Time', 'max')).reset_index()
+    # Une facture compte pour la Frequency à partir de sa première ligne
+    first_seen = events.groupby(['Customer', 'Invoice'], sort=False)['Snapshot'].min()
+    new_invoices = first_seen.groupby([first_seen.to_numpy(), first_seen.index.get_level_values(0)]).size()
+    by_snapshot['NewInvoices'] = new_invoices.reindex(
+        pd.MultiIndex.from_arrays([by_snapshot['Snapshot'], by_snapshot['Customer']]), fill_value=0).to_numpy()
+    return customer_ids, by_snapshot
+
+def _iter_snapshots(df_transactions, dates):
+    """
+    Rejoue les agrégats cumulés par client dans l'ordre des instantanés (une seule passe triée) et,
+    à chaque date, score les clients comme score_rfm. Produit (date, customer_ids, positions scorées,
+    Recency, Frequency, Monetary, R, F, M, codes segment) ; les tableaux d'état sont réutilisés entre dates.
+    """
+    dates = pd.DatetimeIndex(dates)
+    dates_ns = dates.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    customer_ids, events = _customer_events(df_transactions, dates_ns)
+    n_customers = len(customer_ids)
+
+    monetary = np.zeros(n_customers)
+    compensation = np.zeros(n_customers)  # sommation compensée des CA successifs
+    frequency = np.zeros(n_customers, dtype=np.int64)
+    last_time = np.full(n_customers, np.iinfo(np.int64).min, dtype=np.int64)
+
+    bounds = np.searchsorted(events['Snapshot'].to_numpy(), np.arange(len(dates) + 1), side='left')
+    event_customers = events['Customer'].to_numpy()
+    event_sales = events['TotalSales'].to_numpy()
+    event_times = events['LastTime'].to_numpy()
+    event_invoices = events['NewInvoices'].to_numpy()
+
+    for k, date in enumerate(dates):
+        idx = event_customers[bounds[k]:bounds[k + 1]]  # clients uniques dans la tranche
+        y = event_sales[bounds[k]:bounds[k + 1]] - compensation[idx]
+        total = monetary[idx] + y
+        compensation[idx] = (total - monetary[idx]) - y
+        monetary[idx] = total
+        frequency[idx] += event_invoices[bounds[k]:bounds[k + 1]]
+        last_time[idx] = np.maximum(last_time[idx], event_times[bounds[k]:bounds[k + 1]])
+
+        # score_rfm : clients ayant acheté avant la date, hors Monetary <= 0, dans l'ordre des CustomerID ;
+        # Monetary comparé et classé au centime, l'ordre des sommes différant de calculate_rfm
+        cents = np.round(monetary, 2)
+        active = np.flatnonzero((frequency > 0) & (cents > 0))
+        n = len(active)
+        recency = (dates_ns[k] - last_time[active]) // NS_PER_DAY
+        freq, mon = frequency[active], monetary[active]
+        if n == 0:
+            r_scores = f_scores = m_scores = np.zeros(0, dtype=np.int8)
+        else:
+            r_codes = _quintile_codes(recency)
+            rank_codes = _quintile_codes(np.arange(1, n + 1))
+            if r_codes is None or rank_codes is None:
+                # qcut impossible (bornes confondues) : score neutre 3 partout, comme score_rfm
+                r_scores = f_scores = m_scores = np.full(n, 3, dtype=np.int8)
+            else:
+                r_scores = 5 - r_codes
+                # Rangs 1..n : codes croissants, d'où le nombre de rangs sous chaque coupure
+                cuts = np.searchsorted(rank_codes, np.arange(1, 5), side='left')
+                f_scores = _rank_quintile_codes(freq, cuts) + 1
+                m_scores = _rank_quintile_codes(cents[active], cuts) + 1
+        segments = SEGMENT_CODE_LOOKUP[r_scores - 1, f_scores - 1, m_scores - 1]
+        yield (date, customer_ids, active, recency, freq, mon, r_scores, f_scores, m_scores, segments)
+
+def rfm_snapshots(df_transactions, dates):
+    """
+    RFM de chaque instantané, en une passe triée sur les transactions au lieu d'un calculate_rfm par date.
+    Générateur de (date, table client) : mêmes colonnes et mêmes segments que calculate_rfm(transactions
+    antérieures à la date, date), avec des scores R / F / M entiers.
+    """
+    if df_transactions.empty:
+        return
+    for date, customer_ids, active, recency, freq, mon, r, f, m, segments in _iter_snapshots(df_transactions, dates):
+        yield date, pd.DataFrame({
+            'CustomerID': customer_ids[active],
+            'Recency': recency,
+            'Frequency': freq,
+            'Monetary': mon,
+            'R_Score': r,
+            'F_Score': f,
+            'M_Score': m,
+            'RFM_Score': rfm_score_labels(r, f, m).to_numpy(),
+            'Segment_RFM': pd.Categorical.from_codes(segments, categories=SEGMENT_LABELS),
+            'Priorité_CRM': SEGMENT_PRIORITY_LOOKUP[r - 1, f - 1, m - 1],
+        })
+
+@profiled
+def segment_migrations(df_transactions, dates):
+    """
+    Effectifs par segment à chaque instantané et transitions entre instantanés consécutifs.
+
+    Retourne (counts, transitions) :
+      - counts : instantanés × segments (nombre de clients) ;
+      - transitions : une ligne par (Snapshot, From, To) non vide, Snapshot étant la date d'arrivée ;
+        les clients non scorés à l'une des deux dates sont dans l'état 'Hors base'.
+    Coût : une passe sur les transactions, puis O(clients log clients) par instantané.
+    """
+    dates = pd.DatetimeIndex(dates, name='Snapshot')
+    n_states = len(MIGRATION_STATES)
+    out_code = n_states - 1
+    counts = np.zeros((len(dates), len(SEGMENT_LABELS)), dtype=np.int64)
+    flows = []
+
+    if not df_transactions.empty:
+        previous = None
+        for k, (_, customer_ids, active, *_, segments) in enumerate(_iter_snapshots(df_transactions, dates)):
+            counts[k] = np.bincount(segments, minlength=len(SEGMENT_LABELS))
+            state = np.full(len(customer_ids), out_code, dtype=np.int8)
+            state[active] = segments
+            if previous is not None:
+                cells = np.bincount(previous.astype(np.intp) * n_states + state, minlength=n_states ** 2)
+                cells[out_code * n_states + out_code] = 0  # clients absents aux deux dates
+                nonzero = np.flatnonzero(cells)
+                flows.append((np.full(len(nonzero), k), nonzero // n_states, nonzero % n_states, cells[nonzero]))
+            previous = state
+
+    counts = pd.DataFrame(counts, index=dates, columns=pd.Index(SEGMENT_LABELS, name='Segment_RFM'))
+    if flows:
+        snapshot, source, target, customers = (np.concatenate(parts) for parts in zip(*flows))
+    else:
+        snapshot = source = target = customers = np.zeros(0, dtype=np.int64)
+    transitions = pd.DataFrame({
+        'Snapshot': dates[snapshot],
+        'From': pd.Categorical.from_codes(source, categories=MIGRATION_STATES),
+        'To': pd.Categorical.from_codes(target, categories=MIGRATION_STATES),
+        'Customers': customers,
+    })
+    return counts, transitions
+
+def transition_matrix(transitions, snapshots=None, normalize=False):
+    """
+    Matrice From × To (états dans l'ordre de MIGRATION_STATES) des transitions arrivant aux dates
+    `snapshots` (toutes par défaut, cumulées). `normalize` : part (%) de chaque ligne d'origine.
+    """
+    if snapshots is not None:
+        transitions = transitions[transitions['Snapshot'].isin(pd.DatetimeIndex(snapshots))]
+    matrix = (transitions.groupby(['From', 'To'], observed=False)['Customers'].sum()
+              .unstack('To').reindex(index=MIGRATION_STATES, columns=MIGRATION_STATES).fillna(0))
+    if normalize:
+        totals = matrix.sum(axis=1)
+        matrix = matrix.div(totals.where(totals > 0), axis=0) * 100
+    return matrix
@@ -1,39 +1,226 @@
 import pandas as pd
 import numpy as np
 import datetime as dt
+import hashlib
+import json
+import os
+import sys
+
+from profiling import profiled
 
 # --- 1. FONCTION DE CHARGEMENT ET PRÉPARATION ---
-def load_and_prepare_data(file_path):
-    """Charge le CSV, nettoie et prépare le DataFrame de base."""
-    try:
-        df = pd.read_csv(file_path, parse_dates=['InvoiceDate'])
-    except FileNotFoundError:
-        # Fallback si lancé depuis le dossier app/
-        try:
-            df = pd.read_csv('app/data/data_clean.csv', parse_dates=['InvoiceDate'])
-        except FileNotFoundError:
-            return pd.DataFrame() # Retourne un DF vide si échec total
+FALLBACK_DATA_PATH = 'app/data/data_clean.csv'
+
+# Cache colonnaire persistant (Parquet) : à incrémenter si la préparation change
+CACHE_VERSION = 3
+CACHE_DIRNAME = '.cache'
+
+COLUMN_RENAMES = {
+    'Customer ID': 'CustomerID',
+    'InvoiceDate': 'TransactionDate',
+    'TotalAmount': 'TotalSales',
+    'Invoice': 'InvoiceNo',
+    'Price': 'UnitPrice'
+}
+# Colonnes lues dans le CSV (les autres ne sont jamais parsées) et types explicites à la lecture :
+# texte répétitif en catégoriel, prix en float32 ; les montants restent en float64 (sommes exactes au centime).
+# StockCode est lu en texte puis catégorisé : le catégoriel du parseur est très lent sur des codes numériques
+CSV_DTYPES = {
+    'Invoice': 'category',
+    'StockCode': 'str',
+    'Description': 'category',
+    'Quantity': 'int32',
+    'Price': 'float32',
+    'Country': 'category',
+    'TotalAmount': 'float64',
+}
+# Customer ID : converti après lecture (valeurs manquantes ou non numériques écartées)
+CSV_COLUMNS = list(CSV_DTYPES) + ['InvoiceDate', 'Customer ID']
+CATEGORICAL_COLUMNS = ['InvoiceNo', 'Country', 'StockCode', 'Description']
+COMPACT_DTYPES = {'Quantity': 'int32', 'UnitPrice': 'float32'}
+INT32_RANGE = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+def _string_categorical(values):
+    """Catégoriel à catégories texte (ex. codes facture lus comme entiers dans un morceau sans annulation)."""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+    if values.cat.categories.dtype != object:
+        values = values.cat.rename_categories(values.cat.categories.astype(str))
+    return values
+
+def read_transactions_csv(file_path, columns=CSV_COLUMNS, **kwargs):
+    """
+    Lecture du CSV limitée à `columns` (noms bruts ou déjà standardisés), avec types compacts.
+    Les dates ISO 8601 sont parsées à la lecture (format fixe, rapide) ; les autres formats restent en
+    texte et sont convertis par prepare_transactions.
+    kwargs : transmis à pd.read_csv (ex. chunksize).
+    """
+    keep = set(columns) | {COLUMN_RENAMES.get(col, col) for col in columns}
+    return pd.read_csv(file_path, usecols=lambda col: col in keep, dtype=CSV_DTYPES,
+                       parse_dates=['InvoiceDate'], date_format='ISO8601', **kwargs)
 
+def prepare_transactions(df):
+    """
+    Standardise, nettoie et type un DataFrame brut (CSV complet ou morceau de CSV).
+    Les opérations texte portent sur les catégories (une par facture), jamais ligne à ligne.
+    """
     # Standardisation des colonnes
-    df.rename(columns={
-        'Customer ID': 'CustomerID', 
-        'InvoiceDate': 'TransactionDate', 
-        'TotalAmount': 'TotalSales', 
-        'Invoice': 'InvoiceNo',
-        'Price': 'UnitPrice'
-    }, inplace=True)
-    
+    df = df.rename(columns=COLUMN_RENAMES)
+
     # Nettoyage et typage
     df['CustomerID'] = pd.to_numeric(df['CustomerID'], errors='coerce')
     df = df.dropna(subset=['CustomerID'])
-    df['CustomerID'] = df['CustomerID'].astype('Int64')
-    
-    # Identification des retours
-    df['is_return'] = df['InvoiceNo'].astype(str).str.startswith('C')
-    
+    # int32 seulement si la conversion est exacte : un identifiant décimal ou hors plage n'est pas tronqué
+    ids = df['CustomerID']
+    if not ((ids % 1 == 0).all() and ids.between(*INT32_RANGE).all()):
+        raise ValueError("CustomerID : identifiants non entiers ou hors de la plage int32")
+    df['CustomerID'] = ids.astype('int32')
+    # Dates lues en ISO 8601 ; sinon (ex. '12/1/2010 8:26') le parseur les laisse en texte : format déduit
+    if 'TransactionDate' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['TransactionDate']):
+        df['TransactionDate'] = pd.to_datetime(df['TransactionDate'])
+
+    # Types compacts : les colonnes texte répétitives passent en catégoriel
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = _string_categorical(df[col])
+    for col, dtype in COMPACT_DTYPES.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+
+    # Codes entiers de facture (codes du catégoriel, denses après retrait des factures sans client) :
+    # agrégations par facture sans hachage de chaînes
+    invoices = df['InvoiceNo'].cat.remove_unused_categories()
+    df['InvoiceNo'] = invoices
+    df['InvoiceCode'] = invoices.cat.codes.astype('int32')
+
+    # Identification des retours : préfixe 'C' testé une fois par facture, puis lu par code
+    is_return_invoice = invoices.cat.categories.str.startswith('C')
+    df['is_return'] = np.asarray(is_return_invoice, dtype=bool)[df['InvoiceCode'].to_numpy()]
+
     return df
 
+def _file_digest(file_path, block_size=1 << 20):
+    """Empreinte SHA-256 du fichier source, lue par blocs."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_paths(file_path, cache_dir):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIRNAME)
+    base = os.path.join(cache_dir, os.path.basename(file_path))
+    return cache_dir, base + '.parquet', base + '.meta.json'
+
+def _read_cache(file_path, cache_dir):
+    """
+    Relit le cache Parquet s'il correspond toujours au fichier source.
+    Chemin rapide : mtime + taille identiques. Sinon on compare l'empreinte SHA-256
+    (un simple `touch` du CSV ne force donc pas un nouveau parsing).
+    """
+    _, data_path, meta_path = _cache_paths(file_path, cache_dir)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stat = os.stat(file_path)
+        if meta.get('version') != CACHE_VERSION or meta.get('size') != stat.st_size:
+            return None
+        if meta.get('mtime_ns') != stat.st_mtime_ns:
+            if meta.get('sha256') != _file_digest(file_path):
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        return pd.read_parquet(data_path)
+    except Exception:
+        # Cache absent, corrompu ou pyarrow indisponible : on reparse le CSV
+        return None
+
+def _write_cache(df, file_path, cache_dir):
+    """Écrit le DataFrame préparé en Parquet (écriture atomique) avec ses métadonnées."""
+    cache_dir, data_path, meta_path = _cache_paths(file_path, cache_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        stat = os.stat(file_path)
+        tmp_path = data_path + '.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, data_path)
+        meta = {
+            'version': CACHE_VERSION,
+            'source': os.path.abspath(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_digest(file_path),
+            'rows': len(df),
+        }
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    except Exception:
+        # Le cache est une optimisation : un échec d'écriture ne doit pas bloquer l'app
+        pass
+
+@profiled
+def load_and_prepare_data(file_path, use_cache=True, cache_dir=None):
+    """
+    Charge le CSV, nettoie et prépare le DataFrame de base.
+    Le résultat est mis en cache en Parquet (types compacts conservés) et n'est
+    recalculé que si le fichier source change.
+    """
+    if not os.path.exists(file_path):
+        # Fallback si lancé depuis le dossier app/
+        file_path = FALLBACK_DATA_PATH
+        if not os.path.exists(file_path):
+            return pd.DataFrame() # Retourne un DF vide si échec total
+
+    if use_cache:
+        df = _read_cache(file_path, cache_dir)
+        if df is not None:
+            return df
+
+    df = prepare_transactions(read_transactions_csv(file_path))
+
+    if use_cache:
+        _write_cache(df, file_path, cache_dir)
+
+    return df
+
+def _shared_object_bytes(series):
+    """Octets d'une colonne en comptant une seule fois chaque objet Python (le parseur CSV partage les chaînes répétées)."""
+    nbytes = series.memory_usage(deep=False, index=False)
+    if series.dtype == object:
+        nbytes += sum({id(v): sys.getsizeof(v) for v in series.to_numpy()}.values())
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        nbytes = series.memory_usage(deep=True, index=False)
+    return nbytes
+
+def memory_report(df_before, df_after):
+    """
+    Empreinte mémoire par colonne (Mo) avant / après préparation, index exclu.
+    - Mo_avant : memory_usage(deep=True), chaque cellule texte comptée comme une chaîne à part ;
+    - Mo_avant_partagé : chaînes identiques partagées comptées une fois (mémoire réellement occupée).
+    Les colonnes brutes sont renommées comme dans prepare_transactions pour être alignées.
+    """
+    before = df_before.rename(columns=COLUMN_RENAMES)
+    mb = 1024 ** 2
+    report = pd.DataFrame({
+        'dtype_avant': before.dtypes.astype(str),
+        'Mo_avant': before.memory_usage(deep=True, index=False) / mb,
+        'Mo_avant_partagé': pd.Series({col: _shared_object_bytes(before[col]) for col in before.columns}) / mb,
+        'dtype_après': df_after.dtypes.astype(str),
+        'Mo_après': pd.Series({col: _shared_object_bytes(df_after[col]) for col in df_after.columns}) / mb,
+    })
+    report = report.fillna({'dtype_avant': '-', 'dtype_après': '-', 'Mo_avant': 0.0,
+                            'Mo_avant_partagé': 0.0, 'Mo_après': 0.0})
+    report.loc['Total'] = ['', report['Mo_avant'].sum(), report['Mo_avant_partagé'].sum(),
+                           '', report['Mo_après'].sum()]
+    after = report['Mo_après'].where(report['Mo_après'] > 0)
+    report['réduction'] = report['Mo_avant'] / after
+    report['réduction_partagé'] = report['Mo_avant_partagé'] / after
+    report.index.name = 'Colonne'
+    return report
+
 # --- 2. FONCTION DE FILTRAGE AVANCÉE ---
+@profiled
 def apply_filters(df, start_date, end_date, country_filter, returns_mode, min_order_val):
     """
     Applique les filtres : Date, Pays, Mode Retours, Seuil Commande.
@@ -63,107 +250,397 @@ def apply_filters(df, start_date, end_date, country_filter, returns_mode, min_or
 
     # 4. Filtre Seuil de Commande
     if min_order_val > 0:
-        invoice_totals = df_filtered.groupby('InvoiceNo')['TotalSales'].sum()
-        valid_invoices = invoice_totals[invoice_totals >= min_order_val].index
-        df_filtered = df_filtered[df_filtered['InvoiceNo'].isin(valid_invoices)].copy()
+        df_filtered = df_filtered[invoice_threshold_mask(df_filtered, min_order_val)].copy()
+
+    return df_filtered
+
+def invoice_threshold_mask(df, min_order_val):
+    """
+    Masque des lignes dont la facture atteint `min_order_val` (total sur les lignes de `df`).
+    Totaux par np.bincount sur les codes entiers de facture, puis lecture vectorisée par ligne.
+    """
+    if 'InvoiceCode' in df.columns:
+        codes = df['InvoiceCode'].to_numpy()
+    else:
+        codes = pd.factorize(df['InvoiceNo'])[0]
+    sales = df['TotalSales'].to_numpy(dtype='float64')
+    totals = np.bincount(codes, weights=sales)
+
+    # Les sommes pandas sont compensées (Kahan) : pour les factures à la limite du seuil,
+    # on recalcule avec groupby afin de conserver exactement la même décision qu'avant
+    near = np.flatnonzero(np.isclose(totals, min_order_val, rtol=1e-9, atol=1e-9))
+    if len(near):
+        rows = np.isin(codes, near)
+        exact = pd.Series(sales[rows]).groupby(codes[rows]).sum()
+        totals[exact.index.to_numpy()] = exact.to_numpy()
+
+    return totals[codes] >= min_order_val
+
+# Cube pré-agrégé : une ligne par facture (et par date / client / pays, normalement uniques par facture)
+CUBE_KEYS = ['InvoiceNo', 'InvoiceCode', 'CustomerID', 'Country', 'TransactionDate', 'is_return']
+
+@profiled
+def build_invoice_cube(df):
+    """
+    Pré-agrège les lignes de facture une fois au chargement : total, nb de lignes, flag retour.
+    Le cube garde les colonnes utilisées en aval (TransactionDate, InvoiceNo, TotalSales...) :
+    calculate_rfm, calculate_cohort_retention et les tendances s'y appliquent directement.
+    Trié par date pour filtrer la période par recherche dichotomique.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=CUBE_KEYS + ['TotalSales', 'LineCount'])
+
+    if 'InvoiceCode' not in df.columns:
+        df = df.assign(InvoiceCode=pd.factorize(df['InvoiceNo'])[0].astype('int32'))
+
+    cube = df.groupby(CUBE_KEYS, observed=True, sort=False).agg(
+        TotalSales=('TotalSales', 'sum'),
+        LineCount=('TotalSales', 'size')
+    ).reset_index()
+    cube = cube.sort_values('TransactionDate', kind='stable').reset_index(drop=True)
+    cube['LineCount'] = cube['LineCount'].astype('int32')
+    return cube
+
+@profiled
+def filter_invoice_cube(cube, start_date, end_date, country_filter, returns_mode, min_order_val):
+    """Équivalent de `apply_filters` sur le cube facture (mêmes règles, mêmes totaux)."""
+    if cube.empty:
+        return cube
+
+    # 1. Filtre Temporel : le cube est trié par date -> tranche par recherche dichotomique
+    dates = cube['TransactionDate'].to_numpy()
+    lo = np.searchsorted(dates, np.datetime64(pd.to_datetime(start_date)), side='left')
+    hi = np.searchsorted(dates, np.datetime64(pd.to_datetime(end_date)), side='right')
+    df_filtered = cube.iloc[lo:hi]
+
+    if df_filtered.empty:
+        return df_filtered
+
+    # 2. Filtre Pays
+    if country_filter != 'Global':
+        df_filtered = df_filtered[df_filtered['Country'] == country_filter]
+
+    # 3. Mode Retours
+    if returns_mode == 'Exclure':
+        df_filtered = df_filtered[~df_filtered['is_return']]
+    elif returns_mode == 'Neutraliser':
+        df_filtered = df_filtered.assign(TotalSales=df_filtered['TotalSales'].where(~df_filtered['is_return'], 0))
+
+    if df_filtered.empty:
+        return df_filtered
+
+    # 4. Filtre Seuil de Commande (au niveau facture)
+    if min_order_val > 0:
+        df_filtered = df_filtered[invoice_threshold_mask(df_filtered, min_order_val)]
 
     return df_filtered
 
 # --- 3. FONCTION RFM ENRICHIE ---
-def calculate_rfm(df_transactions, analysis_date):
-    """Calcule R, F, M, scores, segments."""
-    
-    if df_transactions.empty:
-        # Retourne un DF vide avec les colonnes attendues pour éviter KeyError plus tard
-        return pd.DataFrame(columns=['CustomerID', 'Recency', 'Frequency', 'Monetary', 
-                                     'R_Score', 'F_Score', 'M_Score', 'RFM_Score', 
-                                     'Segment_RFM', 'Priorité_CRM'])
 
-    # Agrégation par client
+# Règles de segmentation : évaluées dans l'ordre, la première qui correspond l'emporte.
+# Chaque règle : (Segment, Priorité CRM, (R min, R max), (F min, F max), (M min, M max))
+SEGMENT_RULES = [
+    ('Champions',                1, (5, 5), (5, 5), (5, 5)),
+    ('Fidèles',                  2, (4, 5), (4, 5), (1, 5)),
+    ('Nouveaux Prometteurs',     3, (4, 5), (1, 2), (1, 5)),
+    ('À Risque (Haute Valeur)',  4, (1, 2), (4, 5), (1, 5)),
+    ('Perdus / Dormants',        6, (1, 2), (1, 2), (1, 5)),
+    ('Gros Dépensiers (Risque)', 3, (1, 5), (1, 5), (4, 5)),
+    ('Potentiels',               5, (1, 5), (1, 5), (1, 5)),
+]
+SEGMENT_FALLBACK = ('Inconnu', 6)
+SEGMENT_LABELS = list(dict.fromkeys([rule[0] for rule in SEGMENT_RULES] + [SEGMENT_FALLBACK[0]]))
+
+def _build_segment_lookup(rules):
+    """Pré-calcule les tables 5x5x5 (code segment, priorité) indexées par (R-1, F-1, M-1)."""
+    scores = np.arange(1, 6)
+    r, f, m = np.meshgrid(scores, scores, scores, indexing='ij')
+    fallback_code = SEGMENT_LABELS.index(SEGMENT_FALLBACK[0])
+    seg_codes = np.full(r.shape, fallback_code, dtype=np.int8)
+    priorities = np.full(r.shape, SEGMENT_FALLBACK[1], dtype=np.int8)
+    assigned = np.zeros(r.shape, dtype=bool)
+
+    for label, priority, (r_lo, r_hi), (f_lo, f_hi), (m_lo, m_hi) in rules:
+        match = (~assigned
+                 & (r >= r_lo) & (r <= r_hi)
+                 & (f >= f_lo) & (f <= f_hi)
+                 & (m >= m_lo) & (m <= m_hi))
+        seg_codes[match] = SEGMENT_LABELS.index(label)
+        priorities[match] = priority
+        assigned |= match
+
+    return seg_codes, priorities
+
+SEGMENT_CODE_LOOKUP, SEGMENT_PRIORITY_LOOKUP = _build_segment_lookup(SEGMENT_RULES)
+
+def _scores_as_float(scores):
+    """Convertit des scores (catégoriels qcut, entiers, objets) en tableau float (NaN si invalide)."""
+    scores = pd.Series(scores)
+    if isinstance(scores.dtype, pd.CategoricalDtype):
+        # Passage par les codes : évite de matérialiser un objet Python par client
+        categories = pd.to_numeric(pd.Series(scores.cat.categories), errors='coerce').to_numpy(dtype=float)
+        codes = scores.cat.codes.to_numpy()
+        return np.where(codes >= 0, categories[codes], np.nan)
+    return pd.to_numeric(scores, errors='coerce').to_numpy(dtype=float)
+
+def assign_segments(r_scores, f_scores, m_scores):
+    """
+    Attribue Segment_RFM (catégoriel) et Priorité_CRM à partir des scores R, F, M.
+    Lecture directe dans la table 5x5x5 : aucun apply ligne à ligne.
+    Les scores manquants ou non numériques tombent dans le segment 'Inconnu'.
+    """
+    index = getattr(r_scores, 'index', None)
+    r, f, m = (_scores_as_float(s) for s in (r_scores, f_scores, m_scores))
+
+    valid = ~(np.isnan(r) | np.isnan(f) | np.isnan(m))
+
+    fallback_code = SEGMENT_LABELS.index(SEGMENT_FALLBACK[0])
+    codes = np.full(len(r), fallback_code, dtype=np.int8)
+    priorities = np.full(len(r), SEGMENT_FALLBACK[1], dtype=np.int8)
+
+    # Troncature comme int(), puis bornage : les règles ne comparent qu'à des seuils dans [1, 5]
+    ri, fi, mi = (np.clip(np.trunc(s[valid]), 1, 5).astype(np.intp) - 1 for s in (r, f, m))
+    codes[valid] = SEGMENT_CODE_LOOKUP[ri, fi, mi]
+    priorities[valid] = SEGMENT_PRIORITY_LOOKUP[ri, fi, mi]
+
+    segments = pd.Categorical.from_codes(codes, categories=SEGMENT_LABELS)
+    return (pd.Series(segments, index=index, name='Segment_RFM'),
+            pd.Series(priorities, index=index, name='Priorité_CRM'))
+
+RFM_COLUMNS = ['CustomerID', 'Recency', 'Frequency', 'Monetary',
+               'R_Score', 'F_Score', 'M_Score', 'RFM_Score',
+               'Segment_RFM', 'Priorité_CRM']
+
+def aggregate_rfm(df_transactions, analysis_date):
+    """Agrège les transactions par client : Recency, Frequency, Monetary (sans scoring)."""
     rfm_df = df_transactions.groupby('CustomerID').agg(
-        Recency=('TransactionDate', lambda x: (analysis_date - x.max()).days),
+        LastPurchase=('TransactionDate', 'max'),
         Frequency=('InvoiceNo', 'nunique'),
         Monetary=('TotalSales', 'sum')
     ).reset_index()
-    
+    rfm_df.insert(1, 'Recency', (pd.Timestamp(analysis_date) - rfm_df.pop('LastPurchase')).dt.days)
+    return rfm_df
+
+# Libellés 'RFM' ('111' ... '555') pré-calculés, indexés par (R-1)*25 + (F-1)*5 + (M-1)
+RFM_SCORE_LABELS = np.array([f"{r}{f}{m}" for r in range(1, 6) for f in range(1, 6) for m in range(1, 6)], dtype=object)
+
+def rfm_score_labels(r_scores, f_scores, m_scores):
+    """Concaténation des scores R, F, M en texte ('543'), par lecture dans une table de 125 libellés."""
+    r, f, m = (_scores_as_float(s) for s in (r_scores, f_scores, m_scores))
+    if not all(np.isin(s, np.arange(1, 6)).all() for s in (r, f, m)):
+        # Scores atypiques : concaténation texte classique
+        return pd.Series(r_scores).astype(str) + pd.Series(f_scores).astype(str) + pd.Series(m_scores).astype(str)
+    index = ((r - 1) * 25 + (f - 1) * 5 + (m - 1)).astype(np.intp)
+    return pd.Series(RFM_SCORE_LABELS[index], index=getattr(r_scores, 'index', None))
+
+def _score_from_cutpoints(values, cuts, labels, ties=None):
+    """
+    Équivalent de qcut avec seuils fournis : intervalles ]c(i-1), c(i)], sans tri des clients.
+    `ties` (un effectif par seuil) : seuls les `ties[i]` premiers ex-aequo au seuil c(i), dans l'ordre
+    de la table, restent sous la coupure, comme avec qcut sur rank(method='first').
+    """
+    values = values.to_numpy(dtype='float64')
+    if ties is None:
+        bins = np.searchsorted(np.asarray(cuts, dtype='float64'), values, side='left')
+    else:
+        bins = np.zeros(len(values), dtype=np.int8)
+        for cut, below in zip(cuts, ties):
+            above = values > cut
+            above[np.flatnonzero(values == cut)[below:]] = True
+            bins += above
+    return pd.Categorical.from_codes(bins, categories=labels)
+
+def score_rfm(rfm_df, cutpoints=None):
+    """
+    Scoring (quintiles) et segmentation d'une table client (CustomerID, Recency, Frequency, Monetary).
+    La table doit être triée par CustomerID pour que le départage des ex-aequo soit reproductible.
+    `cutpoints` ({métrique: 4 seuils}, ex. issus de sketchs fusionnés) remplace le tri exact de qcut ;
+    sa clé optionnelle 'ties' ({métrique: 4 effectifs}) départage les ex-aequo aux seuils.
+    Exclusion et rang du Monetary portent sur sa valeur au centime : deux sommes des mêmes montants dans
+    un ordre différent (lignes, cube facture, cumul par instantané) donnent les mêmes scores.
+    """
     # Exclusion des clients avec Monetary <= 0 (Biais statistique + Division par zero)
-    rfm_df = rfm_df[rfm_df['Monetary'] > 0]
-    
+    rfm_df = rfm_df[rfm_df['Monetary'].round(2) > 0].copy()
+
     if rfm_df.empty:
-        return pd.DataFrame(columns=['CustomerID', 'Recency', 'Frequency', 'Monetary', 
-                                     'R_Score', 'F_Score', 'M_Score', 'RFM_Score', 
-                                     'Segment_RFM', 'Priorité_CRM'])
-    
+        return pd.DataFrame(columns=RFM_COLUMNS)
+
     # Scoring (Quintiles)
-    try:
-        rfm_df['R_Score'] = pd.qcut(rfm_df['Recency'], 5, labels=[5, 4, 3, 2, 1])
-        rfm_df['F_Score'] = pd.qcut(rfm_df['Frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5])
-        rfm_df['M_Score'] = pd.qcut(rfm_df['Monetary'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5])
-    except ValueError:
-        # Cas où il n'y a pas assez de valeurs uniques pour qcut
-        # On fallback sur une assignation simplifiée ou on retourne tel quel
-        rfm_df['R_Score'] = 3
-        rfm_df['F_Score'] = 3
-        rfm_df['M_Score'] = 3
-
-    rfm_df['RFM_Score'] = rfm_df['R_Score'].astype(str) + rfm_df['F_Score'].astype(str) + rfm_df['M_Score'].astype(str)
-
-    # Segmentation & Priorité CRM
-    def segment_label(row):
+    if cutpoints is not None:
+        ties = cutpoints.get('ties', {})
+        rfm_df['R_Score'] = _score_from_cutpoints(rfm_df['Recency'], cutpoints['Recency'], [5, 4, 3, 2, 1],
+                                                  ties.get('Recency'))
+        rfm_df['F_Score'] = _score_from_cutpoints(rfm_df['Frequency'], cutpoints['Frequency'], [1, 2, 3, 4, 5],
+                                                  ties.get('Frequency'))
+        rfm_df['M_Score'] = _score_from_cutpoints(rfm_df['Monetary'], cutpoints['Monetary'], [1, 2, 3, 4, 5],
+                                                  ties.get('Monetary'))
+    else:
         try:
-            r, f, m = int(row['R_Score']), int(row['F_Score']), int(row['M_Score'])
-        except:
-            return 'Inconnu', 6 # Fallback
-        
-        if r >= 5 and f >= 5 and m >= 5: return 'Champions', 1
-        if r >= 4 and f >= 4: return 'Fidèles', 2
-        if r >= 4 and f <= 2: return 'Nouveaux Prometteurs', 3
-        if r <= 2 and f >= 4: return 'À Risque (Haute Valeur)', 4
-        if r <= 2 and f <= 2: return 'Perdus / Dormants', 6
-        if m >= 4: return 'Gros Dépensiers (Risque)', 3
-        return 'Potentiels', 5
+            rfm_df['R_Score'] = pd.qcut(rfm_df['Recency'], 5, labels=[5, 4, 3, 2, 1])
+            rfm_df['F_Score'] = pd.qcut(rfm_df['Frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5])
+            rfm_df['M_Score'] = pd.qcut(rfm_df['Monetary'].round(2).rank(method='first'), 5, labels=[1, 2, 3, 4, 5])
+        except ValueError:
+            # Cas où il n'y a pas assez de valeurs uniques pour qcut
+            # On fallback sur une assignation simplifiée ou on retourne tel quel
+            rfm_df['R_Score'] = 3
+            rfm_df['F_Score'] = 3
+            rfm_df['M_Score'] = 3
+
+    rfm_df['RFM_Score'] = rfm_score_labels(rfm_df['R_Score'], rfm_df['F_Score'], rfm_df['M_Score'])
 
-    rfm_df[['Segment_RFM', 'Priorité_CRM']] = rfm_df.apply(lambda x: pd.Series(segment_label(x)), axis=1)
+    # Segmentation & Priorité CRM (table de correspondance vectorisée)
+    rfm_df['Segment_RFM'], rfm_df['Priorité_CRM'] = assign_segments(
+        rfm_df['R_Score'], rfm_df['F_Score'], rfm_df['M_Score']
+    )
 
     return rfm_df
 
-# --- 4. FONCTION COHORTES (Robustesse améliorée) ---
-def calculate_cohort_retention(df_transactions):
-    """Calcule la matrice de rétention (%) et la matrice de CA Moyen (ARPU)."""
+@profiled
+def calculate_rfm(df_transactions, analysis_date):
+    """Calcule R, F, M, scores, segments."""
     
-    # (B) Robustesse : Gestion DF vide
     if df_transactions.empty:
+        # Retourne un DF vide avec les colonnes attendues pour éviter KeyError plus tard
+        return pd.DataFrame(columns=RFM_COLUMNS)
+
+    # Agrégation par client, puis scoring sur la table compacte
+    return score_rfm(aggregate_rfm(df_transactions, analysis_date))
+
+@profiled
+def segment_stats(df_rfm):
+    """Synthèse par segment : nb clients, CA total / moyen, récence moyenne et priorité CRM."""
+    # On construit le dictionnaire d'aggrégation dynamiquement pour éviter les KeyError
+    agg_dict = {
+        'CustomerID': 'count',
+        'Monetary': ['sum', 'mean'],
+        'Recency': 'mean'
+    }
+    # On ajoute Priorité_CRM seulement si elle existe
+    if 'Priorité_CRM' in df_rfm.columns:
+        agg_dict['Priorité_CRM'] = 'first'
+
+    rfm_stats = df_rfm.groupby('Segment_RFM', observed=True).agg(agg_dict).round(1)
+
+    # Aplatir les colonnes MultiIndex proprement
+    # Les colonnes seront [CustomerID, Monetary_sum, Monetary_mean, Recency, Priorité_CRM] dans l'ordre
+    rfm_stats.columns = ['_'.join(col).strip() if col[1] else col[0] for col in rfm_stats.columns.values]
+
+    # Renommage explicite pour affichage
+    rename_map = {
+        'CustomerID_count': 'Nb Clients',
+        'Monetary_sum': 'CA Total',
+        'Monetary_mean': 'CA Moyen',
+        'Recency_mean': 'Récence Moy',
+        'Priorité_CRM_first': 'Priorité'
+    }
+    return rfm_stats.rename(columns=rename_map)
+
+# --- 4. FONCTION COHORTES (Robustesse améliorée) ---
+# Granularités de cohorte : périodes encodées en entiers consécutifs
+# (mois = année*12 + mois, trimestre = année*4 + trimestre, semaine = n° de semaine depuis 1970, lundi)
+COHORT_FREQS = {'M': 'Mois', 'W': 'Semaine', 'Q': 'Trimestre'}
+COHORT_INDEX_NAMES = {'M': 'CohortMonth', 'W': 'CohortWeek', 'Q': 'CohortQuarter'}
+
+def period_codes(dates, freq='M'):
+    """Encode des dates en numéros de période entiers (différence = âge en périodes)."""
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    if freq == 'W':
+        # 1970-01-01 est un jeudi : décalage de 3 jours pour des semaines commençant le lundi
+        return (dates.astype('datetime64[D]').astype(np.int64) + 3) // 7
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    if freq == 'Q':
+        return months // 3
+    return months
+
+def period_labels(codes, freq='M'):
+    """Libellés lisibles des périodes : '2010-01', '2010-T1' ou date du lundi '2010-01-04'."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if freq == 'W':
+        return pd.DatetimeIndex((codes * 7 - 3).astype('datetime64[D]')).strftime('%Y-%m-%d')
+    if freq == 'Q':
+        return pd.Index([f"{1970 + c // 4}-T{c % 4 + 1}" for c in codes])
+    return pd.DatetimeIndex(codes.astype('datetime64[M]')).strftime('%Y-%m')
+
+def period_start_dates(codes, freq='M'):
+    """Date de début (minuit) de chaque période : 1er du mois / du trimestre, ou lundi de la semaine."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if freq == 'W':
+        return pd.DatetimeIndex((codes * 7 - 3).astype('datetime64[D]'))
+    months = codes * 3 if freq == 'Q' else codes
+    return pd.DatetimeIndex(months.astype('datetime64[M]').astype('datetime64[D]'))
+
+def customer_period_activity(df_transactions, freq='M'):
+    """Réduit les transactions à une ligne par (client, période d'achat) avec le CA de la période."""
+    periods = pd.Series(period_codes(df_transactions['TransactionDate'], freq),
+                        index=df_transactions.index, name='Period')
+    return (df_transactions.groupby([df_transactions['CustomerID'], periods])['TotalSales']
+            .sum().reset_index())
+
+def cohort_matrices(activity, freq='M'):
+    """
+    Matrices de rétention (%) et d'ARPU à partir de l'activité (CustomerID, Period, TotalSales).
+    Âge de cohorte = soustraction entière de périodes ; effectifs et CA accumulés en une passe
+    (bincount) dans un tableau dense cohorte × âge. Les cases au-delà de la dernière période
+    observée restent vides (NaN), les périodes sans achat valent 0.
+    Utilisée par calculate_cohort_retention et par l'agrégat incrémental.
+    """
+    if activity.empty:
         return pd.DataFrame(), pd.DataFrame(), pd.Series(dtype="float")
 
-    df = df_transactions.copy()
-    df['TransactionMonth'] = df['TransactionDate'].dt.to_period('M')
-    df['CohortMonth'] = df.groupby('CustomerID')['TransactionMonth'].transform('min')
-    
-    # Cohort Index
-    def get_cohort_index(df_in):
-        return (df_in['TransactionMonth'].dt.to_timestamp() - df_in['CohortMonth'].dt.to_timestamp()).dt.days // 30
-    
-    df['CohortIndex'] = get_cohort_index(df)
+    customers = pd.factorize(activity['CustomerID'])[0]
+    period = activity['Period'].to_numpy(dtype=np.int64)
+    revenue = activity['TotalSales'].to_numpy(dtype='float64')
+
+    # Période d'acquisition de chaque client, puis âge par soustraction entière
+    first = np.full(customers.max() + 1, period.max(), dtype=np.int64)
+    np.minimum.at(first, customers, period)
+    cohort = first[customers]
+    age = period - cohort
+
+    first_cohort, last_period = cohort.min(), period.max()
+    n_rows, n_cols = last_period - first_cohort + 1, age.max() + 1
+    cell = (cohort - first_cohort) * n_cols + age
+
+    # Une ligne d'activité = un client actif sur la période : le comptage donne les clients uniques
+    counts = np.bincount(cell, minlength=n_rows * n_cols).reshape(n_rows, n_cols).astype('float64')
+    sales = np.bincount(cell, weights=revenue, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+    # On ne garde que les périodes ayant acquis des clients
+    sizes = counts[:, 0]
+    keep = sizes > 0
+    counts, sales, sizes = counts[keep], sales[keep], sizes[keep]
+    cohort_codes = np.arange(first_cohort, last_period + 1)[keep]
+
+    # Cases non observables (cohorte trop récente pour cet âge)
+    horizon = (last_period - cohort_codes)[:, None] < np.arange(n_cols)[None, :]
+    counts[horizon] = np.nan
+    sales[horizon] = np.nan
+
+    index = pd.Index(period_labels(cohort_codes, freq), name=COHORT_INDEX_NAMES[freq])
+    columns = pd.RangeIndex(n_cols, name='CohortIndex')
+    retention_matrix = pd.DataFrame(counts / sizes[:, None] * 100, index=index, columns=columns)
+    arpu_matrix = pd.DataFrame(sales / sizes[:, None], index=index, columns=columns)
+    cohort_sizes = pd.Series(sizes, index=index, name=0)
+
+    return retention_matrix, arpu_matrix, cohort_sizes
+
+@profiled
+def calculate_cohort_retention(df_transactions, freq='M'):
+    """Calcule la matrice de rétention (%) et la matrice de CA Moyen (ARPU) par mois, semaine ou trimestre."""
     
-    # 1. Matrice Rétention
-    cohort_data = df.groupby(['CohortMonth', 'CohortIndex'])['CustomerID'].nunique().reset_index()
-    if cohort_data.empty:
+    # (B) Robustesse : Gestion DF vide
+    if df_transactions.empty:
         return pd.DataFrame(), pd.DataFrame(), pd.Series(dtype="float")
 
-    cohort_counts = cohort_data.pivot_table(index='CohortMonth', columns='CohortIndex', values='CustomerID')
-    cohort_sizes = cohort_counts.iloc[:, 0]
-    retention_matrix = cohort_counts.divide(cohort_sizes, axis=0) * 100
-    
-    # 2. Matrice CA Moyen (ARPU)
-    cohort_revenue = df.groupby(['CohortMonth', 'CohortIndex'])['TotalSales'].sum().reset_index()
-    revenue_matrix = cohort_revenue.pivot_table(index='CohortMonth', columns='CohortIndex', values='TotalSales')
-    arpu_matrix = revenue_matrix.divide(cohort_sizes, axis=0)
-
-    # Formatage index
-    retention_matrix.index = retention_matrix.index.strftime('%Y-%m')
-    arpu_matrix.index = arpu_matrix.index.strftime('%Y-%m')
-    
-    return retention_matrix, arpu_matrix, cohort_sizes
+    return cohort_matrices(customer_period_activity(df_transactions, freq), freq)
+
+@profiled
+def sales_trend(df_transactions, freq='M'):
+    """CA et nombre de factures par période ('M' ou 'Q'), indexés par date de fin de période."""
+    by_period = df_transactions.set_index('TransactionDate').resample(freq)
+    df_trend = by_period['TotalSales'].sum().reset_index()
+    df_trend['InvoiceCount'] = by_period['InvoiceNo'].nunique().values
+    return df_trend
 
 # --- 5. CALCULS CLV & SCÉNARIOS ---
 def calculate_clv_formula(monetary_value, retention_rate_r, discount_rate_d, avg_margin):
@@ -184,6 +661,48 @@ def calculate_clv_formula(monetary_value, retention_rate_r, discount_rate_d, avg
         # On remplace les 0 par NaN pour éviter Inf, puis on fillna(0)
         return (contribution_margin / denominator).fillna(0)
 
+GLOBAL_SCENARIO = 'Globale (tous les clients)'
+
+@profiled
+def segment_monetary_summary(df_rfm):
+    """CA total et nombre de clients par segment : seule donnée dont dépendent les scénarios."""
+    summary = df_rfm.groupby('Segment_RFM', observed=True)['Monetary'].agg(['sum', 'count'])
+    return summary[summary['count'] > 0]
+
+@profiled
+def simulate_scenario_grid(df_rfm, retention_r, discount_d, margin_pct, discount_pct, targets=None, summary=None):
+    """
+    Évalue CLV moyenne et CA simulés pour une grille de scénarios, par diffusion NumPy.
+
+    Chaque paramètre est un scalaire ou un tableau (diffusés ensemble, ex. une grille np.meshgrid).
+    `targets` : liste de cibles de remise, GLOBAL_SCENARIO ou un nom de segment (défaut : toutes).
+    Retourne (clv, total_sales, targets) avec clv.shape == total_sales.shape == forme diffusée + (nb cibles,).
+    Aucune copie de df_rfm : seules les sommes par segment sont utilisées.
+    """
+    if summary is None:
+        summary = segment_monetary_summary(df_rfm)
+    if targets is None:
+        targets = [GLOBAL_SCENARIO] + summary.index.tolist()
+
+    total = summary['sum'].sum()
+    n_customers = summary['count'].sum()
+    # CA concerné par la remise pour chaque cible
+    targeted = np.array([total if t == GLOBAL_SCENARIO else summary['sum'].get(t, 0.0) for t in targets], dtype='float64')
+
+    retention_r, discount_d, margin_pct, discount_pct = (
+        np.asarray(x, dtype='float64')[..., None] for x in np.broadcast_arrays(retention_r, discount_d, margin_pct, discount_pct)
+    )
+    total_sales = total - discount_pct * targeted
+    avg_monetary = total_sales / n_customers if n_customers else np.zeros_like(total_sales)
+
+    # Même règle que calculate_clv_formula pour un dénominateur nul ou négatif
+    denominator = (1 - retention_r) + discount_d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        clv = np.where(denominator <= 0.0001, 0.0, avg_monetary * margin_pct / denominator)
+
+    return clv, total_sales, list(targets)
+
+@profiled
 def run_scenario_simulation(df_base, df_rfm, retention_r, discount_d, margin_pct, discount_mode, discount_pct, target_segment):
     """
     Simule l'impact des paramètres sur CLV et CA.
@@ -192,19 +711,8 @@ def run_scenario_simulation(df_base, df_rfm, retention_r, discount_d, margin_pct
     if df_rfm.empty:
         return 0.0, 0.0
 
-    df_sim_rfm = df_rfm.copy()
-    
-    if discount_mode == 'Globale (tous les clients)':
-        df_sim_rfm['Monetary_Sim'] = df_sim_rfm['Monetary'] * (1 - discount_pct)
-    else:
-        mask_segment = df_sim_rfm['Segment_RFM'] == target_segment
-        df_sim_rfm['Monetary_Sim'] = np.where(mask_segment, 
-                                              df_sim_rfm['Monetary'] * (1 - discount_pct), 
-                                              df_sim_rfm['Monetary'])
-    
-    avg_monetary_sim = df_sim_rfm['Monetary_Sim'].mean()
-    # Utilisation de la fonction robustifiée
-    clv_sim = calculate_clv_formula(avg_monetary_sim, retention_r, discount_d, margin_pct)
-    total_sales_sim = df_sim_rfm['Monetary_Sim'].sum()
+    target = GLOBAL_SCENARIO if discount_mode == GLOBAL_SCENARIO else target_segment
+    clv_sim, total_sales_sim, _ = simulate_scenario_grid(df_rfm, retention_r, discount_d, margin_pct,
+                                                         discount_pct, targets=[target])
     
-    return clv_sim, total_sales_sim
\ No newline at end of file
+    return float(clv_sim[0]), float(total_sales_sim[0])
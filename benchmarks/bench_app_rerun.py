@@ -0,0 +1,67 @@
+"""
+Benchmark : temps mur d'un rerun Streamlit de app/app.py (AppTest, sans navigateur).
+
+Mesure le premier rendu puis la médiane de reruns déclenchés par :
+  - un curseur du simulateur (Tab 4 ouvert) ;
+  - le seuil minimum de commande (filtre global, alterné entre deux valeurs).
+Les données sont celles lues par l'application (app/data/processed.csv).
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_app_rerun.py --repeat 5
+"""
+import argparse
+import logging
+import os
+import statistics
+import time
+import warnings
+
+from streamlit.testing.v1 import AppTest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, '..', 'app', 'app.py')
+TAB_KEY = 'onglet'
+SIMULATOR_TAB = "🧪 Simulateur"
+
+def timed_run(at, tab=None):
+    # AppTest ne renvoie pas l'onglet sélectionné au rerun suivant : on le réimpose
+    if tab and TAB_KEY in at.session_state:
+        at.session_state[TAB_KEY] = tab
+    t0 = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed
+
+def widget(widgets, key=None, label_prefix=None):
+    for w in widgets:
+        if (key and w.key == key) or (label_prefix and w.label.startswith(label_prefix)):
+            return w
+    raise LookupError(key or label_prefix)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+    # Avertissements de dépréciation Streamlit : un message par graphique et par rerun
+    logging.getLogger('streamlit.deprecation_util').addFilter(lambda record: False)
+
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+    print(f"{'Premier rendu':>22} | {timed_run(at):>7.2f} s")
+
+    # Onglets paresseux : on ouvre le simulateur (sans effet si tous les onglets sont rendus)
+    timed_run(at, SIMULATOR_TAB)
+
+    timings = []
+    for i in range(args.repeat):
+        widget(at.slider, key='sim_r').set_value(0.5 + 0.05 * (i % 2 + 1))
+        timings.append(timed_run(at, SIMULATOR_TAB))
+    print(f"{'Curseur simulateur':>22} | {statistics.median(timings):>7.2f} s")
+
+    timings = []
+    for i in range(args.repeat):
+        widget(at.slider, label_prefix='Seuil').set_value(10 * (i % 2 + 1))
+        timings.append(timed_run(at, SIMULATOR_TAB))
+    print(f"{'Seuil de commande':>22} | {statistics.median(timings):>7.2f} s")
@@ -0,0 +1,173 @@
+"""
+Benchmark : moteurs de requête du pipeline (pandas en mémoire vs Arrow / DuckDB sur Parquet).
+
+Le CSV synthétique est converti une fois en jeu Parquet partitionné par pays (backends.py), puis chaque
+moteur tourne dans un sous-processus : ouverture, invoice_cube, calculate_rfm, calculate_cohort_retention
+et apply_filters sur deux jeux de filtres, avec le RSS max du processus.
+
+--check vérifie d'abord la parité des moteurs Parquet avec pandas (mêmes valeurs, hors InvoiceCode
+renuméroté) sur une grille de filtres : à lancer sur une taille qui tient en mémoire.
+--memory-limit-mb plafonne la mémoire virtuelle des sous-processus (RLIMIT_AS) pour simuler un jeu plus
+grand que la RAM : le moteur pandas échoue là où les moteurs Parquet aboutissent.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_backends.py --rows 1000000 --check
+    python benchmarks/bench_backends.py --rows 50000000 --engines arrow duckdb
+    python benchmarks/bench_backends.py --rows 20000000 --engines pandas arrow --memory-limit-mb 3000
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+from bench_streaming import _peak_rss_mb  # noqa: E402
+
+FILTER_SETS = {
+    'global': ('2009-12-01', '2011-12-09', 'Global', 'Exclure', 0),
+    'pays': ('2010-06-01', '2011-06-30', 'France', 'Neutraliser', 50),
+}
+
+def run_engine(engine, data_path, memory_limit_mb):
+    """Exécuté dans le sous-processus : mesure chaque requête et imprime un JSON de mesures."""
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 ** 2
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    import pandas as pd
+    from backends import open_backend
+
+    timings = {}
+    try:
+        t0 = time.perf_counter()
+        backend = open_backend(engine, data_path)
+        timings['open'] = time.perf_counter() - t0
+        for label, filters in FILTER_SETS.items():
+            analysis_date = pd.Timestamp(filters[1]) + pd.Timedelta(days=1)
+            for step, call in [('invoice_cube', lambda: backend.invoice_cube(filters)),
+                               ('calculate_rfm', lambda: backend.calculate_rfm(filters, analysis_date)),
+                               ('cohorts', lambda: backend.calculate_cohort_retention(filters)),
+                               ('apply_filters', lambda: backend.apply_filters(filters))]:
+                if label == 'global' and step == 'apply_filters':
+                    continue  # toutes les lignes : pas une requête hors mémoire
+                t0 = time.perf_counter()
+                call()
+                timings[f'{label}:{step}'] = time.perf_counter() - t0
+        error = None
+    except MemoryError:
+        error = 'MemoryError'
+    print(json.dumps({'engine': engine, 'error': error, 'peak_rss_mb': round(_peak_rss_mb(), 1),
+                      'timings': {k: round(v, 3) for k, v in timings.items()}}))
+
+def measure(engine, data_path, memory_limit_mb):
+    env = dict(os.environ)
+    if memory_limit_mb:
+        # Les allocateurs Arrow par défaut réservent de l'espace d'adresses, compté par RLIMIT_AS
+        env['ARROW_DEFAULT_MEMORY_POOL'] = 'system'
+    out = subprocess.run([sys.executable, __file__, '--run-engine', engine, '--data', data_path,
+                          '--memory-limit-mb', str(memory_limit_mb or 0)], capture_output=True, text=True, env=env)
+    lines = out.stdout.strip().splitlines()
+    if out.returncode != 0 or not lines:
+        # Dépassement du plafond hors Python (allocation native) : le processus est tué
+        return {'engine': engine, 'error': f'code {out.returncode}', 'peak_rss_mb': None, 'timings': {}}
+    return json.loads(lines[-1])
+
+def _comparable(df):
+    # InvoiceCode est renuméroté par les moteurs Parquet ; les catégories texte sont comparées par valeur.
+    # L'index des lignes n'est pas comparé : le cache Parquet de load_and_prepare_data le remet à zéro
+    import pandas as pd
+    df = df.drop(columns='InvoiceCode')
+    for col in df.columns:
+        if col != 'Country' and isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df
+
+def check_parity(data_path, engines):
+    """Compare les moteurs Parquet au moteur pandas sur une grille de filtres ; retourne le nombre d'écarts."""
+    import pandas as pd
+    from backends import open_backend
+
+    reference = open_backend('pandas', data_path)
+    meta = reference.metadata()
+    mid = meta['min_date'] + (meta['max_date'] - meta['min_date']) / 2
+    # Pays testé : de préférence un nom dont la partition Hive est encodée (Country=United%20Kingdom),
+    # pour vérifier que le filtre pays des moteurs Parquet retrouve la valeur décodée
+    country = next((c for c in meta['countries'] if quote(c) != c), meta['countries'][-1])
+    grid = list(itertools.product([meta['min_date'], mid.normalize()], [meta['max_date']],
+                                  ['Global', country], ['Inclure', 'Exclure', 'Neutraliser'], [0, 10, 50]))
+    mismatches = 0
+    for engine in engines:
+        backend = open_backend(engine, data_path)
+        engine_mismatches = 0
+        for filters in grid:
+            analysis_date = pd.Timestamp(filters[1]) + pd.Timedelta(days=1)
+            try:
+                pd.testing.assert_frame_equal(_comparable(reference.apply_filters(filters).reset_index(drop=True)),
+                                              _comparable(backend.apply_filters(filters).reset_index(drop=True)))
+                pd.testing.assert_frame_equal(_comparable(reference.invoice_cube(filters).reset_index(drop=True)),
+                                              _comparable(backend.invoice_cube(filters)))
+                pd.testing.assert_frame_equal(reference.calculate_rfm(filters, analysis_date).reset_index(drop=True),
+                                              backend.calculate_rfm(filters, analysis_date).reset_index(drop=True))
+                for freq in ('M', 'W', 'Q'):
+                    for a, b in zip(reference.calculate_cohort_retention(filters, freq),
+                                    backend.calculate_cohort_retention(filters, freq)):
+                        assert_equal = pd.testing.assert_frame_equal if isinstance(a, pd.DataFrame) \
+                            else pd.testing.assert_series_equal
+                        assert_equal(a, b)
+            except AssertionError as e:
+                engine_mismatches += 1
+                print(f"ÉCART {engine} {filters} : {str(e).splitlines()[0]}")
+        print(f"Parité {engine} : {len(grid) - engine_mismatches}/{len(grid)} jeux de filtres identiques "
+              f"(Global, {country})")
+        mismatches += engine_mismatches
+    return mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=50_000)
+    parser.add_argument('--data', default=None, help="CSV existant (sinon généré dans /tmp).")
+    parser.add_argument('--engines', nargs='+', default=['pandas', 'arrow', 'duckdb'],
+                        choices=['pandas', 'arrow', 'duckdb'])
+    parser.add_argument('--check', action='store_true', help="Vérifie la parité avec pandas avant de mesurer.")
+    parser.add_argument('--memory-limit-mb', type=int, default=0)
+    parser.add_argument('--run-engine', choices=['pandas', 'arrow', 'duckdb'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_engine:
+        run_engine(args.run_engine, args.data, args.memory_limit_mb)
+        sys.exit(0)
+
+    engines = [e for e in args.engines if e != 'duckdb' or importlib.util.find_spec('duckdb') is not None]
+    if len(engines) < len(args.engines):
+        print("duckdb non installé : moteur ignoré")
+
+    data_path = args.data or f'/tmp/synthetic_{args.rows}.csv'
+    if not os.path.exists(data_path):
+        from synthetic import write_csv
+        t0 = time.perf_counter()
+        write_csv(data_path, args.rows, n_customers=args.customers)
+        print(f"Génération : {args.rows:,} lignes en {time.perf_counter() - t0:.1f}s -> {data_path}")
+
+    from backends import ensure_transactions_dataset
+    t0 = time.perf_counter()
+    ensure_transactions_dataset(data_path)
+    print(f"Jeu Parquet : {time.perf_counter() - t0:.1f}s (réutilisé s'il est à jour)")
+
+    if args.check and check_parity(data_path, [e for e in engines if e != 'pandas']):
+        sys.exit(1)
+
+    for engine in engines:
+        res = measure(engine, data_path, args.memory_limit_mb)
+        if res['error']:
+            print(f"{engine:>7} | échec ({res['error']})")
+            continue
+        steps = ' | '.join(f"{k} {v:.2f}s" for k, v in res['timings'].items())
+        print(f"{engine:>7} | RSS max {res['peak_rss_mb']:>8.0f} Mo | {steps}")
@@ -0,0 +1,73 @@
+"""
+Benchmark : IncrementalRFMStore alimenté par de nombreux lots quotidiens (un lot par jour de factures).
+
+Mesure le temps moyen d'un update() sur les premiers et les derniers lots : il doit rester stable au fil
+de l'historique (comparaison aux seules factures des jours du lot), au lieu de croître avec le nombre de
+factures déjà vues. Chaque jour est coupé en deux lots pour exercer la déduplication d'une facture
+répartie sur deux lots. La RFM finale est comparée à calculate_rfm, sans fenêtre puis avec
+--window jours de factures conservés.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_incremental_batches.py
+    python benchmarks/bench_incremental_batches.py --rows 5000000 --customers 200000 --days 1095
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from utils import prepare_transactions, calculate_rfm  # noqa: E402
+from incremental import IncrementalRFMStore  # noqa: E402
+from synthetic import generate_transactions  # noqa: E402
+
+def daily_batches(df):
+    """Deux lots par jour ; la coupure tombe au milieu des lignes du jour, donc souvent dans une facture."""
+    days = df['TransactionDate'].to_numpy().astype('datetime64[D]')
+    bounds = np.flatnonzero(np.diff(days.view(np.int64))) + 1
+    for part in np.split(np.arange(len(df)), bounds):
+        half = len(part) // 2
+        yield df.iloc[part[:half]]
+        yield df.iloc[part[half:]]
+
+def run(df, window, analysis_date, reference):
+    store = IncrementalRFMStore(invoice_window_days=window)
+    timings = []
+    for batch in daily_batches(df):
+        t0 = time.perf_counter()
+        store.update(batch)
+        timings.append(time.perf_counter() - t0)
+    timings = np.array(timings)
+    decile = max(1, len(timings) // 10)
+    result = store.rfm(analysis_date)
+    same = (reference['Frequency'].to_numpy() == result['Frequency'].to_numpy()).all()
+    kept = sum(len(pairs) for pairs in store._invoices.values())
+    label = 'sans fenêtre' if window is None else f'fenêtre {window} j'
+    print(f"{label:>14} | {len(timings):,} lots en {timings.sum():>6.1f} s | "
+          f"premiers 10 % {timings[:decile].mean() * 1000:>6.1f} ms/lot | "
+          f"derniers 10 % {timings[-decile:].mean() * 1000:>6.1f} ms/lot | "
+          f"{kept:,} factures conservées | Frequency identique : {'oui' if same else 'NON'}")
+    return same
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=730, help="Période couverte (un lot par jour et par moitié).")
+    parser.add_argument('--window', type=int, default=7, help="Jours de factures conservés par le second passage.")
+    args = parser.parse_args()
+
+    start = pd.Timestamp('2010-01-01')
+    df = prepare_transactions(generate_transactions(args.rows, n_customers=args.customers, start=start,
+                                                    end=start + pd.Timedelta(days=args.days)))
+    df = df.sort_values('TransactionDate', kind='stable')
+    analysis_date = df['TransactionDate'].max() + pd.Timedelta(days=1)
+    reference = calculate_rfm(df, analysis_date)
+    print(f"{len(df):,} lignes, {df['InvoiceNo'].nunique():,} factures, {len(reference):,} clients")
+
+    ok = all([run(df, None, analysis_date, reference), run(df, args.window, analysis_date, reference)])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,49 @@
+"""
+Micro-benchmark : filtre « Seuil minimum commande » de apply_filters.
+
+Compare l'implémentation historique (groupby InvoiceNo + isin sur chaînes) au masque
+vectorisé sur codes entiers (invoice_threshold_mask), pour plusieurs seuils.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_invoice_threshold.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from utils import prepare_transactions, invoice_threshold_mask  # noqa: E402
+from synthetic import generate_transactions  # noqa: E402
+
+def legacy_threshold(df, min_order_val):
+    """Implémentation d'origine (référence)."""
+    invoice_totals = df.groupby('InvoiceNo', observed=True)['TotalSales'].sum()
+    valid_invoices = invoice_totals[invoice_totals >= min_order_val].index
+    return df[df['InvoiceNo'].isin(valid_invoices)].copy()
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - t0)
+    return min(timings), result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[10, 50, 100, 250, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = prepare_transactions(generate_transactions(args.rows, n_customers=50_000, lines_per_invoice=8))
+    print(f"{len(df):,} lignes, {df['InvoiceNo'].nunique():,} factures")
+    print(f"{'Seuil':>7} | {'Legacy (ms)':>11} | {'Codes (ms)':>10} | {'Speedup':>7} | Identique")
+    print('-' * 58)
+    for threshold in args.thresholds:
+        t_old, old = best_of(lambda: legacy_threshold(df, threshold), args.repeat)
+        t_new, new = best_of(lambda: df[invoice_threshold_mask(df, threshold)].copy(), args.repeat)
+        same = old.index.equals(new.index)
+        print(f"{threshold:>7.0f} | {t_old * 1e3:>11.1f} | {t_new * 1e3:>10.1f} | {t_old / t_new:>6.1f}x | {same}")
@@ -0,0 +1,102 @@
+"""
+Benchmark : empreinte mémoire du DataFrame de transactions, lecture par défaut vs préparation compacte.
+
+  - « défaut » : pd.read_csv sans option (toutes les colonnes, texte en object, int64 / float64) ;
+  - « compact » : load_and_prepare_data sans cache (colonnes utiles, catégoriels, float32 / int32).
+
+Le rapport par colonne (utils.memory_report) donne deux mesures « avant » : memory_usage(deep=True), qui
+compte chaque cellule texte comme une chaîne distincte, et la mémoire réellement occupée, où les chaînes
+répétées que partage le parseur CSV ne comptent qu'une fois. Chaque mode tourne aussi dans un sous-processus
+pour mesurer le RSS retenu après chargement (au-dessus du RSS après imports, après gc et restitution des
+blocs libres par malloc_trim) et le pic pendant le chargement. Objectif affiché : réduction d'au moins 3x.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_memory.py --data app/data/processed.csv
+    python benchmarks/bench_memory.py --rows 2000000
+"""
+import argparse
+import ctypes
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+from bench_suite import _reset_peak_rss, _status_kb  # noqa: E402
+
+TARGET_REDUCTION = 3.0
+
+def load(mode, data_path):
+    import pandas as pd
+    from utils import load_and_prepare_data
+    if mode == 'default':
+        return pd.read_csv(data_path)
+    return load_and_prepare_data(data_path, use_cache=False)
+
+def _release_free_memory():
+    # Rend au système les blocs libérés que glibc garde en réserve : le RSS reflète alors les données vivantes
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except OSError:
+        pass
+
+def run_mode(mode, data_path):
+    """Exécuté dans le sous-processus : RSS retenu et pic du chargement (Mo) en JSON."""
+    import pandas as pd  # noqa: F401 (imports hors mesure)
+    import utils  # noqa: F401
+    gc.collect()
+    _reset_peak_rss()
+    rss_before = _status_kb('VmRSS')
+    t0 = time.perf_counter()
+    df = load(mode, data_path)
+    seconds = time.perf_counter() - t0
+    gc.collect()
+    _release_free_memory()
+    print(json.dumps({'mode': mode, 'seconds': round(seconds, 3), 'rows': len(df),
+                      'resident_mb': round((_status_kb('VmRSS') - rss_before) / 1024, 1),
+                      'peak_mb': round((_status_kb('VmHWM') - rss_before) / 1024, 1)}))
+
+def measure(mode, data_path):
+    out = subprocess.run([sys.executable, __file__, '--run-mode', mode, '--data', data_path],
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--data', default=None, help="CSV existant (sinon généré dans /tmp).")
+    parser.add_argument('--run-mode', choices=['default', 'compact'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.data)
+        sys.exit(0)
+
+    data_path = args.data or f'/tmp/synthetic_{args.rows}.csv'
+    if not os.path.exists(data_path):
+        from synthetic import write_csv
+        write_csv(data_path, args.rows)
+
+    import pandas as pd
+    from utils import memory_report
+
+    report = memory_report(load('default', data_path), load('compact', data_path))
+    with pd.option_context('display.width', 120, 'display.float_format', '{:.2f}'.format):
+        print(report)
+
+    results = {mode: measure(mode, data_path) for mode in ('default', 'compact')}
+    for res in results.values():
+        print(f"{res['mode']:>8} | {res['rows']:>10,} lignes | {res['seconds']:>7.2f} s | "
+              f"résident {res['resident_mb']:>8.1f} Mo | pic {res['peak_mb']:>8.1f} Mo")
+
+    total = report.loc['Total']
+    resident = results['default']['resident_mb'] / max(results['compact']['resident_mb'], 0.1)
+    for label, factor in [('memory_usage deep', total['réduction']),
+                          ('chaînes partagées comptées une fois', total['réduction_partagé']),
+                          ('RSS retenu', resident)]:
+        status = 'atteint' if factor >= TARGET_REDUCTION else 'non atteint'
+        print(f"Réduction x{factor:.1f} ({label}) : objectif x{TARGET_REDUCTION:.0f} {status}")
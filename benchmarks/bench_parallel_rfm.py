@@ -0,0 +1,43 @@
+"""
+Benchmark de passage à l'échelle : calculate_rfm_parallel pour 1/2/4/8/16 workers vs calculate_rfm.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_parallel_rfm.py --rows 10000000 --customers 500000
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from utils import prepare_transactions, calculate_rfm  # noqa: E402
+from parallel import calculate_rfm_parallel  # noqa: E402
+from synthetic import generate_transactions  # noqa: E402
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--customers', type=int, default=500_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    df = prepare_transactions(generate_transactions(args.rows, n_customers=args.customers))
+    analysis_date = df['TransactionDate'].max() + pd.Timedelta(days=1)
+    print(f"{len(df):,} lignes, {df['CustomerID'].nunique():,} clients, {os.cpu_count()} CPU")
+
+    t0 = time.perf_counter()
+    reference = calculate_rfm(df, analysis_date)
+    t_ref = time.perf_counter() - t0
+    print(f"{'calculate_rfm':>15} | {t_ref:>7.2f} s")
+
+    print(f"{'Workers':>15} | {'Temps':>9} | {'Speedup':>7} | Identique")
+    for n_workers in args.workers:
+        t0 = time.perf_counter()
+        # min_rows_per_worker=0 : mesure le chemin multi-processus même sous le seuil de repli
+        result = calculate_rfm_parallel(df, analysis_date, n_workers=n_workers, min_rows_per_worker=0)
+        elapsed = time.perf_counter() - t0
+        same = result.reset_index(drop=True).equals(reference.reset_index(drop=True))
+        print(f"{n_workers:>15} | {elapsed:>7.2f} s | {t_ref / elapsed:>6.2f}x | {same}")
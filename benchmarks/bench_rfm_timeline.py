@@ -0,0 +1,73 @@
+"""
+Benchmark : RFM à chaque instantané (migrations de segments) en une passe vs un calculate_rfm par date.
+
+Le jeu synthétique est réduit au cube facture (mode Exclure), comme dans l'application. La référence
+filtre les transactions antérieures à chaque date puis appelle calculate_rfm ; elle n'est chronométrée
+que sur --reference-snapshots dates réparties sur la plage, puis extrapolée au nombre total d'instantanés.
+Sur ces mêmes dates, les segments produits par timeline.rfm_snapshots sont comparés à la référence.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_rfm_timeline.py
+    python benchmarks/bench_rfm_timeline.py --customers 1000000 --rows 6000000 --freq W
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from utils import prepare_transactions, build_invoice_cube, calculate_rfm  # noqa: E402
+from timeline import snapshot_dates, rfm_snapshots, segment_migrations  # noqa: E402
+from synthetic import generate_transactions  # noqa: E402
+
+def reference_rfm(cube, date):
+    return calculate_rfm(cube[cube['TransactionDate'] < date], date)
+
+def run(rows, customers, start, end, freq, reference_snapshots):
+    t0 = time.perf_counter()
+    df = prepare_transactions(generate_transactions(rows, n_customers=customers, start=start, end=end,
+                                                    lines_per_invoice=2))
+    cube = build_invoice_cube(df[~df['is_return']])
+    del df
+    dates = snapshot_dates(start, end, freq)
+    print(f"Données : {len(cube):,} factures, {cube['CustomerID'].nunique():,} clients, "
+          f"{len(dates)} instantanés ({freq}) en {time.perf_counter() - t0:.1f}s")
+
+    t0 = time.perf_counter()
+    counts, transitions = segment_migrations(cube, dates)
+    t_timeline = time.perf_counter() - t0
+
+    sample = dates[np.unique(np.linspace(0, len(dates) - 1, reference_snapshots).round().astype(int))]
+    t_reference, mismatches = 0.0, 0
+    snapshots = dict(snap for snap in rfm_snapshots(cube, dates) if snap[0] in sample)
+    for date in sample:
+        t0 = time.perf_counter()
+        expected = reference_rfm(cube, date)
+        t_reference += time.perf_counter() - t0
+        got = snapshots[date]
+        same = (len(expected) == len(got)
+                and (expected['CustomerID'].to_numpy() == got['CustomerID'].to_numpy()).all()
+                and (expected['Segment_RFM'].astype(str).to_numpy() == got['Segment_RFM'].astype(str).to_numpy()).all())
+        mismatches += not same
+    t_reference *= len(dates) / len(sample)
+
+    print(f"Une passe (timeline)         : {t_timeline:>8.2f} s ({t_timeline / len(dates) * 1000:.0f} ms / instantané)")
+    print(f"calculate_rfm par instantané : {t_reference:>8.2f} s (extrapolé depuis {len(sample)} dates)")
+    print(f"Accélération x{t_reference / t_timeline:.1f} ; segments identiques sur "
+          f"{len(sample) - mismatches}/{len(sample)} dates ; {len(transitions):,} transitions non vides")
+    return mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--start', default='2009-01-01')
+    parser.add_argument('--end', default='2011-12-31')
+    parser.add_argument('--freq', choices=['M', 'W', 'Q'], default='W')
+    parser.add_argument('--reference-snapshots', type=int, default=8,
+                        help="Nombre de dates où la référence calculate_rfm est chronométrée et comparée.")
+    args = parser.parse_args()
+    sys.exit(1 if run(args.rows, args.customers, args.start, args.end, args.freq, args.reference_snapshots) else 0)
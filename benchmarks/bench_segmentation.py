@@ -0,0 +1,74 @@
+"""
+Benchmark : segmentation RFM vectorisée (table 5x5x5) vs apply ligne à ligne historique.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_segmentation.py
+    python benchmarks/bench_segmentation.py --sizes 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from utils import assign_segments  # noqa: E402
+
+
+def legacy_segment_label(row):
+    """Copie conforme de l'implémentation d'origine de calculate_rfm (référence)."""
+    try:
+        r, f, m = int(row['R_Score']), int(row['F_Score']), int(row['M_Score'])
+    except:  # noqa: E722
+        return 'Inconnu', 6
+
+    if r >= 5 and f >= 5 and m >= 5: return 'Champions', 1
+    if r >= 4 and f >= 4: return 'Fidèles', 2
+    if r >= 4 and f <= 2: return 'Nouveaux Prometteurs', 3
+    if r <= 2 and f >= 4: return 'À Risque (Haute Valeur)', 4
+    if r <= 2 and f <= 2: return 'Perdus / Dormants', 6
+    if m >= 4: return 'Gros Dépensiers (Risque)', 3
+    return 'Potentiels', 5
+
+
+def make_scores(n_customers, seed=0):
+    """Scores R/F/M catégoriels, comme produits par pd.qcut dans calculate_rfm."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'R_Score': pd.Categorical(rng.integers(1, 6, n_customers), categories=[5, 4, 3, 2, 1]),
+        'F_Score': pd.Categorical(rng.integers(1, 6, n_customers), categories=[1, 2, 3, 4, 5]),
+        'M_Score': pd.Categorical(rng.integers(1, 6, n_customers), categories=[1, 2, 3, 4, 5]),
+    })
+    return df
+
+
+def run(sizes, legacy_max):
+    print(f"{'Clients':>10} | {'Legacy (s)':>10} | {'Vectorisé (s)':>13} | {'Speedup':>8} | Identique")
+    print('-' * 62)
+    for n in sizes:
+        df = make_scores(n)
+
+        t0 = time.perf_counter()
+        segments, priorities = assign_segments(df['R_Score'], df['F_Score'], df['M_Score'])
+        t_new = time.perf_counter() - t0
+
+        if n <= legacy_max:
+            t0 = time.perf_counter()
+            legacy = df.apply(lambda x: pd.Series(legacy_segment_label(x)), axis=1)
+            t_old = time.perf_counter() - t0
+            same = (segments.astype(str).tolist() == legacy[0].tolist()
+                    and priorities.astype(int).tolist() == legacy[1].astype(int).tolist())
+            print(f"{n:>10,} | {t_old:>10.3f} | {t_new:>13.4f} | {t_old / t_new:>7.0f}x | {same}")
+        else:
+            print(f"{n:>10,} | {'(ignoré)':>10} | {t_new:>13.4f} | {'-':>8} | -")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max', type=int, default=1_000_000,
+                        help="Taille max pour laquelle l'implémentation historique est chronométrée.")
+    args = parser.parse_args()
+    run(args.sizes, args.legacy_max)
@@ -0,0 +1,67 @@
+"""
+Benchmark : scoring RFM exact (qcut + rank) vs seuils lus dans des sketchs fusionnables
+(histogrammes exacts pour Recency / Frequency, sketch de quantiles pour Monetary).
+
+Mesure la vitesse (sketch construit à la volée, ou précalculé par pays puis fusionné) et la
+précision : part des clients avec un score identique au scoring exact, et écart de 1 point au plus.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_sketch_scoring.py --customers 1000000 --accuracy 0.01
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from utils import score_rfm  # noqa: E402
+from sketches import build_rfm_sketches, build_rfm_sketches_by, merge_rfm_sketches, rfm_cutpoints  # noqa: E402
+
+def make_rfm_table(n_customers, n_countries=10, seed=0):
+    """Table client agrégée synthétique aux distributions proches d'Online Retail II."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CustomerID': np.arange(n_customers),
+        'Recency': rng.integers(1, 740, n_customers),
+        'Frequency': rng.geometric(0.25, n_customers),
+        'Monetary': np.round(rng.lognormal(6.5, 1.2, n_customers), 2),
+        'Country': rng.integers(0, n_countries, n_customers),
+    })
+
+def timed(func):
+    t0 = time.perf_counter()
+    result = func()
+    return time.perf_counter() - t0, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--accuracy', type=float, default=0.01, help="Précision relative du sketch Monetary.")
+    args = parser.parse_args()
+
+    for n in args.customers:
+        rfm = make_rfm_table(n)
+        t_exact, exact = timed(lambda: score_rfm(rfm))
+
+        # Sketch construit à la volée sur la table (une passe, pas de tri)
+        t_sketch, approx = timed(lambda: score_rfm(rfm, cutpoints=rfm_cutpoints(build_rfm_sketches(rfm, args.accuracy))))
+
+        # Sketchs précalculés par pays : seul le coût de fusion + scoring est payé au rerun
+        by_country = build_rfm_sketches_by(dict(tuple(rfm.groupby('Country'))), args.accuracy)
+        t_merge, merged = timed(lambda: score_rfm(rfm, cutpoints=rfm_cutpoints(merge_rfm_sketches(by_country.values()))))
+
+        print(f"\n{n:,} clients | précision relative {args.accuracy:.1%}")
+        print(f"  exact (qcut)      : {t_exact * 1e3:8.1f} ms")
+        print(f"  sketch à la volée : {t_sketch * 1e3:8.1f} ms ({t_exact / t_sketch:.1f}x)")
+        print(f"  sketchs fusionnés : {t_merge * 1e3:8.1f} ms ({t_exact / t_merge:.1f}x)")
+        for col in ['R_Score', 'F_Score', 'M_Score', 'Segment_RFM']:
+            same = (exact[col].astype(str).to_numpy() == merged[col].astype(str).to_numpy()).mean()
+            line = f"  {col:<11}: {same:6.1%} identiques"
+            if col != 'Segment_RFM':
+                gap = np.abs(exact[col].astype(int).to_numpy() - merged[col].astype(int).to_numpy())
+                line += f", {(gap <= 1).mean():6.1%} à ±1"
+            print(line)
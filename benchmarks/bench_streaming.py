@@ -0,0 +1,88 @@
+"""
+Benchmark : ingestion en flux (CSV par morceaux -> agrégats RFM/cohortes) vs chargement complet.
+
+Chaque mode tourne dans un sous-processus pour mesurer sa mémoire crête (RSS max) isolément.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_streaming.py --rows 50000000
+    python benchmarks/bench_streaming.py --rows 2000000 --full   # compare au chemin pandas complet
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+FILTERS = dict(start_date='2009-12-01', end_date='2011-12-09', country_filter='Global',
+               returns_mode='Exclure', min_order_val=0)
+
+def _peak_rss_mb():
+    # VmHWM est propre au processus ; ru_maxrss (en Ko sous Linux) hérite du parent après fork/exec
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_mode(mode, data_path, chunksize):
+    """Exécuté dans le sous-processus : calcule RFM + cohortes et imprime un JSON de mesures."""
+    import pandas as pd
+    from utils import load_and_prepare_data, apply_filters, calculate_rfm, calculate_cohort_retention
+    from incremental import stream_csv_to_store
+
+    analysis_date = pd.Timestamp(FILTERS['end_date']) + pd.Timedelta(days=1)
+    t0 = time.perf_counter()
+    if mode == 'stream':
+        store = stream_csv_to_store(data_path, chunksize=chunksize, **FILTERS)
+        rfm = store.rfm(analysis_date)
+        store.cohorts()
+    else:
+        df = load_and_prepare_data(data_path, use_cache=False)
+        df_filtered = apply_filters(df, *FILTERS.values())
+        rfm = calculate_rfm(df_filtered, analysis_date)
+        calculate_cohort_retention(df_filtered)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({'mode': mode, 'seconds': round(elapsed, 2), 'peak_rss_mb': round(_peak_rss_mb(), 1),
+                      'customers': len(rfm)}))
+
+def measure(mode, data_path, chunksize):
+    out = subprocess.run([sys.executable, __file__, '--run-mode', mode, '--data', data_path,
+                          '--chunksize', str(chunksize)], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--data', default=None, help="CSV existant (sinon généré dans /tmp).")
+    parser.add_argument('--full', action='store_true', help="Mesure aussi le chargement pandas complet.")
+    parser.add_argument('--run-mode', choices=['stream', 'full'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.data, args.chunksize)
+        sys.exit(0)
+
+    data_path = args.data or f'/tmp/synthetic_{args.rows}.csv'
+    if not os.path.exists(data_path):
+        from synthetic import write_csv
+        t0 = time.perf_counter()
+        write_csv(data_path, args.rows, n_customers=args.customers)
+        print(f"Génération : {args.rows:,} lignes en {time.perf_counter() - t0:.1f}s -> {data_path}")
+    size_mb = os.path.getsize(data_path) / 1024 ** 2
+    print(f"Fichier : {size_mb:,.0f} Mo, morceaux de {args.chunksize:,} lignes")
+
+    modes = ['stream'] + (['full'] if args.full else [])
+    for mode in modes:
+        res = measure(mode, data_path, args.chunksize)
+        print(f"{res['mode']:>7} | {res['seconds']:>8.1f} s | RSS max {res['peak_rss_mb']:>8.0f} Mo | "
+              f"{res['customers']:,} clients")
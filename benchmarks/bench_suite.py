@@ -0,0 +1,231 @@
+"""
+Suite de benchmarks : temps et mémoire crête de chaque étape de utils.py, de 10k à 50M lignes.
+
+Pour chaque taille, un CSV synthétique (synthetic.py) est généré puis réutilisé, et un sous-processus
+dédié mesure successivement :
+  - load_and_prepare_data (sans cache Parquet : lecture CSV + préparation) ;
+  - apply_filters dans chaque mode de retours (Inclure, Exclure, Neutraliser) ;
+  - calculate_rfm, calculate_cohort_retention et run_scenario_simulation (sur le mode Exclure).
+
+Le jeu se règle par --customers, --invoices, --countries, --return-rate, --start et --end (transmis à
+synthetic.write_csv ; valeurs par défaut du générateur sinon).
+
+Temps : meilleur de --repeat exécutions. Mémoire : pic de RSS pendant l'étape au-dessus du RSS de départ
+(VmHWM remis à zéro via /proc/self/clear_refs), ou pic tracemalloc si le noyau ne le permet pas.
+
+Les résultats sont écrits en JSON (--output). Avec --baseline, chaque mesure est comparée à une exécution
+enregistrée (--save-baseline) : une hausse au-delà de --tolerance est signalée et le code de sortie vaut 1.
+
+Usage (depuis la racine du projet) :
+    python benchmarks/bench_suite.py --sizes 10000 100000 1000000 --output /tmp/bench.json
+    python benchmarks/bench_suite.py --sizes 10000 100000 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_suite.py --sizes 10000 100000 --baseline benchmarks/baseline.json --tolerance 0.25
+    python benchmarks/bench_suite.py --sizes 1000000 --invoices 20000 --countries 20 --return-rate 0.1 \
+        --start 2010-01-01 --end 2010-12-31
+"""
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+RETURNS_MODES = ['Inclure', 'Exclure', 'Neutraliser']
+# Paramètres par défaut de l'application (barre latérale et simulateur)
+SCENARIO = dict(retention_r=0.6, discount_d=0.1, margin_pct=0.3, discount_pct=0.1)
+# En deçà de ces écarts absolus, une hausse relative n'est pas signalée (bruit de mesure sur les petites tailles)
+MIN_DELTA = {'seconds': 0.01, 'peak_mb': 5.0}
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+def _reset_peak_rss():
+    """Remet VmHWM au RSS courant (Linux >= 4.0). Retourne False si indisponible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        _status_kb('VmHWM')
+        return True
+    except (OSError, KeyError):
+        return False
+
+def measure(func, *args, repeat=1, **kwargs):
+    """Exécute `func` : (résultat, meilleur temps en s, pic mémoire en Mo au-dessus du départ, méthode)."""
+    if _reset_peak_rss():
+        rss_before = _status_kb('VmRSS')
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = time.perf_counter() - t0
+        peak_mb, method = max(0, _status_kb('VmHWM') - rss_before) / 1024, 'rss'
+    else:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = time.perf_counter() - t0
+        peak_mb, method = tracemalloc.get_traced_memory()[1] / 1024 ** 2, 'tracemalloc'
+        tracemalloc.stop()
+    for _ in range(repeat - 1):
+        del result
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return result, best, peak_mb, method
+
+def run_size(data_path, rows, repeat):
+    """Exécuté dans le sous-processus : mesure chaque étape et imprime la liste des mesures en JSON."""
+    import pandas as pd
+    from utils import (load_and_prepare_data, apply_filters, calculate_rfm, calculate_cohort_retention,
+                       run_scenario_simulation, GLOBAL_SCENARIO)
+
+    results = []
+
+    def record(function, func, *args, mode=None, **kwargs):
+        result, seconds, peak_mb, method = measure(func, *args, repeat=repeat, **kwargs)
+        results.append({'rows': rows, 'function': function, 'mode': mode, 'seconds': round(seconds, 4),
+                        'peak_mb': round(peak_mb, 1), 'memory_method': method})
+        return result
+
+    df = record('load_and_prepare_data', load_and_prepare_data, data_path, use_cache=False)
+    start, end = df['TransactionDate'].min(), df['TransactionDate'].max()
+    filtered = {mode: record('apply_filters', apply_filters, df, start, end, 'Global', mode, 0, mode=mode)
+                for mode in RETURNS_MODES}
+    df_filtered = filtered['Exclure']
+    del filtered
+    analysis_date = pd.Timestamp(end) + pd.Timedelta(days=1)
+    df_rfm = record('calculate_rfm', calculate_rfm, df_filtered, analysis_date)
+    record('calculate_cohort_retention', calculate_cohort_retention, df_filtered)
+    record('run_scenario_simulation', run_scenario_simulation, df_filtered, df_rfm, SCENARIO['retention_r'],
+           SCENARIO['discount_d'], SCENARIO['margin_pct'], GLOBAL_SCENARIO, SCENARIO['discount_pct'], None)
+    print(json.dumps(results))
+
+def measure_size(data_path, rows, repeat):
+    out = subprocess.run([sys.executable, __file__, '--run-size', str(rows), '--data', data_path,
+                          '--repeat', str(repeat)], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def synthetic_csv(workdir, rows, customers, seed, **data_options):
+    """
+    CSV synthétique de `rows` lignes, généré au premier appel puis réutilisé. `data_options` (n_invoices,
+    n_countries, return_rate, start, end) sont transmis à synthetic.write_csv et entrent dans le nom du fichier.
+    """
+    data_options = {key: value for key, value in data_options.items() if value is not None}
+    suffix = ''
+    if data_options:
+        suffix = '_' + hashlib.sha1(json.dumps(data_options, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    path = os.path.join(workdir, f'synthetic_{rows}_{customers}_{seed}{suffix}.csv')
+    if not os.path.exists(path):
+        from synthetic import write_csv
+        os.makedirs(workdir, exist_ok=True)
+        t0 = time.perf_counter()
+        write_csv(path + '.tmp', rows, seed=seed, n_customers=customers, **data_options)
+        os.replace(path + '.tmp', path)
+        print(f"Génération : {rows:,} lignes en {time.perf_counter() - t0:.1f}s -> {path}")
+    return path
+
+def customers_for(rows):
+    # Online Retail II : ~1M lignes pour ~6k clients ; on garde un ordre de grandeur comparable
+    return max(1_000, rows // 200)
+
+def _key(result):
+    return (result['rows'], result['function'], result['mode'])
+
+def compare(results, baseline, tolerance):
+    """Mesures en hausse de plus de `tolerance` (relative) par rapport à la référence."""
+    reference = {_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        ref = reference.get(_key(result))
+        if ref is None:
+            continue
+        for metric, min_delta in MIN_DELTA.items():
+            before, after = ref[metric], result[metric]
+            if after - before > min_delta and after > before * (1 + tolerance):
+                regressions.append(dict(result, metric=metric, baseline=before, current=after,
+                                        ratio=round(after / before, 2) if before else None))
+    return regressions
+
+def environment():
+    import numpy as np
+    import pandas as pd
+    return {'date': dt.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+def _write_json(path, payload):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Nombres de lignes (ex. 10000 100000 1000000 10000000 50000000).")
+    parser.add_argument('--customers', type=int, default=None,
+                        help="Nombre de clients (défaut : proportionnel à la taille, 1 000 minimum).")
+    parser.add_argument('--invoices', type=int, default=None,
+                        help="Nombre total de factures par jeu (défaut : une facture pour 20 lignes).")
+    parser.add_argument('--countries', type=int, default=None, help="Nombre de pays (défaut de synthetic.py : 10).")
+    parser.add_argument('--return-rate', type=float, default=None,
+                        help="Part des factures annulées (défaut de synthetic.py : 0.02).")
+    parser.add_argument('--start', default=None, help="Début de la période (défaut de synthetic.py : 2009-12-01).")
+    parser.add_argument('--end', default=None, help="Fin de la période (défaut de synthetic.py : 2011-12-09).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default='/tmp/bench_suite', help="Dossier des CSV générés.")
+    parser.add_argument('--output', default=None, help="Fichier JSON des résultats.")
+    parser.add_argument('--baseline', default=None, help="Résultats de référence à comparer.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Hausse relative tolérée (0.25 = +25 %%).")
+    parser.add_argument('--save-baseline', default=None, help="Enregistre ces résultats comme référence.")
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        run_size(args.data, args.run_size, args.repeat)
+        sys.exit(0)
+
+    data_options = {'n_invoices': args.invoices, 'n_countries': args.countries, 'return_rate': args.return_rate,
+                    'start': args.start, 'end': args.end}
+    results = []
+    for rows in args.sizes:
+        data_path = synthetic_csv(args.workdir, rows, args.customers or customers_for(rows), args.seed, **data_options)
+        for res in measure_size(data_path, rows, args.repeat):
+            results.append(res)
+            label = res['function'] + (f" ({res['mode']})" if res['mode'] else '')
+            print(f"{rows:>11,} | {label:<38} | {res['seconds']:>9.3f} s | pic {res['peak_mb']:>8.1f} Mo")
+
+    data = {key: value for key, value in data_options.items() if value is not None}
+    payload = {'environment': environment(), 'repeat': args.repeat, 'data': data, 'results': results}
+    if args.output:
+        _write_json(args.output, payload)
+    if args.save_baseline:
+        _write_json(args.save_baseline, payload)
+        print(f"Référence enregistrée : {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('data', {}) != data:
+            print(f"Attention : jeux de données différents de la référence ({baseline.get('data', {})} vs {data})")
+        regressions = compare(results, baseline, args.tolerance)
+        payload['regressions'] = regressions
+        if args.output:
+            _write_json(args.output, payload)
+        for reg in regressions:
+            label = reg['function'] + (f" ({reg['mode']})" if reg['mode'] else '')
+            print(f"RÉGRESSION {reg['rows']:>11,} | {label:<38} | {reg['metric']} "
+                  f"{reg['baseline']} -> {reg['current']} (x{reg['ratio']})")
+        if not regressions:
+            print(f"Aucune régression au-delà de {args.tolerance:.0%} par rapport à {args.baseline}")
+        sys.exit(1 if regressions else 0)
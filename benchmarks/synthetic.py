@@ -0,0 +1,106 @@
+"""
+Générateur de transactions synthétiques au format Online Retail II (voir DATA_DICTIONNARY.md).
+
+Colonnes produites (noms du CSV nettoyé par le notebook) :
+    Invoice, StockCode, Description, Quantity, InvoiceDate, Price, Customer ID, Country, TotalAmount
+
+Usage :
+    python benchmarks/synthetic.py --rows 1000000 --output /tmp/synthetic.csv
+    python benchmarks/synthetic.py --rows 1000000 --customers 20000 --invoices 40000 --countries 20 \
+        --return-rate 0.05 --start 2010-01-01 --end 2011-12-31 --output /tmp/synthetic.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+COUNTRIES = ['United Kingdom', 'Germany', 'France', 'EIRE', 'Spain', 'Netherlands', 'Belgium',
+             'Switzerland', 'Portugal', 'Australia', 'Norway', 'Italy', 'Channel Islands',
+             'Finland', 'Cyprus', 'Sweden', 'Austria', 'Denmark', 'Japan', 'Poland']
+
+def generate_transactions(n_rows, n_customers=5_000, n_countries=10, return_rate=0.02,
+                          start='2009-12-01', end='2011-12-09', lines_per_invoice=20,
+                          missing_customer_rate=0.0, seed=0, invoice_offset=0, n_invoices=None):
+    """
+    Génère `n_rows` lignes de factures. Les lignes d'une facture sont contiguës et partagent
+    client, date, pays et statut d'annulation (préfixe 'C', quantités négatives).
+    Le nombre de factures vaut `n_invoices` s'il est fourni, sinon n_rows // lines_per_invoice.
+    """
+    rng = np.random.default_rng(seed)
+    n_invoices = max(1, min(n_rows, n_invoices) if n_invoices else n_rows // lines_per_invoice)
+
+    # Attributs par facture
+    start_ts, end_ts = pd.Timestamp(start), pd.Timestamp(end)
+    span_minutes = max(1, int((end_ts - start_ts).total_seconds() // 60))
+    inv_customer = rng.integers(12_000, 12_000 + n_customers, n_invoices)
+    # Pays stable par client
+    countries = np.array((COUNTRIES * (n_countries // len(COUNTRIES) + 1))[:n_countries])
+    inv_country = countries[inv_customer % n_countries]
+    inv_date = start_ts + pd.to_timedelta(rng.integers(0, span_minutes, n_invoices), unit='min')
+    inv_return = rng.random(n_invoices) < return_rate
+    inv_number = np.arange(invoice_offset, invoice_offset + n_invoices) + 489_000
+    inv_label = np.where(inv_return, 'C', '') + inv_number.astype(str)
+
+    # Lignes : rattachées aux factures dans l'ordre
+    line_invoice = np.sort(rng.integers(0, n_invoices, n_rows))
+    stock = rng.integers(10_000, 90_000, n_rows)
+    quantity = rng.integers(1, 25, n_rows) * np.where(inv_return[line_invoice], -1, 1)
+    price = np.round(rng.gamma(2.0, 1.8, n_rows) + 0.1, 2)
+    customer = inv_customer[line_invoice].astype('float64')
+    if missing_customer_rate > 0:
+        customer[rng.random(n_rows) < missing_customer_rate] = np.nan
+
+    df = pd.DataFrame({
+        'Invoice': inv_label[line_invoice],
+        'StockCode': stock.astype(str),
+        'Description': pd.Categorical.from_codes(stock % 500, [f'PRODUCT {i}' for i in range(500)]),
+        'Quantity': quantity,
+        'InvoiceDate': inv_date[line_invoice],
+        'Price': price,
+        'Customer ID': customer,
+        'Country': inv_country[line_invoice],
+    })
+    df['TotalAmount'] = np.round(df['Quantity'] * df['Price'], 2)
+    return df
+
+def write_csv(path, n_rows, chunk_rows=1_000_000, seed=0, n_invoices=None, **kwargs):
+    """
+    Écrit un CSV de `n_rows` lignes par morceaux (mémoire bornée par `chunk_rows`).
+    `n_invoices` (total) est réparti entre les morceaux au prorata de leurs lignes.
+    """
+    lines_per_invoice = kwargs.get('lines_per_invoice', 20)
+    written, part, invoices_written = 0, 0, 0
+    if os.path.exists(path):
+        os.remove(path)
+    while written < n_rows:
+        rows = min(chunk_rows, n_rows - written)
+        if n_invoices:
+            chunk_invoices = max(1, n_invoices * (written + rows) // n_rows - invoices_written)
+            offset = invoices_written
+        else:
+            chunk_invoices, offset = None, written // lines_per_invoice + part
+        df = generate_transactions(rows, seed=seed + part, invoice_offset=offset, n_invoices=chunk_invoices,
+                                   **kwargs)
+        df.to_csv(path, mode='a', header=(part == 0), index=False)
+        invoices_written += chunk_invoices or 0
+        written += rows
+        part += 1
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=5_000)
+    parser.add_argument('--invoices', type=int, default=None,
+                        help="Nombre total de factures (défaut : une facture pour 20 lignes).")
+    parser.add_argument('--countries', type=int, default=10)
+    parser.add_argument('--return-rate', type=float, default=0.02)
+    parser.add_argument('--start', default='2009-12-01')
+    parser.add_argument('--end', default='2011-12-09')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    write_csv(args.output, args.rows, seed=args.seed, n_customers=args.customers, n_invoices=args.invoices,
+              n_countries=args.countries, return_rate=args.return_rate, start=args.start, end=args.end)
+    print(f"{args.rows:,} lignes écrites dans {args.output}")